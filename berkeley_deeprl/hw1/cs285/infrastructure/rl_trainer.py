@@ -1,5 +1,6 @@
 from collections import OrderedDict
 import numpy as np
+import os
 import time
 
 import gym
@@ -8,6 +9,7 @@ import torch
 from cs285.infrastructure import pytorch_util as ptu
 from cs285.infrastructure.logger import Logger
 from cs285.infrastructure import utils
+from cs285.infrastructure import profiling
 
 # how many rollouts to save as videos to tensorboard
 MAX_NVIDEO = 2
@@ -70,6 +72,17 @@ class RL_Trainer(object):
         agent_class = self.params['agent_class']
         self.agent = agent_class(self.env, self.params['agent_params'])
 
+        #############
+        ## PROFILING
+        #############
+
+        # Phase timers, and a cProfile dump of a window of iterations
+        profiling.init_profiling(self.params.get('profile_phases', False))
+        self.cprofile_window = profiling.CProfileWindow(
+            self.params.get('cprofile_start_itr', -1),
+            self.params.get('cprofile_num_itrs', 1),
+            os.path.join(self.params['logdir'], 'cprofile.prof'))
+
     def run_training_loop(self, n_iter, collect_policy, eval_policy,
                           initial_expertdata=None, relabel_with_expert=False,
                           start_relabel_with_expert=1, expert_policy=None):
@@ -89,6 +102,7 @@ class RL_Trainer(object):
 
         for itr in range(n_iter):
             print("\n\n********** Iteration %i ************" % itr)
+            self.cprofile_window.step(itr)
 
             # decide if videos should be rendered/logged at this iteration
             if itr % self.params['video_log_freq'] == 0 and self.params['video_log_freq'] != -1:
@@ -103,38 +117,63 @@ class RL_Trainer(object):
                 self.log_metrics = False
 
             # collect trajectories, to be used for training
-            training_returns = self.collect_training_trajectories(
-                itr,
-                initial_expertdata,
-                collect_policy,
-                self.params['batch_size']
-            )  # HW1: implement this function below
+            with profiling.phase('collect'):
+                training_returns = self.collect_training_trajectories(
+                    itr,
+                    initial_expertdata,
+                    collect_policy,
+                    self.params['batch_size']
+                )  # HW1: implement this function below
             paths, envsteps_this_batch, train_video_paths = training_returns
             self.total_envsteps += envsteps_this_batch
+            profiling.count('EnvSteps', envsteps_this_batch)
 
             # relabel the collected obs with actions from a provided expert policy
             if relabel_with_expert and itr >= start_relabel_with_expert:
                 # HW1: implement this function below
-                paths = self.do_relabel_with_expert(expert_policy, paths)
+                with profiling.phase('relabel'):
+                    paths = self.do_relabel_with_expert(expert_policy, paths)
 
             # add collected data to replay buffer
-            self.agent.add_to_replay_buffer(paths)
+            with profiling.phase('replay_insert'):
+                self.agent.add_to_replay_buffer(paths)
 
             # train agent (using sampled data from replay buffer)
-            training_logs = self.train_agent()  # HW1: implement this function below
+            with profiling.phase('train'):
+                training_logs = self.train_agent()  # HW1: implement this function below
 
             # log/save
             if self.log_video or self.log_metrics:
 
                 # perform logging
                 print('\nBeginning logging procedure...')
-                self.perform_logging(
-                    itr, paths, eval_policy, train_video_paths, training_logs)
+                with profiling.phase('logging'):
+                    self.perform_logging(
+                        itr, paths, eval_policy, train_video_paths, training_logs)
 
                 if self.params['save_params']:
                     print('\nSaving agent params')
-                    self.agent.save(
-                        '{}/policy_itr_{}.pt'.format(self.params['logdir'], itr))
+                    with profiling.phase('save'):
+                        self.agent.save(
+                            '{}/policy_itr_{}.pt'.format(self.params['logdir'], itr))
+
+            self.log_profiling(itr)
+
+        self.cprofile_window.close()
+
+    def log_profiling(self, itr):
+        """
+        Logs the phase timers and throughputs every profile_log_freq
+        iterations (scalar_log_freq by default), when profiling is enabled.
+        """
+        if not profiling.enabled:
+            return
+        log_freq = self.params.get('profile_log_freq') or self.params['scalar_log_freq']
+        if log_freq <= 0 or itr % log_freq != 0:
+            return
+        for key, value in profiling.get_logs().items():
+            self.logger.log_scalar(value, key, itr)
+        self.logger.flush()
 
     ####################################
     ####################################
@@ -169,8 +208,9 @@ class RL_Trainer(object):
         # HINT2: you want each of these collected rollouts to be of length self.params['ep_len']
         print("\nCollecting data to be used for training...")
         # paths, envsteps_this_batch = TODO #OK
-        paths, envsteps_this_batch = utils.sample_trajectories(
-            self.env, collect_policy, self.params['batch_size'], MAX_VIDEO_LEN)
+        with profiling.phase('sample_trajectories'):
+            paths, envsteps_this_batch = utils.sample_trajectories(
+                self.env, collect_policy, self.params['batch_size'], MAX_VIDEO_LEN)
 
         # collect more rollouts with the same policy, to be saved as videos in tensorboard
         # note: here, we collect MAX_NVIDEO rollouts, each of length MAX_VIDEO_LEN
@@ -190,21 +230,28 @@ class RL_Trainer(object):
             # TODO sample some data from the data buffer
             # HINT1: use the agent's sample function
             # HINT2: how much data = self.params['train_batch_size']
-            ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch = TODO
+            with profiling.phase('sample'):
+                ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch = TODO
+            profiling.count('Samples', len(ob_batch))
 
             # TODO use the sampled data to train an agent
             # HINT: use the agent's train function
             # HINT: keep the agent's training log for debugging
-            train_log = TODO
+            with profiling.phase('update'):
+                train_log = TODO
+            profiling.count('GradientSteps')
             all_logs.append(train_log)
         return all_logs
 
     def do_relabel_with_expert(self, expert_policy, paths):
         print("\nRelabelling collected observations with labels from an expert policy...")
 
-        # TODO relabel collected obsevations (from our policy) with labels from an expert policy
-        # HINT: query the policy (using the get_action function) with paths[i]["observation"]
-        # and replace paths[i]["action"] with these expert labels
+        # query the expert once on all observations instead of once per path
+        path_lens = [len(path["observation"]) for path in paths]
+        expert_actions = expert_policy.get_action(
+            np.concatenate([path["observation"] for path in paths]))
+        for path, actions in zip(paths, np.split(expert_actions, np.cumsum(path_lens)[:-1])):
+            path["action"] = actions
 
         return paths
 
@@ -215,8 +262,9 @@ class RL_Trainer(object):
 
         # collect eval trajectories, for logging
         print("\nCollecting data for eval...")
-        eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(
-            self.env, eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
+        with profiling.phase('eval'):
+            eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(
+                self.env, eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
 
         # save eval rollouts as videos in tensorboard event file
         if self.log_video and train_video_paths != None:
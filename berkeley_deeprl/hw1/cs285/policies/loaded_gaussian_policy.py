@@ -25,6 +25,120 @@ def read_layer(l):
         'b'].astype(np.float32)
 
 
+def fold_obs_norm(W, b, obs_mean, obs_std, eps=1e-6):
+    """
+        Folds the observation standardizer into an affine layer, so that
+        ((obs - mean) / (std + eps)) @ W + b == obs @ W_fused + b_fused
+
+        arguments:
+            W: (D_in, D_out) weights, as stored in the expert pickle
+            b: (1, D_out) bias
+            obs_mean, obs_std: (1, D_in) standardizer statistics
+
+        returns:
+            W_fused, b_fused
+    """
+    scale = 1.0 / (obs_std.astype(np.float64) + eps)
+    W_fused = W.astype(np.float64) * scale.reshape(-1, 1)
+    b_fused = b.astype(np.float64) - (obs_mean.astype(np.float64) * scale) @ W
+    return W_fused.astype(np.float32), b_fused.astype(np.float32)
+
+
+_np_nonlin = {
+    'lrelu': lambda x: np.where(x > 0, x, 0.01 * x),
+    'tanh': np.tanh,
+}
+
+
+class NumpyGaussianPolicy(BasePolicy):
+    """
+        Torch-free expert: the mean action of a LoadedGaussianPolicy computed
+        with the observation normalization folded into the first layer.
+        Accepts a single observation or a (N, D) batch.
+    """
+
+    def __init__(self, layers, nonlin_type):
+        self.layers = [(np.ascontiguousarray(W), b.reshape(-1))
+                       for W, b in layers]
+        self.nonlin_type = nonlin_type
+        self.non_lin = _np_nonlin[nonlin_type]
+
+    def forward(self, obs):
+        h = obs
+        for W, b in self.layers[:-1]:
+            h = self.non_lin(h @ W + b)
+        W, b = self.layers[-1]
+        return h @ W + b
+
+    def get_action(self, obs):
+        if len(obs.shape) > 1:
+            observation = obs
+        else:
+            observation = obs[None, :]
+        return self.forward(observation.astype(np.float32))
+
+    def update(self, obs_no, acs_na, adv_n=None, acs_labels_na=None):
+        raise NotImplementedError
+
+    def save(self, filepath):
+        np.savez(filepath, nonlin_type=self.nonlin_type,
+                 **{'W_%d' % i: W for i, (W, _) in enumerate(self.layers)},
+                 **{'b_%d' % i: b for i, (_, b) in enumerate(self.layers)})
+
+    @classmethod
+    def load(cls, filepath):
+        data = np.load(filepath)
+        n_layers = len([k for k in data.files if k.startswith('W_')])
+        layers = [(data['W_%d' % i], data['b_%d' % i]) for i in range(n_layers)]
+        return cls(layers, str(data['nonlin_type']))
+
+
+class FusedExpert(nn.Module):
+    """
+        Scriptable torch counterpart of NumpyGaussianPolicy.
+    """
+
+    def __init__(self, layers, nonlin_type):
+        super().__init__()
+        self.hidden_layers = nn.ModuleList(
+            [create_linear_layer(W, b) for W, b in layers[:-1]])
+        self.output_layer = create_linear_layer(*layers[-1])
+        if nonlin_type == 'lrelu':
+            self.non_lin = nn.LeakyReLU(0.01)
+        else:
+            self.non_lin = nn.Tanh()
+
+    def forward(self, obs):
+        h = obs
+        for layer in self.hidden_layers:
+            h = self.non_lin(layer(h))
+        return self.output_layer(h)
+
+
+class TorchScriptGaussianPolicy(BasePolicy):
+    """
+        Wraps a scripted FusedExpert with the policy interface.
+        Accepts a single observation or a (N, D) batch.
+    """
+
+    def __init__(self, scripted):
+        self.scripted = scripted
+
+    def get_action(self, obs):
+        if len(obs.shape) > 1:
+            observation = obs
+        else:
+            observation = obs[None, :]
+        with torch.no_grad():
+            return ptu.to_numpy(self.scripted(ptu.from_numpy(observation.astype(np.float32))))
+
+    def update(self, obs_no, acs_na, adv_n=None, acs_labels_na=None):
+        raise NotImplementedError
+
+    def save(self, filepath):
+        torch.jit.save(self.scripted, filepath)
+
+
 class LoadedGaussianPolicy(BasePolicy, nn.Module):
     def __init__(self, filename, **kwargs):
         super().__init__(**kwargs)
@@ -66,16 +180,21 @@ class LoadedGaussianPolicy(BasePolicy, nn.Module):
         # Hidden layers next
         assert list(self.policy_params['hidden'].keys()) == ['FeedforwardNet']
         layer_params = self.policy_params['hidden']['FeedforwardNet']
+        self.raw_layers = []
         for layer_name in sorted(layer_params.keys()):
             l = layer_params[layer_name]
             W, b = read_layer(l)
+            self.raw_layers.append((W, b))
             linear_layer = create_linear_layer(W, b)
             self.hidden_layers.append(linear_layer)
 
         # Output layer
         W, b = read_layer(self.policy_params['out'])
+        self.raw_layers.append((W, b))
         self.output_layer = create_linear_layer(W, b)
 
+        self.raw_obs_norm = (obsnorm_mean, obsnorm_stdev)
+
     def forward(self, obs):
         normed_obs = (obs - self.obs_norm_mean) / (self.obs_norm_std + 1e-6)
         h = normed_obs
@@ -103,3 +222,66 @@ class LoadedGaussianPolicy(BasePolicy, nn.Module):
 
     def save(self, filepath):
         torch.save(self.state_dict(), filepath)
+
+    ##################################
+
+    def fused_layers(self):
+        """Return the (W, b) layers with obs normalization folded into the first."""
+        layers = list(self.raw_layers)
+        W, b = layers[0]
+        layers[0] = fold_obs_norm(W, b, *self.raw_obs_norm)
+        return layers
+
+    def sample_check_obs(self, n=256):
+        """Draw n observations from the expert's normalization statistics."""
+        obs_mean, obs_std = self.raw_obs_norm
+        obs = obs_mean + obs_std * np.random.randn(n, obs_mean.shape[1])
+        return obs.astype(np.float32)
+
+    def export_numpy(self, check_obs=None, atol=1e-4):
+        """
+            Build a NumpyGaussianPolicy equivalent to this expert.
+            The outputs of both are compared on check_obs, by default on
+            sample_check_obs(); pass check_obs=False to skip the check.
+        """
+        fused = NumpyGaussianPolicy(self.fused_layers(), self.nonlin_type)
+        self._check_export(fused, check_obs, atol)
+        return fused
+
+    def export_torchscript(self, check_obs=None, atol=1e-4):
+        """
+            Build a TorchScriptGaussianPolicy, a scripted FusedExpert,
+            equivalent to this expert. Checked like export_numpy.
+        """
+        fused = TorchScriptGaussianPolicy(torch.jit.script(
+            FusedExpert(self.fused_layers(), self.nonlin_type).to(ptu.device)))
+        self._check_export(fused, check_obs, atol)
+        return fused
+
+    def _check_export(self, fused, check_obs, atol):
+        if check_obs is False:
+            return
+        if check_obs is None:
+            check_obs = self.sample_check_obs()
+        check_fused_expert(self, fused.get_action, check_obs, atol)
+
+
+def check_fused_expert(expert, fused_get_action, obs, atol=1e-4):
+    """
+        Assert that a fused expert reproduces the actions of the original.
+
+        arguments:
+            expert: LoadedGaussianPolicy
+            fused_get_action: callable mapping a (N, D) obs batch to actions
+            obs: (N, D) observations to compare on
+
+        returns:
+            the max absolute difference between both
+    """
+    with torch.no_grad():
+        expected = expert.get_action(obs)
+    actual = np.asarray(fused_get_action(obs))
+    max_err = np.max(np.abs(expected - actual))
+    assert max_err <= atol, (
+        'Fused expert deviates from the original by {}'.format(max_err))
+    return max_err
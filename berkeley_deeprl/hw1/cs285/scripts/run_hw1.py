@@ -41,6 +41,12 @@ class BC_Trainer(object):
               self.params['expert_policy_file'])
         self.loaded_expert_policy = LoadedGaussianPolicy(
             self.params['expert_policy_file'])
+        # fused experts are checked against the original on observations
+        # drawn from its own normalization statistics
+        if self.params['expert_backend'] == 'numpy':
+            self.loaded_expert_policy = self.loaded_expert_policy.export_numpy()
+        elif self.params['expert_backend'] == 'torchscript':
+            self.loaded_expert_policy = self.loaded_expert_policy.export_torchscript()
         print('Done restoring expert policy...')
 
     def run_training_loop(self):
@@ -68,6 +74,8 @@ def main():
     parser.add_argument('--exp_name', '-exp', type=str,
                         default='pick an experiment name', required=True)
     parser.add_argument('--do_dagger', action='store_true')
+    parser.add_argument('--expert_backend', type=str, default='torch',
+                        choices=['torch', 'numpy', 'torchscript'])
     parser.add_argument('--ep_len', type=int)
 
     # number of gradient steps for training policy (per iter in n_iter)
@@ -95,6 +103,10 @@ def main():
     parser.add_argument('--which_gpu', type=int, default=0)
     parser.add_argument('--max_replay_buffer_size', type=int, default=1000000)
     parser.add_argument('--save_params', action='store_true')
+    parser.add_argument('--profile_phases', action='store_true')
+    parser.add_argument('--profile_log_freq', type=int) # defaults to scalar_log_freq
+    parser.add_argument('--cprofile_start_itr', type=int, default=-1) # -1 to disable
+    parser.add_argument('--cprofile_num_itrs', type=int, default=1)
     parser.add_argument('--seed', type=int, default=1)
     args = parser.parse_args()
 
@@ -0,0 +1,145 @@
+"""
+Phase timers and throughput counters for the training loop.
+
+Phases nest, the time of a phase is reported under the path of the
+phases it runs in, e.g. 'train/critic_update'. Profiling is disabled by
+default, phase() then returns a shared no-op context manager and count()
+returns immediately, so the instrumentation can stay in the code.
+
+    from cs285.infrastructure import profiling
+    profiling.init_profiling(enabled=True)
+
+    with profiling.phase('collect'):
+        paths, envsteps = ...
+    profiling.count('EnvSteps', envsteps)
+
+    logs = profiling.get_logs()
+"""
+import cProfile
+import time
+from collections import OrderedDict
+
+
+class _NullPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Phase(object):
+    __slots__ = ('name', 'path', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _stack.append(self.name)
+        self.path = '/'.join(_stack)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        _stack.pop()
+        _totals[self.path] = _totals.get(self.path, 0.0) + elapsed
+        _calls[self.path] = _calls.get(self.path, 0) + 1
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+enabled = False
+_stack = []
+_totals = OrderedDict()
+_calls = {}
+_counts = OrderedDict()
+_window_start = time.perf_counter()
+
+
+def init_profiling(enabled=True):
+    globals()['enabled'] = enabled
+    reset()
+
+
+def reset():
+    global _window_start
+    _totals.clear()
+    _calls.clear()
+    _counts.clear()
+    _window_start = time.perf_counter()
+
+
+def phase(name):
+    """
+    Returns a context manager timing the enclosed block as the phase name.
+    """
+    if not enabled:
+        return _NULL_PHASE
+    return _Phase(name)
+
+
+def count(name, n=1):
+    """
+    Adds n to the counter name, e.g. 'EnvSteps', 'GradientSteps' or 'Samples'.
+    """
+    if enabled:
+        _counts[name] = _counts.get(name, 0) + n
+
+
+def get_logs(reset_window=True):
+    """
+    Returns the time spent in each phase and the rate of each counter since
+    the last call (or init_profiling), as an OrderedDict for the logger:
+        Time_<path>: seconds spent in the phase
+        Calls_<path>: number of times the phase ran
+        Throughput_<name>: counter per second of wall time
+        Time_Window: wall time of the window
+    Empty when profiling is disabled.
+    """
+    logs = OrderedDict()
+    if not enabled:
+        return logs
+    window = time.perf_counter() - _window_start
+    for path, total in _totals.items():
+        logs['Time_' + path] = total
+        logs['Calls_' + path] = _calls[path]
+    for name, n in _counts.items():
+        logs['Throughput_' + name] = n / window if window > 0 else 0.0
+    logs['Time_Window'] = window
+    if reset_window:
+        reset()
+    return logs
+
+
+class CProfileWindow(object):
+    """
+    Runs cProfile for num_itrs iterations from start_itr, and dumps the
+    stats to filename in the pstats format (readable by pstats, snakeviz or
+    gprof2dot). Call step(itr) at the start of every iteration, and close()
+    after the loop. For a sampling profile of a whole run, attach py-spy
+    to the process instead (py-spy record --pid <pid>).
+    """
+
+    def __init__(self, start_itr, num_itrs, filename):
+        self.start_itr = start_itr
+        self.end_itr = start_itr + num_itrs
+        self.filename = filename
+        self.profiler = None
+
+    def step(self, itr):
+        if itr == self.start_itr and self.start_itr >= 0:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif itr == self.end_itr:
+            self.close()
+
+    def close(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.filename)
+            print('Saved cProfile stats to {}'.format(self.filename))
+            self.profiler = None
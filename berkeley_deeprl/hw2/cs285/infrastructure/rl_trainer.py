@@ -1,4 +1,5 @@
 from collections import OrderedDict
+import functools
 import pickle
 import os
 import sys
@@ -11,6 +12,8 @@ import torch
 from cs285.infrastructure import pytorch_util as ptu
 
 from cs285.infrastructure import utils
+from cs285.infrastructure import profiling
+from cs285.infrastructure import eval_worker
 from cs285.infrastructure.logger import Logger
 from cs285.infrastructure.action_noise_wrapper import ActionNoiseWrapper
 
@@ -19,6 +22,16 @@ MAX_NVIDEO = 2
 MAX_VIDEO_LEN = 40 # we overwrite this in the code below
 
 
+def make_eval_env(env_name, seed, action_noise_std):
+    """
+    Makes the env of the async eval worker, like the training env.
+    """
+    env = gym.make(env_name)
+    if action_noise_std > 0:
+        env = ActionNoiseWrapper(env, seed, action_noise_std)
+    return env
+
+
 class RL_Trainer(object):
 
     def __init__(self, params):
@@ -94,6 +107,27 @@ class RL_Trainer(object):
         agent_class = self.params['agent_class']
         self.agent = agent_class(self.env, self.params['agent_params'])
 
+        #############
+        ## PROFILING
+        #############
+
+        # Phase timers, and a cProfile dump of a window of iterations
+        profiling.init_profiling(self.params.get('profile_phases', False))
+        self.cprofile_window = profiling.CProfileWindow(
+            self.params.get('cprofile_start_itr', -1),
+            self.params.get('cprofile_num_itrs', 1),
+            os.path.join(self.params['logdir'], 'cprofile.prof'))
+
+        #############
+        ## EVAL
+        #############
+
+        # With async_eval, the eval rollouts run in a worker process, started
+        # with the first evaluation
+        self.eval_env_fn = functools.partial(
+            make_eval_env, self.params['env_name'], seed, self.params['action_noise_std'])
+        self.eval_worker = None
+
     def run_training_loop(self, n_iter, collect_policy, eval_policy,
                           initial_expertdata=None, relabel_with_expert=False,
                           start_relabel_with_expert=1, expert_policy=None):
@@ -113,6 +147,7 @@ class RL_Trainer(object):
 
         for itr in range(n_iter):
             print("\n\n********** Iteration %i ************"%itr)
+            self.cprofile_window.step(itr)
 
             # decide if videos should be rendered/logged at this iteration
             if itr % self.params['video_log_freq'] == 0 and self.params['video_log_freq'] != -1:
@@ -129,26 +164,79 @@ class RL_Trainer(object):
                 self.logmetrics = False
 
             # collect trajectories, to be used for training
-            training_returns = self.collect_training_trajectories(itr,
-                                initial_expertdata, collect_policy,
-                                self.params['batch_size'])
+            with profiling.phase('collect'):
+                training_returns = self.collect_training_trajectories(itr,
+                                    initial_expertdata, collect_policy,
+                                    self.params['batch_size'])
             paths, envsteps_this_batch, train_video_paths = training_returns
             self.total_envsteps += envsteps_this_batch
+            profiling.count('EnvSteps', envsteps_this_batch)
 
             # add collected data to replay buffer
-            self.agent.add_to_replay_buffer(paths)
+            with profiling.phase('replay_insert'):
+                self.agent.add_to_replay_buffer(paths)
 
             # train agent (using sampled data from replay buffer)
-            train_logs = self.train_agent()
+            with profiling.phase('train'):
+                train_logs = self.train_agent()
 
             # log/save
             if self.logvideo or self.logmetrics:
                 # perform logging
                 print('\nBeginning logging procedure...')
-                self.perform_logging(itr, paths, eval_policy, train_video_paths, train_logs)
+                with profiling.phase('logging'):
+                    self.perform_logging(itr, paths, eval_policy, train_video_paths, train_logs)
 
                 if self.params['save_params']:
-                    self.agent.save('{}/agent_itr_{}.pt'.format(self.params['logdir'], itr))
+                    with profiling.phase('save'):
+                        self.agent.save('{}/agent_itr_{}.pt'.format(self.params['logdir'], itr))
+
+            self.log_async_eval()
+            self.log_profiling(itr)
+
+        self.cprofile_window.close()
+        if self.eval_worker is not None:
+            self.log_async_eval(block=True)
+            self.eval_worker.close()
+
+    def log_profiling(self, itr):
+        """
+        Logs the phase timers and throughputs every profile_log_freq
+        iterations (scalar_log_freq by default), when profiling is enabled.
+        """
+        if not profiling.enabled:
+            return
+        log_freq = self.params.get('profile_log_freq') or self.params['scalar_log_freq']
+        if log_freq <= 0 or itr % log_freq != 0:
+            return
+        for key, value in profiling.get_logs().items():
+            self.logger.log_scalar(value, key, itr)
+        self.logger.flush()
+
+    def submit_async_eval(self, itr, eval_policy):
+        """
+        Sends a snapshot of eval_policy to the eval worker. The metrics are
+        logged at itr by log_async_eval once the rollouts are done.
+        """
+        if self.eval_worker is None:
+            self.eval_worker = eval_worker.EvalWorker(
+                self.eval_env_fn, eval_policy, self.params['ep_len'], seed=self.params['seed'])
+        if not self.eval_worker.submit(itr, eval_policy, self.params['eval_batch_size']):
+            print('\nSkipping eval, the previous one is still running')
+
+    def log_async_eval(self, block=False):
+        """
+        Logs the metrics of the finished async evaluations, at the iteration
+        their policy snapshot was taken. With block, waits for the running one.
+        """
+        if self.eval_worker is None:
+            return
+        for itr, logs in self.eval_worker.poll(block=block):
+            print('\nEval of iteration {}'.format(itr))
+            for key, value in logs.items():
+                print('{} : {}'.format(key, value))
+                self.logger.log_scalar(value, key, itr)
+            self.logger.flush()
 
     ####################################
     ####################################
@@ -169,8 +257,15 @@ class RL_Trainer(object):
         #######################
 
         # collect eval trajectories, for logging
-        print("\nCollecting data for eval...")
-        eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(self.env, eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
+        eval_paths = None
+        if self.params.get('async_eval'):
+            if self.logmetrics:
+                with profiling.phase('eval_submit'):
+                    self.submit_async_eval(itr, eval_policy)
+        else:
+            print("\nCollecting data for eval...")
+            with profiling.phase('eval'):
+                eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(self.env, eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
 
         # save eval rollouts as videos in tensorboard event file
         if self.logvideo and train_video_paths != None:
@@ -190,19 +285,14 @@ class RL_Trainer(object):
         if self.logmetrics:
             # returns, for logging
             train_returns = [path["reward"].sum() for path in paths]
-            eval_returns = [eval_path["reward"].sum() for eval_path in eval_paths]
 
             # episode lengths, for logging
             train_ep_lens = [len(path["reward"]) for path in paths]
-            eval_ep_lens = [len(eval_path["reward"]) for eval_path in eval_paths]
 
-            # decide what to log
+            # decide what to log, the async eval metrics are logged when ready
             logs = OrderedDict()
-            logs["Eval_AverageReturn"] = np.mean(eval_returns)
-            logs["Eval_StdReturn"] = np.std(eval_returns)
-            logs["Eval_MaxReturn"] = np.max(eval_returns)
-            logs["Eval_MinReturn"] = np.min(eval_returns)
-            logs["Eval_AverageEpLen"] = np.mean(eval_ep_lens)
+            if eval_paths is not None:
+                logs.update(eval_worker.get_eval_logs(eval_paths))
 
             logs["Train_AverageReturn"] = np.mean(train_returns)
             logs["Train_StdReturn"] = np.std(train_returns)
@@ -1,6 +1,7 @@
 import numpy as np
 
-from cs285.infrastructure.dqn_utils import MemoryOptimizedReplayBuffer, PiecewiseSchedule
+from cs285.infrastructure import profiling
+from cs285.infrastructure.dqn_utils import make_replay_buffer, PiecewiseSchedule
 from cs285.policies.argmax_policy import ArgMaxPolicy
 from cs285.critics.dqn_critic import DQNCritic
 
@@ -27,8 +28,10 @@ class DQNAgent(object):
         self.actor = ArgMaxPolicy(self.critic)
 
         lander = agent_params['env_name'].startswith('LunarLander')
-        self.replay_buffer = MemoryOptimizedReplayBuffer(
-            agent_params['replay_buffer_size'], agent_params['frame_history_len'], lander=lander)
+        # With a codec, compressed frames for Atari buffers of 1M frames
+        self.replay_buffer = make_replay_buffer(
+            agent_params['replay_buffer_size'], agent_params['frame_history_len'],
+            codec=agent_params.get('replay_buffer_codec'), lander=lander)
         self.t = 0
         self.num_param_updates = 0
 
@@ -102,6 +105,7 @@ class DQNAgent(object):
                 TODO
 
             self.num_param_updates += 1
+            profiling.count('GradientSteps')
 
         self.t += 1
         return log
@@ -1,14 +1,17 @@
 """This file includes a collection of utility functions that are useful for
 implementing DQN."""
+import functools
 import random
-from collections import namedtuple
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import gym
 import numpy as np
 from torch import nn
 import torch.optim as optim
 
-from cs285.infrastructure.atari_wrappers import wrap_deepmind
+from cs285.infrastructure.atari_wrappers import wrap_deepmind_fused
 from gym.envs.registration import register
 
 import torch
@@ -47,7 +50,7 @@ def get_env_kwargs(env_name):
             'learning_freq': 4,
             'grad_norm_clipping': 10,
             'input_shape': (84, 84, 4),
-            'env_wrappers': wrap_deepmind,
+            'env_wrappers': wrap_deepmind_fused,
             'frame_history_len': 4,
             'gamma': 0.99,
         }
@@ -362,6 +365,8 @@ class MemoryOptimizedReplayBuffer(object):
             overflows the old memories are dropped.
         frame_history_len: int
             Number of memories to be retried for each observation.
+
+        CompressedReplayBuffer stores the frames compressed instead.
         """
         self.lander = lander
 
@@ -515,3 +520,225 @@ class MemoryOptimizedReplayBuffer(object):
         self.reward[idx] = reward
         self.done[idx]   = done
 
+
+def get_frame_codec(codec):
+    """Returns the (compress, decompress) functions of bytes of the codec:
+    'lz4' (needs the lz4 package), 'zstd' (needs zstandard) or 'zlib'."""
+    if codec == 'lz4':
+        import lz4.frame
+        return lz4.frame.compress, lz4.frame.decompress
+    if codec == 'zstd':
+        import zstandard
+        # The decompressor is made per call, as it is used from two threads
+        return (zstandard.ZstdCompressor(level=3).compress,
+                lambda data: zstandard.ZstdDecompressor().decompress(data))
+    if codec == 'zlib':
+        import zlib
+        return functools.partial(zlib.compress, level=1), zlib.decompress
+    raise ValueError('Unknown frame codec {!r}, use lz4, zstd or zlib'.format(codec))
+
+
+class CompressedReplayBuffer(MemoryOptimizedReplayBuffer):
+    def __init__(self, size, frame_history_len, lander=False,
+                 codec='lz4', chunk_size=8, cache_chunks=512, prefetch=True):
+        """MemoryOptimizedReplayBuffer with the frames stored compressed.
+
+        The frames are compressed in chunks of `chunk_size` consecutive
+        buffer slots. The chunk being written is kept uncompressed and is
+        compressed when it is full. Chunks that are read are decompressed
+        into an LRU cache of `cache_chunks` chunks. With `prefetch`, the
+        indices of the next batch are drawn at the end of `sample`, and their
+        chunks are decompressed in a worker thread while the agent steps the
+        env and trains, so the next batch can only contain transitions stored
+        before the current `sample`.
+
+        Atari frames compress 5-10x, so the 1M frames of the typical Atari
+        buffer take about 1 gigabyte, plus 512 * 8 * 84 * 84 bytes ~= 29
+        megabytes of cache. Small chunks keep the decompression of a batch,
+        which touches up to 2 chunks per transition, cheap.
+
+        Parameters
+        ----------
+        codec: str
+            'lz4', 'zstd' or 'zlib', see `get_frame_codec`.
+        chunk_size: int
+            Number of consecutive frames compressed together.
+        cache_chunks: int
+            Number of decompressed chunks kept, should hold the chunks of a
+            batch, up to 2 per sampled transition.
+        prefetch: bool
+            Decompress the chunks of the next batch in a worker thread.
+
+        The other parameters are the same as MemoryOptimizedReplayBuffer's.
+        """
+        super(CompressedReplayBuffer, self).__init__(size, frame_history_len, lander=lander)
+        self.codec = codec
+        self.compress, self.decompress = get_frame_codec(codec)
+        self.chunk_size = chunk_size
+        self.cache_chunks = cache_chunks
+        self.prefetch = prefetch
+
+        self.frame_shape = None
+        self.frame_dtype = None
+        # Compressed bytes of each chunk, None for the open chunk and the
+        # chunks not written yet
+        self.chunks = [None] * ((size + chunk_size - 1) // chunk_size)
+        self.open_chunk = None
+        self.open_frames = None
+        self.cache = OrderedDict()
+        # Guards self.chunks and self.cache, shared with the prefetch thread
+        self.lock = threading.Lock()
+
+        self.executor = None
+        self.prefetch_future = None
+        self.next_idxes = None
+
+    def _chunk_len(self, chunk):
+        return min(self.chunk_size, self.size - chunk * self.chunk_size)
+
+    def _load_chunk(self, chunk):
+        """Returns the frames of a closed chunk, from the cache or decompressed
+        into it. None if the chunk isn't closed."""
+        with self.lock:
+            frames = self.cache.get(chunk)
+            if frames is not None:
+                self.cache.move_to_end(chunk)
+                return frames
+            data = self.chunks[chunk]
+        if data is None:
+            return None
+        frames = np.frombuffer(self.decompress(data), dtype=self.frame_dtype).reshape(
+            (-1,) + self.frame_shape)
+        with self.lock:
+            # The chunk may have been reopened for writing in the meantime
+            if self.chunks[chunk] is data:
+                self._cache_put(chunk, frames)
+        return frames
+
+    def _cache_put(self, chunk, frames):
+        self.cache[chunk] = frames
+        self.cache.move_to_end(chunk)
+        while len(self.cache) > self.cache_chunks:
+            self.cache.popitem(last=False)
+
+    def _get_frame(self, idx):
+        chunk, offset = divmod(idx, self.chunk_size)
+        if chunk == self.open_chunk:
+            return self.open_frames[offset]
+        frames = self._load_chunk(chunk)
+        assert frames is not None, 'Frame {} was never stored'.format(idx)
+        return frames[offset]
+
+    def _open_chunk(self, chunk):
+        # The slots of the chunk not overwritten yet keep their old frames
+        old_frames = self._load_chunk(chunk)
+        with self.lock:
+            self.chunks[chunk] = None
+            self.cache.pop(chunk, None)
+        if old_frames is not None:
+            self.open_frames[:len(old_frames)] = old_frames
+        self.open_chunk = chunk
+
+    def _close_chunk(self):
+        chunk = self.open_chunk
+        frames = self.open_frames[:self._chunk_len(chunk)]
+        data = self.compress(frames.tobytes())
+        with self.lock:
+            self.chunks[chunk] = data
+            # The latest frames are read for the next observations
+            self._cache_put(chunk, frames.copy())
+        self.open_chunk = None
+
+    def _encode_observation(self, idx):
+        end_idx   = idx + 1 # make noninclusive
+        start_idx = end_idx - self.frame_history_len
+        # low-dimensional observations, such as RAM state, are returned directly
+        if len(self.frame_shape) == 1:
+            return self._get_frame((end_idx - 1) % self.size)
+        # if there weren't enough frames ever in the buffer for context
+        if start_idx < 0 and self.num_in_buffer != self.size:
+            start_idx = 0
+        for idx in range(start_idx, end_idx - 1):
+            if self.done[idx % self.size]:
+                start_idx = idx + 1
+        missing_context = self.frame_history_len - (end_idx - start_idx)
+        frames = [np.zeros(self.frame_shape, dtype=self.frame_dtype) for _ in range(missing_context)]
+        for idx in range(start_idx, end_idx):
+            frames.append(self._get_frame(idx % self.size))
+        return np.concatenate(frames, 2)
+
+    def _prefetch_chunks(self, idxes):
+        chunks = set()
+        for idx in idxes:
+            # The frames of the observation and the next observation
+            for frame_idx in (idx - self.frame_history_len + 1, idx + 1):
+                chunks.add((frame_idx % self.size) // self.chunk_size)
+        for chunk in sorted(chunks):
+            if chunk != self.open_chunk:
+                self._load_chunk(chunk)
+
+    def _draw_idxes(self, batch_size):
+        return sample_n_unique(lambda: random.randint(0, self.num_in_buffer - 2), batch_size)
+
+    def sample(self, batch_size):
+        """Same as MemoryOptimizedReplayBuffer.sample. With prefetch, the
+        transitions were drawn, and their frames decompressed, after the
+        previous call."""
+        assert self.can_sample(batch_size)
+        if self.prefetch_future is not None:
+            self.prefetch_future.result()
+            self.prefetch_future = None
+        idxes = self.next_idxes
+        if idxes is None or len(idxes) != batch_size:
+            idxes = self._draw_idxes(batch_size)
+        batch = self._encode_sample(idxes)
+
+        self.next_idxes = None
+        if self.prefetch:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1)
+            self.next_idxes = self._draw_idxes(batch_size)
+            self.prefetch_future = self.executor.submit(self._prefetch_chunks, self.next_idxes)
+        return batch
+
+    def store_frame(self, frame):
+        """Same as MemoryOptimizedReplayBuffer.store_frame."""
+        if self.open_frames is None:
+            self.frame_shape = tuple(frame.shape)
+            self.frame_dtype = np.dtype(np.float32 if self.lander else np.uint8)
+            self.open_frames = np.zeros((self.chunk_size,) + self.frame_shape, dtype=self.frame_dtype)
+            self.action   = np.empty([self.size],                     dtype=np.int32)
+            self.reward   = np.empty([self.size],                     dtype=np.float32)
+            self.done     = np.empty([self.size],                     dtype=np.bool)
+
+        chunk, offset = divmod(self.next_idx, self.chunk_size)
+        if chunk != self.open_chunk:
+            self._open_chunk(chunk)
+        self.open_frames[offset] = frame
+        if offset + 1 == self._chunk_len(chunk):
+            self._close_chunk()
+
+        ret = self.next_idx
+        self.next_idx = (self.next_idx + 1) % self.size
+        self.num_in_buffer = min(self.size, self.num_in_buffer + 1)
+
+        return ret
+
+    def frame_nbytes(self):
+        """Returns the bytes taken by the frames: the compressed chunks, the
+        open chunk and the cache."""
+        with self.lock:
+            nbytes = sum(len(data) for data in self.chunks if data is not None)
+            nbytes += sum(frames.nbytes for frames in self.cache.values())
+        if self.open_frames is not None:
+            nbytes += self.open_frames.nbytes
+        return nbytes
+
+
+def make_replay_buffer(size, frame_history_len, codec=None, **kwargs):
+    """Returns a CompressedReplayBuffer storing its frames with codec, or a
+    MemoryOptimizedReplayBuffer if codec is None. kwargs are passed to the
+    buffer."""
+    if codec:
+        return CompressedReplayBuffer(size, frame_history_len, codec=codec, **kwargs)
+    return MemoryOptimizedReplayBuffer(size, frame_history_len, **kwargs)
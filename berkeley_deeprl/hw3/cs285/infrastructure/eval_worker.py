@@ -0,0 +1,145 @@
+"""
+Evaluation rollouts in a separate process, so training continues while the
+eval policy is rolled out.
+
+The worker gets a copy of the policy when it starts, and a snapshot of the
+policy's state_dict with every request. It runs the rollouts in its own env,
+on the CPU, and sends back the eval metrics tagged with the iteration the
+snapshot was taken at.
+
+    eval_worker = EvalWorker(functools.partial(gym.make, env_name), policy, ep_len)
+    eval_worker.submit(itr, policy, eval_batch_size)
+    ...
+    for itr, logs in eval_worker.poll():
+        ...
+    eval_worker.close()
+"""
+import io
+import multiprocessing
+import queue
+import time
+import traceback
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from cs285.infrastructure import pytorch_util as ptu
+from cs285.infrastructure import utils
+
+
+def get_eval_logs(eval_paths):
+    """
+    Returns the eval metrics of the rollouts, as an OrderedDict for the logger.
+    """
+    eval_returns = [eval_path["reward"].sum() for eval_path in eval_paths]
+    eval_ep_lens = [len(eval_path["reward"]) for eval_path in eval_paths]
+
+    logs = OrderedDict()
+    logs["Eval_AverageReturn"] = np.mean(eval_returns)
+    logs["Eval_StdReturn"] = np.std(eval_returns)
+    logs["Eval_MaxReturn"] = np.max(eval_returns)
+    logs["Eval_MinReturn"] = np.min(eval_returns)
+    logs["Eval_AverageEpLen"] = np.mean(eval_ep_lens)
+    return logs
+
+
+def _dumps(obj):
+    buffer = io.BytesIO()
+    torch.save(obj, buffer)
+    return buffer.getvalue()
+
+
+def _loads(data):
+    return torch.load(io.BytesIO(data), map_location='cpu')
+
+
+def _run_worker(env_fn, policy_bytes, ep_len, seed, num_threads, requests, results):
+    try:
+        # Leave the GPU and the other cores to training
+        ptu.init_gpu(use_gpu=False)
+        torch.set_num_threads(num_threads)
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+
+        env = env_fn()
+        env.seed(seed)
+        policy = _loads(policy_bytes)
+
+        while True:
+            request = requests.get()
+            if request is None:
+                return
+            itr, state_bytes, eval_batch_size = request
+            policy.load_state_dict(_loads(state_bytes))
+
+            start = time.time()
+            eval_paths, _ = utils.sample_trajectories(env, policy, eval_batch_size, ep_len)
+            logs = get_eval_logs(eval_paths)
+            logs["Eval_Time"] = time.time() - start
+            results.put((itr, logs))
+    except Exception:
+        results.put((None, traceback.format_exc()))
+
+
+class EvalWorker(object):
+    """
+    Runs the eval rollouts of submitted policy snapshots in a background
+    process. One evaluation runs at a time, a snapshot submitted while the
+    previous one is still being evaluated is skipped.
+
+    env_fn must be picklable, e.g. a module level function or a
+    functools.partial of one, as the worker is started with spawn.
+    """
+
+    def __init__(self, env_fn, policy, ep_len, seed=0, num_threads=1):
+        ctx = multiprocessing.get_context('spawn')
+        self.requests = ctx.Queue()
+        self.results = ctx.Queue()
+        self.process = ctx.Process(
+            target=_run_worker,
+            args=(env_fn, _dumps(policy), ep_len, seed, num_threads, self.requests, self.results),
+            daemon=True)
+        self.process.start()
+        self.pending = 0
+
+    def submit(self, itr, policy, eval_batch_size):
+        """
+        Evaluates the current weights of policy, on eval_batch_size env steps.
+        Returns False if the snapshot was skipped.
+        """
+        if self.pending > 0:
+            return False
+        self.requests.put((itr, _dumps(policy.state_dict()), eval_batch_size))
+        self.pending += 1
+        return True
+
+    def poll(self, block=False):
+        """
+        Returns the (itr, logs) of the finished evaluations. With block, waits
+        for all the submitted evaluations to finish.
+        """
+        finished = []
+        while self.pending > 0:
+            try:
+                itr, logs = self.results.get(timeout=1.0) if block else self.results.get_nowait()
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError('The eval worker exited with code {}'.format(self.process.exitcode))
+                if block:
+                    continue
+                break
+            if itr is None:
+                raise RuntimeError('The eval worker failed:\n{}'.format(logs))
+            self.pending -= 1
+            finished.append((itr, logs))
+        return finished
+
+    def close(self):
+        """
+        Stops the worker. Call poll(block=True) first to get the results of
+        the evaluations that are still running.
+        """
+        if self.process.is_alive():
+            self.requests.put(None)
+        self.process.join()
@@ -69,6 +69,7 @@ def main():
 
     parser.add_argument('--batch_size', '-b', type=int, default=1000) #steps collected per train iteration
     parser.add_argument('--eval_batch_size', '-eb', type=int, default=400) #steps collected per eval iteration
+    parser.add_argument('--async_eval', action='store_true') # run the eval rollouts in a worker process
     parser.add_argument('--train_batch_size', '-tb', type=int, default=1000) ##steps used per gradient step
 
     parser.add_argument('--discount', type=float, default=1.0)
@@ -86,6 +87,10 @@ def main():
     parser.add_argument('--scalar_log_freq', type=int, default=10)
 
     parser.add_argument('--save_params', action='store_true')
+    parser.add_argument('--profile_phases', action='store_true')
+    parser.add_argument('--profile_log_freq', type=int) # defaults to scalar_log_freq
+    parser.add_argument('--cprofile_start_itr', type=int, default=-1) # -1 to disable
+    parser.add_argument('--cprofile_num_itrs', type=int, default=1)
 
     args = parser.parse_args()
 
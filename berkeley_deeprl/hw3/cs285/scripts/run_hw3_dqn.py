@@ -55,6 +55,7 @@ def main():
     parser.add_argument('--num_agent_train_steps_per_iter', type=int, default=1)
     parser.add_argument('--num_critic_updates_per_agent_update', type=int, default=1)
     parser.add_argument('--double_q', action='store_true')
+    parser.add_argument('--replay_buffer_codec', type=str, choices=['lz4', 'zstd', 'zlib']) # compress the replay buffer
 
     parser.add_argument('--seed', type=int, default=1)
     parser.add_argument('--no_gpu', '-ngpu', action='store_true')
@@ -63,6 +64,10 @@ def main():
     parser.add_argument('--video_log_freq', type=int, default=-1)
 
     parser.add_argument('--save_params', action='store_true')
+    parser.add_argument('--profile_phases', action='store_true')
+    parser.add_argument('--profile_log_freq', type=int) # defaults to scalar_log_freq
+    parser.add_argument('--cprofile_start_itr', type=int, default=-1) # -1 to disable
+    parser.add_argument('--cprofile_num_itrs', type=int, default=1)
 
     args = parser.parse_args()
 
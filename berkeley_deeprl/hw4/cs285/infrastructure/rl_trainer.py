@@ -12,6 +12,7 @@ import torch
 from cs285.agents.mb_agent import MBAgent
 from cs285.infrastructure import pytorch_util as ptu
 from cs285.infrastructure import utils
+from cs285.infrastructure import profiling
 from cs285.infrastructure.logger import Logger
 
 # register all of our envs
@@ -107,6 +108,17 @@ class RL_Trainer(object):
         agent_class = self.params['agent_class']
         self.agent = agent_class(self.env, self.params['agent_params'])
 
+        #############
+        ## PROFILING
+        #############
+
+        # Phase timers, and a cProfile dump of a window of iterations
+        profiling.init_profiling(self.params.get('profile_phases', False))
+        self.cprofile_window = profiling.CProfileWindow(
+            self.params.get('cprofile_start_itr', -1),
+            self.params.get('cprofile_num_itrs', 1),
+            os.path.join(self.params['logdir'], 'cprofile.prof'))
+
     def run_training_loop(self, n_iter, collect_policy, eval_policy,
                           initial_expertdata=None):
         """
@@ -125,6 +137,7 @@ class RL_Trainer(object):
         for itr in range(n_iter):
             if itr % print_period == 0:
                 print("\n\n********** Iteration %i ************"%itr)
+            self.cprofile_window.step(itr)
 
             # decide if videos should be rendered/logged at this iteration
             if itr % self.params['video_log_freq'] == 0 and self.params['video_log_freq'] != -1:
@@ -143,36 +156,61 @@ class RL_Trainer(object):
             use_batchsize = self.params['batch_size']
             if itr == 0:
                 use_batchsize = self.params['batch_size_initial']
-            paths, envsteps_this_batch, train_video_paths = (
-                self.collect_training_trajectories(
-                    itr, initial_expertdata, collect_policy, use_batchsize)
-            )
+            with profiling.phase('collect'):
+                paths, envsteps_this_batch, train_video_paths = (
+                    self.collect_training_trajectories(
+                        itr, initial_expertdata, collect_policy, use_batchsize)
+                )
 
             self.total_envsteps += envsteps_this_batch
+            profiling.count('EnvSteps', envsteps_this_batch)
 
             # add collected data to replay buffer
-            if isinstance(self.agent, MBAgent):
-                self.agent.add_to_replay_buffer(paths, self.params['add_sl_noise'])
-            else:
-                self.agent.add_to_replay_buffer(paths)
+            with profiling.phase('replay_insert'):
+                if isinstance(self.agent, MBAgent):
+                    self.agent.add_to_replay_buffer(paths, self.params['add_sl_noise'])
+                else:
+                    self.agent.add_to_replay_buffer(paths)
 
             # train agent (using sampled data from replay buffer)
             if itr % print_period == 0:
                 print("\nTraining agent...")
-            all_logs = self.train_agent()
+            with profiling.phase('train'):
+                all_logs = self.train_agent()
 
             # if there is a model, log model predictions
             if isinstance(self.agent, MBAgent) and itr == 0:
-                self.log_model_predictions(itr, all_logs)
+                with profiling.phase('model_predictions'):
+                    self.log_model_predictions(itr, all_logs)
 
             # log/save
             if self.logvideo or self.logmetrics:
                 # perform logging
                 print('\nBeginning logging procedure...')
-                self.perform_logging(itr, paths, eval_policy, train_video_paths, all_logs)
+                with profiling.phase('logging'):
+                    self.perform_logging(itr, paths, eval_policy, train_video_paths, all_logs)
 
                 if self.params['save_params']:
-                    self.agent.save('{}/agent_itr_{}.pt'.format(self.params['logdir'], itr))
+                    with profiling.phase('save'):
+                        self.agent.save('{}/agent_itr_{}.pt'.format(self.params['logdir'], itr))
+
+            self.log_profiling(itr)
+
+        self.cprofile_window.close()
+
+    def log_profiling(self, itr):
+        """
+        Logs the phase timers and throughputs every profile_log_freq
+        iterations (scalar_log_freq by default), when profiling is enabled.
+        """
+        if not profiling.enabled:
+            return
+        log_freq = self.params.get('profile_log_freq') or self.params['scalar_log_freq']
+        if log_freq <= 0 or itr % log_freq != 0:
+            return
+        for key, value in profiling.get_logs().items():
+            self.logger.log_scalar(value, key, itr)
+        self.logger.flush()
 
     ####################################
     ####################################
@@ -205,7 +243,8 @@ class RL_Trainer(object):
 
         # collect eval trajectories, for logging
         print("\nCollecting data for eval...")
-        eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(self.env, eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
+        with profiling.phase('eval'):
+            eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(self.env, eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
 
         # save eval rollouts as videos in tensorboard event file
         if self.logvideo and train_video_paths != None:
@@ -0,0 +1,274 @@
+"""
+Benchmarks the hot paths of the model-based RL code on the CPU: the replay
+buffer and action selection of the MPC policy, on the obstacles env.
+
+Each benchmark is run for a few parameter settings. The time of one call is
+measured like timeit (the number of calls per repeat is picked so a repeat
+takes at least --min_time). The peak memory allocated by one call is measured
+with tracemalloc, which sees NumPy arrays but not torch tensors, and the peak
+resident memory of the process after the setup is reported as well.
+
+The results can be written to JSON and compared against a previous run, e.g.
+to check a branch for regressions:
+
+    python cs285/scripts/benchmark_hot_paths.py --json master.json
+    python cs285/scripts/benchmark_hot_paths.py --json branch.json --compare master.json
+    python cs285/scripts/benchmark_hot_paths.py --filter ReplayBuffer
+"""
+import argparse
+import collections
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+Benchmark = collections.namedtuple('Benchmark', ['name', 'setup', 'params'])
+
+BENCHMARKS = []
+
+# Number of torch threads, set from the command line
+TORCH_THREADS = 1
+
+
+def benchmark(name, params):
+    """
+    Registers setup(**p) for each p in params. setup builds everything the
+    benchmark needs and returns the function to time.
+    """
+    def register(setup):
+        BENCHMARKS.append(Benchmark(name, setup, params))
+        return setup
+    return register
+
+
+def _init_torch():
+    import torch
+    from cs285.infrastructure import pytorch_util as ptu
+    torch.set_num_threads(TORCH_THREADS)
+    torch.manual_seed(0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ptu.init_gpu(use_gpu=False)
+
+
+def _random_paths(num_transitions, ob_dim=2, ac_dim=2, path_length=100):
+    from cs285.infrastructure.utils import Path
+    paths = []
+    for start in range(0, num_transitions, path_length):
+        n = min(path_length, num_transitions - start)
+        terminals = np.zeros(n)
+        terminals[-1] = 1
+        paths.append(Path(np.random.rand(n, ob_dim), [], np.random.rand(n, ac_dim),
+                          np.random.randn(n), np.random.rand(n, ob_dim), terminals))
+    return paths
+
+
+#############
+## BENCHMARKS
+#############
+
+@benchmark('ReplayBuffer.add_rollouts', [{'num_in_buffer': 10000}, {'num_in_buffer': 100000}])
+def setup_add_rollouts(num_in_buffer, batch_size=1000):
+    """
+    Adds one batch of rollouts to a buffer already holding num_in_buffer
+    transitions.
+    """
+    from cs285.infrastructure.replay_buffer import ReplayBuffer
+    base = ReplayBuffer()
+    base.add_rollouts(_random_paths(num_in_buffer))
+    new_paths = _random_paths(batch_size)
+
+    def add_rollouts():
+        buffer = copy.copy(base)
+        buffer.paths = list(base.paths)
+        buffer.add_rollouts(new_paths)
+    return add_rollouts
+
+
+@benchmark('ReplayBuffer.sample_random_data', [{'batch_size': 512}, {'batch_size': 8000}])
+def setup_sample_random_data(batch_size, num_in_buffer=100000):
+    from cs285.infrastructure.replay_buffer import ReplayBuffer
+    buffer = ReplayBuffer()
+    buffer.add_rollouts(_random_paths(num_in_buffer))
+    return lambda: buffer.sample_random_data(batch_size)
+
+
+@benchmark('MPCPolicy.get_action', [
+    {'sample_strategy': 'random', 'N': 1000, 'horizon': 10},
+    {'sample_strategy': 'random', 'N': 4000, 'horizon': 20},
+    {'sample_strategy': 'cem', 'N': 1000, 'horizon': 10},
+])
+def setup_mpc_get_action(sample_strategy, N, horizon, ensemble_size=3):
+    """
+    Selects an action in the obstacles env, with an ensemble of untrained
+    dynamics models of the default size.
+    """
+    _init_torch()
+    from cs285.envs.obstacles.obstacles_env import Obstacles
+    from cs285.models.ff_model import FFModel
+    from cs285.policies.MPC_policy import MPCPolicy
+    env = Obstacles()
+    ob_dim = env.observation_space.shape[0]
+    ac_dim = env.action_space.shape[0]
+    models = [FFModel(ac_dim, ob_dim, n_layers=2, size=250) for _ in range(ensemble_size)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        policy = MPCPolicy(env, ac_dim, models, horizon, N, sample_strategy=sample_strategy)
+
+    obs = np.random.rand(1000, ob_dim)
+    acs = np.random.rand(1000, ac_dim)
+    delta = np.random.randn(1000, ob_dim) * 0.01
+    policy.data_statistics = {
+        'obs_mean': obs.mean(axis=0), 'obs_std': obs.std(axis=0),
+        'acs_mean': acs.mean(axis=0), 'acs_std': acs.std(axis=0),
+        'delta_mean': delta.mean(axis=0), 'delta_std': delta.std(axis=0),
+    }
+    for model in models:
+        model.update_statistics(**policy.data_statistics)
+    ob = env.reset()
+    return lambda: policy.get_action(ob)
+
+
+#############
+## RUNNER
+#############
+
+def run(bench, params, repeat, min_time):
+    np.random.seed(0)
+    fn = bench.setup(**params)
+    max_rss = _max_rss()
+
+    # Warm up, then measure the peak memory of one call
+    fn()
+    tracemalloc.start()
+    fn()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1000000:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    times = [t / number for t in timer.repeat(repeat, number)]
+
+    return {
+        'name': bench.name,
+        'params': params,
+        'number': number,
+        'repeat': repeat,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'peak_memory': peak_memory,
+        'max_rss': max_rss,
+    }
+
+
+def _max_rss():
+    """
+    Peak resident memory of the process, in bytes.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)), universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metadata(args):
+    meta = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'git_revision': _git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'threads': args.threads,
+        'repeat': args.repeat,
+        'min_time': args.min_time,
+    }
+    if 'torch' in sys.modules:
+        meta['torch'] = sys.modules['torch'].__version__
+    return meta
+
+
+def _format_bytes(n):
+    for unit in ['B', 'KB', 'MB']:
+        if abs(n) < 1024:
+            return '{:.0f}{}'.format(n, unit)
+        n /= 1024.
+    return '{:.1f}GB'.format(n)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filter', action='append',
+                        help='only run benchmarks whose name contains this, can be repeated')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min_time', type=float, default=0.2,
+                        help='minimum time of one repeat, in seconds')
+    parser.add_argument('--threads', type=int, default=1, help='torch threads')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results of a previous run to compare against')
+    args = parser.parse_args()
+
+    global TORCH_THREADS
+    TORCH_THREADS = args.threads
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {_key(r): r for r in json.load(f)['results']}
+
+    results = []
+    for bench in BENCHMARKS:
+        if args.filter and not any(f in bench.name for f in args.filter):
+            continue
+        for params in bench.params:
+            # The code under test prints progress, keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run(bench, params, args.repeat, args.min_time)
+            results.append(result)
+
+            line = '{:<60} {:>10.1f}us  peak {:>7}  max rss {:>7}'.format(
+                '{} {}'.format(bench.name, ' '.join('{}={}'.format(k, v) for k, v in params.items())),
+                result['min'] * 1e6, _format_bytes(result['peak_memory']),
+                _format_bytes(result['max_rss']))
+            previous = baseline.get(_key(result))
+            if previous is not None:
+                line += '  {:.2f}x baseline'.format(result['min'] / previous['min'])
+            print(line)
+            sys.stdout.flush()
+
+    if args.json:
+        report = {'meta': _metadata(args), 'results': results}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -88,6 +88,10 @@ def main():
     parser.add_argument('--video_log_freq', type=int, default=1) #-1 to disable
     parser.add_argument('--scalar_log_freq', type=int, default=1) #-1 to disable
     parser.add_argument('--save_params', action='store_true')
+    parser.add_argument('--profile_phases', action='store_true')
+    parser.add_argument('--profile_log_freq', type=int) # defaults to scalar_log_freq
+    parser.add_argument('--cprofile_start_itr', type=int, default=-1) # -1 to disable
+    parser.add_argument('--cprofile_num_itrs', type=int, default=1)
     args = parser.parse_args()
 
     # convert to dictionary
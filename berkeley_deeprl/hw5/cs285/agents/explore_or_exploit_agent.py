@@ -4,8 +4,9 @@ from cs285.critics.dqn_critic import DQNCritic
 from cs285.critics.cql_critic import CQLCritic
 from cs285.infrastructure.replay_buffer import ReplayBuffer
 from cs285.infrastructure.utils import *
+from cs285.infrastructure import profiling
 from cs285.policies.argmax_policy import ArgMaxPolicy
-from cs285.infrastructure.dqn_utils import MemoryOptimizedReplayBuffer
+from cs285.infrastructure.dqn_utils import make_replay_buffer
 from cs285.exploration.rnd_model import RNDModel
 from .dqn_agent import DQNAgent
 import numpy as np
@@ -15,7 +16,8 @@ class ExplorationOrExploitationAgent(DQNAgent):
     def __init__(self, env, agent_params):
         super(ExplorationOrExploitationAgent, self).__init__(env, agent_params)
         
-        self.replay_buffer = MemoryOptimizedReplayBuffer(100000, 1, float_obs=True)
+        self.replay_buffer = make_replay_buffer(100000, 1, codec=agent_params.get('replay_buffer_codec'),
+                                                float_obs=True, state_histogram_bins=10)
         self.num_exploration_steps = agent_params['num_exploration_steps']
         self.offline_exploitation = agent_params['offline_exploitation']
 
@@ -91,6 +93,7 @@ class ExplorationOrExploitationAgent(DQNAgent):
                 log['Exploitation CQL Loss'] = exploitation_critic_loss['CQL Loss']
 
             self.num_param_updates += 1
+            profiling.count('GradientSteps')
 
         self.t += 1
         return log
@@ -104,21 +107,26 @@ class ExplorationOrExploitationAgent(DQNAgent):
             Note that self.last_obs must always point to the new latest observation.
         """
         if (not self.offline_exploitation) or (self.t <= self.num_exploration_steps):
-            self.replay_buffer_idx = self.replay_buffer.store_frame(self.last_obs)
+            with profiling.phase('replay_insert'):
+                self.replay_buffer_idx = self.replay_buffer.store_frame(self.last_obs)
 
         perform_random_action = np.random.random() < self.eps or self.t < self.learning_starts
 
-        if perform_random_action:
-            action = self.env.action_space.sample()
-        else:
-            processed = self.replay_buffer.encode_recent_observation()
-            action = self.actor.get_action(processed)
+        with profiling.phase('policy'):
+            if perform_random_action:
+                action = self.env.action_space.sample()
+            else:
+                processed = self.replay_buffer.encode_recent_observation()
+                action = self.actor.get_action(processed)
 
-        next_obs, reward, done, info = self.env.step(action)
+        with profiling.phase('env_step'):
+            next_obs, reward, done, info = self.env.step(action)
         self.last_obs = next_obs.copy()
 
         if (not self.offline_exploitation) or (self.t <= self.num_exploration_steps):
-            self.replay_buffer.store_effect(self.replay_buffer_idx, action, reward, done)
+            with profiling.phase('replay_insert'):
+                self.replay_buffer.store_effect(self.replay_buffer_idx, action, reward, done)
 
         if done:
-            self.last_obs = self.env.reset()
+            with profiling.phase('env_reset'):
+                self.last_obs = self.env.reset()
@@ -1,4 +1,18 @@
-from cs285.envs import ant
-from cs285.envs import cheetah
-from cs285.envs import obstacles
-from cs285.envs import reacher
\ No newline at end of file
+from gym.envs.registration import register, registry
+
+# The envs are registered by entry point, so their modules (and MuJoCo)
+# are only imported by gym.make
+ENTRY_POINTS = [
+    ('ant-cs285-v0', 'cs285.envs.ant.ant:AntEnv', 1000),
+    ('cheetah-cs285-v0', 'cs285.envs.cheetah.cheetah:HalfCheetahEnv', 1000),
+    ('obstacles-cs285-v0', 'cs285.envs.obstacles.obstacles_env:Obstacles', 500),
+    ('reacher-cs285-v0', 'cs285.envs.reacher.reacher_env:Reacher7DOFEnv', 500),
+]
+
+for env_id, entry_point, max_episode_steps in ENTRY_POINTS:
+    if env_id not in registry.env_specs:
+        register(
+            id=env_id,
+            entry_point=entry_point,
+            max_episode_steps=max_episode_steps,
+        )
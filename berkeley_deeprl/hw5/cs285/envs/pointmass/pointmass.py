@@ -1,8 +1,8 @@
-import networkx as nx
-import scipy.sparse.csgraph
 import numpy as np
 import gym
 import pickle
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 WALLS = {
     'Small':
@@ -253,6 +253,73 @@ def resize_walls(walls, factor):
   return walls
 
 
+WALL_COLOR = np.array([128, 128, 128], dtype=np.uint8)
+GOAL_COLOR = np.array([0, 128, 0], dtype=np.uint8)
+AGENT_COLOR = np.array([0, 0, 0], dtype=np.uint8)
+
+
+def draw_walls(plt, walls):
+  """Draws the wall cells of a transposed walls array on the current axes,
+  as one image instead of one patch per cell."""
+  image = np.zeros(walls.shape + (4,), dtype=np.uint8)
+  image[walls == 1] = np.append(WALL_COLOR, 255)
+  plt.imshow(image, origin='lower', extent=(0, 1, 0, 1), interpolation='nearest', aspect='auto')
+  plt.xlim([0, 1])
+  plt.ylim([0, 1])
+  plt.xticks([])
+  plt.yticks([])
+
+
+def rasterize_walls(walls, height, width):
+  """Returns a [height, width, 3] uint8 image of the walls, laid out like
+  draw_walls: the first observation coordinate goes right and the second
+  one goes up."""
+  (num_rows, num_cols) = walls.shape
+  x = (np.arange(width) + 0.5) / width
+  y = 1.0 - (np.arange(height) + 0.5) / height
+  rows = np.minimum((x * num_rows).astype(int), num_rows - 1)
+  cols = np.minimum((y * num_cols).astype(int), num_cols - 1)
+  is_wall = walls[rows[None, :], cols[:, None]] == 1
+  image = np.full((height, width, 3), 255, dtype=np.uint8)
+  image[is_wall] = WALL_COLOR
+  return image
+
+
+def draw_disk(image, obs, radius, color):
+  """Draws a disk at the normalized observation obs on image, in place."""
+  (height, width) = image.shape[:2]
+  cx = obs[0] * width
+  cy = (1.0 - obs[1]) * height
+  x0, x1 = max(int(cx - radius), 0), min(int(cx + radius) + 1, width)
+  y0, y1 = max(int(cy - radius), 0), min(int(cy + radius) + 1, height)
+  if x0 >= x1 or y0 >= y1:
+    return
+  xs = np.arange(x0, x1) + 0.5 - cx
+  ys = np.arange(y0, y1) + 0.5 - cy
+  inside = xs[None, :] ** 2 + ys[:, None] ** 2 <= radius ** 2
+  image[y0:y1, x0:x1][inside] = color
+
+
+def save_trajectory_plot(walls, obs_vec, goal, filepath):
+  """Saves a plot of the normalized observations obs_vec in the maze to filepath.
+
+  Uses its own figure, so it can run in a background process."""
+  import matplotlib
+  matplotlib.use('Agg')
+  import matplotlib.pyplot as plt
+  fig = plt.figure()
+  draw_walls(plt, walls.T)
+  plt.plot(obs_vec[:, 0], obs_vec[:, 1], 'b-o', alpha=0.3)
+  plt.scatter([obs_vec[0, 0]], [obs_vec[0, 1]], marker='+',
+              color='red', s=200, label='start')
+  plt.scatter([obs_vec[-1, 0]], [obs_vec[-1, 1]], marker='+',
+              color='green', s=200, label='end')
+  plt.scatter([goal[0]], [goal[1]], marker='*',
+              color='green', s=200, label='goal')
+  plt.legend(loc='upper left')
+  plt.savefig(filepath)
+  plt.close(fig)
+
 
 class Pointmass(gym.Env):
   """Abstract class for 2D navigation environments."""
@@ -260,6 +327,9 @@ class Pointmass(gym.Env):
   def __init__(self,
                difficulty=0,
                dense_reward=False,
+               trajectory_plot_freq=0,
+               plot_in_background=True,
+               render_size=(500, 500),
                ):
     """Initialize the point environment.
 
@@ -268,13 +338,11 @@ class Pointmass(gym.Env):
       resize_factor: (int) Scale the map by this factor.
       action_noise: (float) Standard deviation of noise to add to actions. Use 0
         to add no noise.
+      trajectory_plot_freq: (int) Plot the last trajectory to the log dir every
+        this many episodes. With 0, it is only plotted by get_last_trajectory.
+      plot_in_background: (bool) Save trajectory plots from a background process.
+      render_size: (height, width) of the rgb_array frames returned by render.
     """
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    self.plt = plt
-    self.fig = self.plt.figure()
-    
     self.action_dim = self.ac_dim = 2
     self.observation_dim = self.obs_dim = 2
     self.env_name = 'pointmass'
@@ -324,13 +392,25 @@ class Pointmass(gym.Env):
         high=np.array([self._height, self._width]),
         dtype=np.float32)
 
+    self.render_size = render_size
+    # Wall images by frame size, drawn once per layout
+    self._wall_images = {}
+
     self.dense_reward = dense_reward
     self.num_actions = 5
     self.epsilon = resize_factor
     self.action_noise = 0.5
     
-    self.obs_vec = []
+    # Observations of the current episode, grown if an episode runs longer
+    self._obs_buffer = np.empty((self.max_episode_steps + 1, 2))
+    self._obs_len = 0
     self.last_trajectory = None
+    self._last_trajectory_plotted = True
+    self.traj_filepath = None
+    self.trajectory_plot_freq = trajectory_plot_freq
+    self.plot_in_background = plot_in_background
+    self._plot_executor = None
+    self._plot_future = None
     self.difficulty = difficulty
 
     self.num_runs = 0
@@ -342,17 +422,31 @@ class Pointmass(gym.Env):
   def reset(self, seed=None):
     if seed: self.seed(seed)
         
-    if len(self.obs_vec) > 0:
-      self.last_trajectory = self.plot_trajectory()
+    if self._obs_len > 0:
+      self.last_trajectory = self.obs_vec.copy()
+      self._last_trajectory_plotted = False
+      if self.trajectory_plot_freq > 0 and self.num_runs % self.trajectory_plot_freq == 0:
+        self._plot_last_trajectory(skip_if_busy=True)
     
-    self.plt.clf()
     self.timesteps_left = self.max_episode_steps
     
-    self.obs_vec = [self._normalize_obs(self.fixed_start.copy())]
+    self._obs_len = 0
+    self._record_obs(self._normalize_obs(self.fixed_start.copy()))
     self.state = self.fixed_start.copy()
     self.num_runs += 1
     return self._normalize_obs(self.state.copy())
 
+  @property
+  def obs_vec(self):
+    """Normalized observations of the current episode."""
+    return self._obs_buffer[:self._obs_len]
+
+  def _record_obs(self, obs):
+    if self._obs_len == len(self._obs_buffer):
+      self._obs_buffer = np.concatenate([self._obs_buffer, np.empty_like(self._obs_buffer)])
+    self._obs_buffer[self._obs_len] = obs
+    self._obs_len += 1
+
   def set_logdir(self, path):
     self.traj_filepath = path + 'last_traj.png'
     
@@ -430,7 +524,7 @@ class Pointmass(gym.Env):
     dist = np.linalg.norm(self.state - self.fixed_goal)
     done = (dist < self.epsilon) or (self.timesteps_left == 0)
     ns = self._normalize_obs(self.state.copy())
-    self.obs_vec.append(ns.copy())
+    self._record_obs(ns)
     
     if self.dense_reward:
       reward = -dist
@@ -439,6 +533,14 @@ class Pointmass(gym.Env):
     
     return ns, reward, done, {}
 
+  @property
+  def plt(self):
+    """pyplot with the Agg backend, imported on first use by plot_walls."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
   @property
   def walls(self):
     return self._walls
@@ -448,6 +550,7 @@ class Pointmass(gym.Env):
     return self._normalize_obs(self.fixed_goal.copy())
 
   def _compute_apsp(self, walls):
+    import networkx as nx
     (height, width) = walls.shape
     g = nx.Graph()
     # Add all the nodes
@@ -476,49 +579,60 @@ class Pointmass(gym.Env):
 
     return dist
 
-  def render(self, mode=None):
-    self.plot_walls()
-
-    # current and end
-    self.plt.plot(self.fixed_goal[0], self.fixed_goal[1], 'go')
-    self.plt.plot(self.state[0], self.state[1], 'ko')
-    self.plt.pause(0.1)
-
-    img = np.frombuffer(self.fig.canvas.tostring_rgb(), dtype=np.uint8)
-    img = img.reshape(self.fig.canvas.get_width_height()[::-1] + (3,))
+  def render(self, mode=None, height=None, width=None):
+    """Returns an rgb_array frame of the walls, the goal (green) and the
+    agent (black), of size render_size unless height and width are given."""
+    height = height or self.render_size[0]
+    width = width or self.render_size[1]
+    if (height, width) not in self._wall_images:
+      self._wall_images[(height, width)] = rasterize_walls(self._walls, height, width)
+    img = self._wall_images[(height, width)].copy()
+
+    radius = max(min(height, width) / 60.0, 1.5)
+    draw_disk(img, self.goal, radius, GOAL_COLOR)
+    draw_disk(img, self._normalize_obs(self.state), radius, AGENT_COLOR)
     return img
 
   def plot_trajectory(self):
-    self.plt.clf()
-    self.plot_walls()
-
-    obs_vec, goal = np.array(self.obs_vec), self.goal
-    self.plt.plot(obs_vec[:, 0], obs_vec[:, 1], 'b-o', alpha=0.3)
-    self.plt.scatter([obs_vec[0, 0]], [obs_vec[0, 1]], marker='+',
-                color='red', s=200, label='start')
-    self.plt.scatter([obs_vec[-1, 0]], [obs_vec[-1, 1]], marker='+',
-                color='green', s=200, label='end')
-    self.plt.scatter([goal[0]], [goal[1]], marker='*',
-                color='green', s=200, label='goal')
-    self.plt.legend(loc='upper left')
-    self.plt.savefig(self.traj_filepath)
+    """Saves a plot of the current episode to the log dir."""
+    save_trajectory_plot(self._walls, self.obs_vec.copy(), self.goal, self.traj_filepath)
+
+  def _plot_last_trajectory(self, skip_if_busy):
+    if self.traj_filepath is None or self._last_trajectory_plotted:
+      return
+    self._last_trajectory_plotted = True
+    if not self.plot_in_background:
+      save_trajectory_plot(self._walls, self.last_trajectory, self.goal, self.traj_filepath)
+      return
+    if self._plot_future is not None and not self._plot_future.done():
+      if skip_if_busy:
+        # Skip this one rather than queueing plots of old episodes
+        self._last_trajectory_plotted = False
+        return
+      self._plot_future.result()
+    if self._plot_executor is None:
+      self._plot_executor = ProcessPoolExecutor(
+          max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+    self._plot_future = self._plot_executor.submit(
+        save_trajectory_plot, self._walls, self.last_trajectory, self.goal, self.traj_filepath)
 
   def get_last_trajectory(self):
+    """Returns the observations of the last finished episode, and starts
+    saving their plot to the log dir if it hasn't been saved yet."""
+    if self.last_trajectory is not None:
+      self._plot_last_trajectory(skip_if_busy=False)
     return self.last_trajectory
 
+  def close(self):
+    """Waits for the trajectory plots that are still being saved."""
+    if self._plot_executor is not None:
+      self._plot_executor.shutdown(wait=True)
+      self._plot_executor = None
+
   def plot_walls(self, walls=None):
     if walls is None:
       walls = self._walls.T
-    (height, width) = walls.shape
-    for (i, j) in zip(*np.where(walls)):
-      x = np.array([j, j+1]) / float(width)
-      y0 = np.array([i, i]) / float(height)
-      y1 = np.array([i+1, i+1]) / float(height)
-      self.plt.fill_between(x, y0, y1, color='grey')
-    self.plt.xlim([0, 1])
-    self.plt.ylim([0, 1])
-    self.plt.xticks([])
-    self.plt.yticks([])
+    draw_walls(self.plt, walls)
   
   def _sample_normalized_empty_state(self):
     s = self._sample_empty_state()
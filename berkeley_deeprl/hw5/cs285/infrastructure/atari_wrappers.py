@@ -173,3 +173,237 @@ def wrap_deepmind(env):
     env = ProcessFrame84(env)
     env = ClipRewardEnv(env)
     return env
+
+
+class FusedAtariEnv(gym.Wrapper):
+    def __init__(self, env, noop_max=30, skip=4, episodic_life=True, clip_reward=True):
+        """The wrap_deepmind stack in one wrapper.
+        Does the no-op and fire resets, the end-of-life episodes, the frame
+        skip with max-pooling, the grayscale and 84x84 resize and the reward
+        clipping of EpisodicLifeEnv, NoopResetEnv, MaxAndSkipEnv,
+        FireResetEnv, ProcessFrame84 and ClipRewardEnv, with the same
+        results, but without the layers of wrapper calls per frame and with
+        the frames processed in preallocated buffers.
+        """
+        import cv2
+        gym.Wrapper.__init__(self, env)
+        assert env.unwrapped.get_action_meanings()[0] == 'NOOP'
+        self.noop_max = noop_max
+        self.override_num_noops = None
+        self.skip = skip
+        self.episodic_life = episodic_life
+        self.clip_reward = clip_reward
+        self.fire_reset = 'FIRE' in env.unwrapped.get_action_meanings()
+        self.lives = 0
+        self.was_real_done = True
+        self.observation_space = spaces.Box(low=0, high=255, shape=(84, 84, 1), dtype=np.uint8)
+
+        self._resize = cv2.resize
+        self._interpolation = cv2.INTER_LINEAR
+        # the last two raw frames of a step, for max pooling
+        self._frames = np.zeros((2,) + env.observation_space.shape, dtype=np.uint8)
+        self._max_frame = np.zeros(env.observation_space.shape, dtype=np.uint8)
+        self._gray = np.zeros((210, 160), dtype=np.float32)
+        self._channel = np.zeros((210, 160), dtype=np.float32)
+        self._resized = np.zeros((110, 84), dtype=np.float32)
+
+    def _life_step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        self.was_real_done = done
+        if self.episodic_life:
+            lives = self.env.unwrapped.ale.lives()
+            if lives < self.lives and lives > 0:
+                done = True
+            self.lives = lives
+        return obs, reward, done, info
+
+    def _life_reset(self, **kwargs):
+        if self.was_real_done or not self.episodic_life:
+            obs = self.env.reset(**kwargs)
+        else:
+            # no-op step to advance from terminal/lost life state
+            obs, _, _, _ = self.env.step(0)
+        self.lives = self.env.unwrapped.ale.lives()
+        return obs
+
+    def _noop_reset(self, **kwargs):
+        self._life_reset(**kwargs)
+        if self.override_num_noops is not None:
+            noops = self.override_num_noops
+        else:
+            noops = self.unwrapped.np_random.randint(1, self.noop_max + 1) #pylint: disable=E1101
+        obs = None
+        for _ in range(noops):
+            obs, _, done, _ = self._life_step(0)
+            if done:
+                obs = self._life_reset(**kwargs)
+        return obs
+
+    def _skip_step(self, action):
+        total_reward = 0.0
+        done = None
+        info = None
+        for i in range(self.skip):
+            obs, reward, done, info = self._life_step(action)
+            if i >= self.skip - 2:
+                self._frames[i - self.skip + 2] = obs
+            total_reward += reward
+            if done:
+                break
+        # as in MaxAndSkipEnv, an early done leaves frames of the previous step
+        np.maximum(self._frames[0], self._frames[1], out=self._max_frame)
+        return total_reward, done, info
+
+    def _process_frame84(self, frame, out=None):
+        """Same as _process_frame84, with the intermediate arrays reused."""
+        gray, channel = self._gray, self._channel
+        frame = np.reshape(frame, [210, 160, 3])
+        np.multiply(frame[:, :, 0], 0.299, out=gray, dtype=np.float32)
+        np.multiply(frame[:, :, 1], 0.587, out=channel, dtype=np.float32)
+        gray += channel
+        np.multiply(frame[:, :, 2], 0.114, out=channel, dtype=np.float32)
+        gray += channel
+        self._resize(gray, (84, 110), dst=self._resized, interpolation=self._interpolation)
+        if out is None:
+            out = np.empty((84, 84, 1), dtype=np.uint8)
+        np.copyto(out[:, :, 0], self._resized[18:102, :], casting='unsafe')
+        return out
+
+    def reset(self, out=None, **kwargs):
+        """Resets the env. The frame is written into out, a uint8 array of
+        shape (84, 84, 1), when given.
+        """
+        obs = self._noop_reset(**kwargs)
+        if self.fire_reset:
+            _, done, _ = self._skip_step(1)
+            if done:
+                self._noop_reset(**kwargs)
+            _, done, _ = self._skip_step(2)
+            if done:
+                self._noop_reset(**kwargs)
+            obs = self._max_frame
+        return self._process_frame84(obs, out)
+
+    def step(self, action, out=None):
+        """Steps the env. The frame is written into out, a uint8 array of
+        shape (84, 84, 1), when given.
+        """
+        total_reward, done, info = self._skip_step(action)
+        if self.clip_reward:
+            total_reward = np.sign(total_reward)
+        return self._process_frame84(self._max_frame, out), total_reward, done, info
+
+
+def wrap_deepmind_fused(env):
+    """Same as wrap_deepmind, in a single FusedAtariEnv wrapper.
+    """
+    return FusedAtariEnv(env, noop_max=30, skip=4)
+
+
+def make_fused_atari_env(env_name, seed=None):
+    """Makes a wrap_deepmind_fused env. A module level function, so it can be
+    passed to SubprocAtariVecEnv with functools.partial.
+    """
+    env = gym.make(env_name)
+    if seed is not None:
+        env.seed(seed)
+    return wrap_deepmind_fused(env)
+
+
+def _vec_env_worker(remote, parent_remote, env_fn, shared_obs, num_envs, index):
+    parent_remote.close()
+    obs = np.frombuffer(shared_obs, dtype=np.uint8).reshape(num_envs, 84, 84, 1)[index]
+    env = env_fn()
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                _, reward, done, info = env.step(data, out=obs)
+                if done:
+                    env.reset(out=obs)
+                remote.send((reward, done, info))
+            elif cmd == 'reset':
+                env.reset(out=obs)
+                remote.send(None)
+            elif cmd == 'seed':
+                env.seed(data)
+                remote.send(None)
+            elif cmd == 'get_spaces':
+                remote.send((env.observation_space, env.action_space))
+            elif cmd == 'close':
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        env.close()
+        remote.close()
+
+
+class SubprocAtariVecEnv(object):
+    def __init__(self, env_fns):
+        """Steps len(env_fns) FusedAtariEnvs, each in its own process.
+        env_fns are picklable functions returning a FusedAtariEnv, e.g.
+        functools.partial(make_fused_atari_env, 'PongNoFrameskip-v4', seed).
+
+        The workers write their frames into shared memory, reset() and step()
+        return them stacked in a uint8 array of shape (N, 84, 84). The array
+        is overwritten by the next call, copy it to keep it. An env that is
+        done is reset by its worker, and the frame returned is the first one
+        of the next episode.
+        """
+        import multiprocessing
+        ctx = multiprocessing.get_context('spawn')
+        self.num_envs = len(env_fns)
+        shared_obs = ctx.RawArray('B', self.num_envs * 84 * 84)
+        self.obs = np.frombuffer(shared_obs, dtype=np.uint8).reshape(self.num_envs, 84, 84)
+        self.remotes, work_remotes = zip(*[ctx.Pipe() for _ in range(self.num_envs)])
+        self.processes = [
+            ctx.Process(target=_vec_env_worker,
+                        args=(work_remote, remote, env_fn, shared_obs, self.num_envs, index),
+                        daemon=True)
+            for index, (work_remote, remote, env_fn) in enumerate(zip(work_remotes, self.remotes, env_fns))]
+        for process in self.processes:
+            process.start()
+        for work_remote in work_remotes:
+            work_remote.close()
+        self.closed = False
+
+        self.remotes[0].send(('get_spaces', None))
+        self.observation_space, self.action_space = self.remotes[0].recv()
+
+    def seed(self, seeds):
+        for remote, seed in zip(self.remotes, seeds):
+            remote.send(('seed', seed))
+        for remote in self.remotes:
+            remote.recv()
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        for remote in self.remotes:
+            remote.recv()
+        return self.obs
+
+    def step_async(self, actions):
+        for remote, action in zip(self.remotes, actions):
+            remote.send(('step', action))
+
+    def step_wait(self):
+        rewards, dones, infos = zip(*[remote.recv() for remote in self.remotes])
+        return self.obs, np.array(rewards, dtype=np.float32), np.array(dones, dtype=np.bool_), list(infos)
+
+    def step(self, actions):
+        """Steps every env with its action, and returns the stacked frames,
+        rewards and dones, and the list of infos.
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+        self.closed = True
@@ -0,0 +1,239 @@
+"""
+Checkpoints of the complete training state, so preempted runs can resume.
+
+Checkpoints alternate between two generations, gen0/ and gen1/, each holding:
+    state.pt         the state dicts of every network, optimizer and learning
+                     rate scheduler of the agent, the agent's step counters,
+                     the trainer's counters, the random number generators and
+                     the num_stored of the replay buffer
+    buffer/          the MemoryOptimizedReplayBuffer, as raw .npy arrays, or
+                     the compressed frames of a CompressedReplayBuffer
+                     (see dqn_utils.write_buffer_checkpoint)
+checkpoint.json, replaced once a generation is completely written, holds the
+iteration and generation of the last complete checkpoint. A write that is
+interrupted only leaves the other generation incomplete.
+
+The replay buffer is written incrementally: only the rows stored since the
+generation was last written are written into its files. A generation that
+holds no buffer yet starts from a copy of the other one. The very first
+buffer checkpoint is written from the buffer's arrays before training
+continues, instead of copying the whole buffer. Otherwise the state is
+copied when save() is called and written in a background thread.
+On resume the buffer is memory-mapped from the checkpoint, and the env is
+reset, ending the episode that was running in the buffer.
+"""
+import collections
+import copy
+import json
+import os
+import random
+import threading
+
+import numpy as np
+import torch
+from torch import nn
+from torch import optim
+
+from cs285.infrastructure.dqn_utils import (
+        MemoryOptimizedReplayBuffer,
+        read_buffer_checkpoint_meta,
+        write_buffer_checkpoint,
+)
+
+# Step counters of the agents. The exploration and learning rate schedules
+# are functions of agent.t, so they resume from the same point.
+AGENT_COUNTERS = ['t', 'num_param_updates']
+
+STATEFUL_TYPES = (nn.Module, optim.Optimizer, optim.lr_scheduler._LRScheduler)
+
+# Packages whose objects are searched for networks and optimizers
+AGENT_PACKAGES = ('cs285.agents', 'cs285.critics', 'cs285.policies', 'cs285.exploration')
+
+
+def find_stateful_objects(agent):
+    """
+    Returns the networks, optimizers and learning rate schedulers reachable
+    from the agent through the attributes of the agent, critics, policies
+    and exploration models, keyed by their attribute path, e.g.
+    'exploitation_critic.optimizer'. An object reachable from several paths
+    is keyed by the shortest one, so a policy pointing to one of the agent's
+    critics doesn't change the keys.
+    """
+    found = {}
+    seen = {id(agent)}
+    queue = collections.deque([('', agent)])
+    while queue:
+        prefix, obj = queue.popleft()
+        for name, value in sorted(vars(obj).items()):
+            if id(value) in seen:
+                continue
+            if isinstance(value, STATEFUL_TYPES):
+                seen.add(id(value))
+                found[prefix + name] = value
+            # Modules are saved whole, but can hold optimizers as attributes
+            if isinstance(value, nn.Module) or type(value).__module__.startswith(AGENT_PACKAGES):
+                seen.add(id(value))
+                queue.append((prefix + name + '.', value))
+    return found
+
+
+def _snapshot(agent, itr, trainer_state):
+    return {
+        'itr': itr,
+        'trainer': copy.deepcopy(trainer_state),
+        'agent': {name: getattr(agent, name) for name in AGENT_COUNTERS if hasattr(agent, name)},
+        'state_dicts': {key: copy.deepcopy(obj.state_dict())
+                        for key, obj in find_stateful_objects(agent).items()},
+        'rng': {
+            'random': random.getstate(),
+            'numpy': np.random.get_state(),
+            'torch': torch.get_rng_state(),
+        },
+    }
+
+
+def _replace_json(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+
+class Checkpointer(object):
+    """
+    Saves checkpoints of an agent to dirname, alternating between two
+    generations. Only one checkpoint is written at a time, save() waits for
+    the previous write to finish.
+    """
+
+    def __init__(self, dirname, background=True):
+        self.dirname = dirname
+        self.background = background
+        self.thread = None
+        self.error = None
+        # Generation of the last complete checkpoint
+        self.generation = None
+        # num_stored of the replay buffer in the files of each generation, or
+        # None if they hold no complete buffer, so only the changes are written
+        self.buffer_num_stored = [None, None]
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.dirname, 'checkpoint.json'))
+
+    def _generation_dir(self, generation):
+        return os.path.join(self.dirname, 'gen{}'.format(generation))
+
+    def save(self, itr, agent, trainer_state):
+        """
+        Checkpoints the agent after iteration itr, with trainer_state, a dict
+        of the trainer's attributes to restore.
+        """
+        self.wait()
+        generation = 0 if self.generation is None else 1 - self.generation
+        state = _snapshot(agent, itr, trainer_state)
+        buffer = None
+        base_dirname = None
+        replay_buffer = getattr(agent, 'replay_buffer', None)
+        if isinstance(replay_buffer, MemoryOptimizedReplayBuffer):
+            state['buffer_num_stored'] = replay_buffer.num_stored
+            since = self.buffer_num_stored[generation]
+            if since is None and self.generation is not None:
+                since = self.buffer_num_stored[self.generation]
+                base_dirname = os.path.join(self._generation_dir(self.generation), 'buffer')
+            if since is not None and replay_buffer.num_stored - since >= replay_buffer.size:
+                # Every row changed
+                since = base_dirname = None
+            if since is None:
+                # Written from the buffer's arrays, copying them could take
+                # as much memory as the buffer itself
+                self._write(generation, state, replay_buffer.get_checkpoint(copy=False))
+                self._raise_error()
+                return
+            buffer = replay_buffer.get_checkpoint(since)
+
+        if not self.background:
+            self._write(generation, state, buffer, base_dirname)
+            self._raise_error()
+            return
+        self.thread = threading.Thread(target=self._write,
+                                       args=(generation, state, buffer, base_dirname))
+        self.thread.start()
+
+    def _write(self, generation, state, buffer, base_dirname=None):
+        try:
+            dirname = self._generation_dir(generation)
+            self.buffer_num_stored[generation] = None
+            os.makedirs(dirname, exist_ok=True)
+            torch.save(state, os.path.join(dirname, 'state.pt'))
+            if buffer is not None:
+                write_buffer_checkpoint(os.path.join(dirname, 'buffer'), buffer, base_dirname)
+            _replace_json(os.path.join(self.dirname, 'checkpoint.json'),
+                          {'itr': state['itr'], 'generation': generation,
+                           'has_buffer': buffer is not None})
+            self.generation = generation
+            if buffer is not None:
+                self.buffer_num_stored[generation] = buffer['meta']['num_stored']
+        except Exception as e:
+            self.error = e
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('Writing the checkpoint to {} failed'.format(self.dirname)) from error
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self._raise_error()
+
+    def load(self, agent, mmap_mode='c'):
+        """
+        Restores the agent from the checkpoint, and returns the iteration it
+        was saved at and the trainer state.
+        """
+        self.wait()
+        with open(os.path.join(self.dirname, 'checkpoint.json')) as f:
+            info = json.load(f)
+        generation = info['generation']
+        dirname = self._generation_dir(generation)
+        state = torch.load(os.path.join(dirname, 'state.pt'), map_location='cpu')
+
+        buffer_meta = None
+        if info['has_buffer']:
+            buffer_meta = read_buffer_checkpoint_meta(os.path.join(dirname, 'buffer'))
+            if buffer_meta is None or buffer_meta['num_stored'] != state['buffer_num_stored']:
+                raise RuntimeError('The replay buffer in {} does not match the checkpoint state'.format(dirname))
+
+        stateful = find_stateful_objects(agent)
+        missing = set(state['state_dicts']) ^ set(stateful)
+        assert not missing, 'The checkpoint does not match the agent: {}'.format(sorted(missing))
+        for key, obj in stateful.items():
+            obj.load_state_dict(state['state_dicts'][key])
+        for name, value in state['agent'].items():
+            setattr(agent, name, value)
+
+        random.setstate(state['rng']['random'])
+        np.random.set_state(state['rng']['numpy'])
+        torch.set_rng_state(state['rng']['torch'])
+
+        self.generation = generation
+        self.buffer_num_stored = [None, None]
+        if buffer_meta is not None:
+            buffer = agent.replay_buffer
+            buffer.load_checkpoint(os.path.join(dirname, 'buffer'), mmap_mode=mmap_mode)
+            # The next checkpoints only write the rows stored since those in
+            # the files of each generation
+            self.buffer_num_stored[generation] = buffer.num_stored
+            other_meta = read_buffer_checkpoint_meta(
+                os.path.join(self._generation_dir(1 - generation), 'buffer'))
+            if other_meta is not None and other_meta['num_stored'] <= buffer.num_stored:
+                self.buffer_num_stored[1 - generation] = other_meta['num_stored']
+            if buffer.num_in_buffer > 0:
+                buffer.done[(buffer.next_idx - 1) % buffer.size] = True
+        if hasattr(agent, 'last_obs'):
+            agent.last_obs = agent.env.reset()
+
+        return state['itr'], state['trainer']
+
+    def close(self):
+        self.wait()
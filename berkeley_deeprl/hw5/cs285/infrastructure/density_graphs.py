@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+from cs285.infrastructure import pytorch_util as ptu
+
+TITLES = {
+    'state_density': 'State Density',
+    'rnd_value': 'RND Value',
+    'exploitation_value': 'Predicted Exploitation Value',
+    'exploration_value': 'Predicted Exploration Value',
+}
+
+
+def compute_density_graphs(agent, grid_size=50):
+    """
+    Computes the state density of the agent's replay buffer, and the RND
+    error and the mean values of both critics on a grid_size x grid_size
+    grid of [0, 1]^2, oriented for imshow.
+
+    Returns a dict from graph name to array, or None if the buffer is empty.
+    """
+    replay_buffer = agent.replay_buffer
+    H = replay_buffer.state_density()
+    if H is None:
+        num_states = replay_buffer.num_in_buffer - 2
+        if num_states <= 0:
+            return None
+        states = replay_buffer.obs[:num_states]
+        H, _, _ = np.histogram2d(states[:, 0], states[:, 1], range=[[0., 1.], [0., 1.]], density=True)
+
+    # The three networks are evaluated on the same grid in one pass
+    ii, jj = np.meshgrid(np.linspace(0, 1, grid_size), np.linspace(0, 1, grid_size))
+    obs = np.stack([ii.flatten(), jj.flatten()], axis=1)
+    with torch.no_grad():
+        obs = ptu.from_numpy(obs)
+        values = torch.stack([
+            agent.exploration_model(obs),
+            agent.exploitation_critic.q_net(obs).mean(-1),
+            agent.exploration_critic.q_net(obs).mean(-1),
+        ])
+    rnd_value, exploitation_value, exploration_value = ptu.to_numpy(values).reshape((3,) + ii.shape)
+
+    return {
+        'state_density': np.rot90(H),
+        'rnd_value': rnd_value[::-1],
+        'exploitation_value': exploitation_value[::-1],
+        'exploration_value': exploration_value[::-1],
+    }
+
+
+def save_density_graphs(logdir, graphs):
+    """
+    Saves the graphs as curr_<name>.png in logdir. Uses its own figure, so it
+    can run in a background process.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    for name, values in graphs.items():
+        plt.clf()
+        interpolation = 'bicubic' if name == 'state_density' else None
+        plt.imshow(values, interpolation=interpolation)
+        plt.colorbar()
+        plt.title(TITLES.get(name, name))
+        fig.savefig(os.path.join(logdir, 'curr_{}.png'.format(name)), bbox_inches='tight')
+    plt.close(fig)
+
+
+class DensityGraphWriter(object):
+    """
+    Saves the arrays of each dump as <logdir>/density_graphs/<name>_<itr>.npy,
+    and renders the latest ones to curr_<name>.png in a background process.
+    A rendering that is due while the previous one is still running is
+    skipped, the arrays are always saved.
+    """
+
+    def __init__(self, logdir, render_in_background=True):
+        self.logdir = logdir
+        self.array_dir = os.path.join(logdir, 'density_graphs')
+        os.makedirs(self.array_dir, exist_ok=True)
+        self.render_in_background = render_in_background
+        self.executor = None
+        self.future = None
+
+    def write(self, itr, graphs):
+        for name, values in graphs.items():
+            np.save(os.path.join(self.array_dir, '{}_{}.npy'.format(name, itr)), values)
+
+        if not self.render_in_background:
+            save_density_graphs(self.logdir, graphs)
+            return
+        if self.future is not None and not self.future.done():
+            return
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        self.future = self.executor.submit(save_density_graphs, self.logdir, graphs)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
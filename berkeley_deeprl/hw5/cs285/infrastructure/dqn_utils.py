@@ -1,7 +1,13 @@
 """This file includes a collection of utility functions that are useful for
 implementing DQN."""
+import functools
+import json
+import os
 import random
-from collections import namedtuple
+import shutil
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import pdb
 
 import gym
@@ -9,7 +15,7 @@ import numpy as np
 from torch import nn
 import torch.optim as optim
 
-from cs285.infrastructure.atari_wrappers import wrap_deepmind
+from cs285.infrastructure.atari_wrappers import wrap_deepmind_fused
 from gym.envs.registration import register
 
 import torch
@@ -72,7 +78,7 @@ def get_env_kwargs(env_name):
             'learning_freq': 4,
             'grad_norm_clipping': 10,
             'input_shape': (84, 84, 4),
-            'env_wrappers': wrap_deepmind,
+            'env_wrappers': wrap_deepmind_fused,
             'frame_history_len': 4,
             'gamma': 0.99,
         }
@@ -391,7 +397,10 @@ def get_wrapper_by_name(env, classname):
             raise ValueError("Couldn't find wrapper named %s"%classname)
 
 class MemoryOptimizedReplayBuffer(object):
-    def __init__(self, size, frame_history_len, lander=False, float_obs=False):
+    # Arrays of one row per slot, written by write_buffer_checkpoint
+    checkpoint_arrays = ['obs', 'action', 'reward', 'done']
+
+    def __init__(self, size, frame_history_len, lander=False, float_obs=False, state_histogram_bins=None):
         """This is a memory efficient implementation of the replay buffer.
 
         The sepecific memory optimizations use here are:
@@ -416,14 +425,28 @@ class MemoryOptimizedReplayBuffer(object):
             overflows the old memories are dropped.
         frame_history_len: int
             Number of memories to be retried for each observation.
+        state_histogram_bins: int
+            If set, and frames are 2D states in [0, 1]^2, the buffer keeps a
+            histogram of the stored states with this many bins per dimension,
+            updated as frames are stored and overwritten.
+
+        The buffer can be checkpointed with `get_checkpoint` and
+        `write_buffer_checkpoint`, and memory-mapped back in with
+        `load_checkpoint`.
+
+        CompressedReplayBuffer stores the frames compressed instead.
         """
         self.float_obs = lander or float_obs
+        self.state_histogram_bins = state_histogram_bins
+        self.state_counts = None
 
         self.size = size
         self.frame_history_len = frame_history_len
 
         self.next_idx      = 0
         self.num_in_buffer = 0
+        # Frames stored since the buffer was created
+        self.num_stored    = 0
 
         self.obs      = None
         self.action   = None
@@ -540,14 +563,37 @@ class MemoryOptimizedReplayBuffer(object):
             self.action   = np.empty([self.size],                     dtype=np.int32)
             self.reward   = np.empty([self.size],                     dtype=np.float32)
             self.done     = np.empty([self.size],                     dtype=np.bool)
+            if self.state_histogram_bins is not None and frame.shape == (2,):
+                self.state_counts = np.zeros([self.state_histogram_bins] * 2, dtype=np.int64)
+        if self.state_counts is not None:
+            if self.num_in_buffer == self.size:
+                self._update_state_counts(self.obs[self.next_idx], -1)
+            self._update_state_counts(frame, 1)
         self.obs[self.next_idx] = frame
 
         ret = self.next_idx
         self.next_idx = (self.next_idx + 1) % self.size
         self.num_in_buffer = min(self.size, self.num_in_buffer + 1)
+        self.num_stored += 1
 
         return ret
 
+    def _update_state_counts(self, state, delta):
+        # Same bins as np.histogram2d over [0, 1]^2, the last one includes 1
+        if np.all((state >= 0) & (state <= 1)):
+            i, j = np.minimum((np.asarray(state) * self.state_histogram_bins).astype(int),
+                              self.state_histogram_bins - 1)
+            self.state_counts[i, j] += delta
+
+    def state_density(self):
+        """Returns the density histogram of the stored states, like
+        np.histogram2d(..., range=[[0., 1.], [0., 1.]], density=True), or
+        None if the buffer doesn't keep one."""
+        if self.state_counts is None or self.state_counts.sum() == 0:
+            return None
+        bin_area = 1.0 / self.state_histogram_bins ** 2
+        return self.state_counts / (self.state_counts.sum() * bin_area)
+
     def store_effect(self, idx, action, reward, done):
         """Store effects of action taken after obeserving frame stored
         at index idx. The reason `store_frame` and `store_effect` is broken
@@ -568,3 +614,429 @@ class MemoryOptimizedReplayBuffer(object):
         self.action[idx] = action
         self.reward[idx] = reward
         self.done[idx]   = done
+
+    def get_checkpoint(self, since=None, copy=True):
+        """Returns the part of the buffer that changed since a checkpoint,
+        for `write_buffer_checkpoint`.
+
+        Parameters
+        ----------
+        since: int
+            `num_stored` of the buffer at the checkpoint to update, or None to
+            return the whole buffer and start a new checkpoint.
+        copy: bool
+            Copy the changed rows, so the buffer can keep being used while
+            they are written. Otherwise the rows are views of the buffer and
+            have to be written before it is used again.
+
+        Returns
+        -------
+        checkpoint: dict
+            'meta': the indices and array formats, as a json-able dict
+            'chunks': a list of (start, {array name: rows}) to write
+            'state_counts': the state histogram, or None
+        """
+        assert since is None or since <= self.num_stored, \
+            'The checkpoint is newer than the buffer'
+        meta = {
+            'size': self.size,
+            'frame_history_len': self.frame_history_len,
+            'next_idx': self.next_idx,
+            'num_in_buffer': self.num_in_buffer,
+            'num_stored': self.num_stored,
+            'arrays': {},
+        }
+        chunks = []
+        if self.action is not None:
+            for name in self.checkpoint_arrays:
+                array = getattr(self, name)
+                meta['arrays'][name] = {'shape': list(array.shape), 'dtype': array.dtype.str}
+            if since is None or since == 0:
+                num_changed = self.num_in_buffer
+            else:
+                # The effect of the last frame of the checkpoint may have been
+                # stored after it, so that row is written again
+                num_changed = min(self.num_in_buffer, self.num_stored - since + 1)
+            start = (self.next_idx - num_changed) % self.size
+            # The changed rows wrap around the end of the ring at most once
+            for chunk_start, chunk_end in [(start, min(start + num_changed, self.size)),
+                                           (0, max(start + num_changed - self.size, 0))]:
+                if chunk_end > chunk_start:
+                    chunks.append((chunk_start, {
+                        name: getattr(self, name)[chunk_start:chunk_end]
+                        for name in meta['arrays']}))
+        state_counts = self.state_counts
+        if copy:
+            chunks = [(start, {name: rows.copy() for name, rows in arrays.items()})
+                      for start, arrays in chunks]
+            state_counts = None if state_counts is None else state_counts.copy()
+        return {'meta': meta, 'chunks': chunks, 'state_counts': state_counts}
+
+    def load_checkpoint(self, dirname, mmap_mode='c'):
+        """Loads a buffer written by `write_buffer_checkpoint`. The arrays
+        are memory-mapped, with the default copy-on-write mode the files are
+        not modified and only the rows that are overwritten are copied into
+        memory."""
+        meta = read_buffer_checkpoint_meta(dirname)
+        assert meta is not None, 'No complete buffer checkpoint in {}'.format(dirname)
+        assert meta['size'] == self.size and meta['frame_history_len'] == self.frame_history_len, \
+            'The checkpoint is of a buffer with a different size or frame history'
+        for name in meta['arrays']:
+            setattr(self, name, np.load(os.path.join(dirname, name + '.npy'), mmap_mode=mmap_mode))
+        self.next_idx = meta['next_idx']
+        self.num_in_buffer = meta['num_in_buffer']
+        self.num_stored = meta['num_stored']
+        state_counts_path = os.path.join(dirname, 'state_counts.npy')
+        if os.path.exists(state_counts_path):
+            self.state_counts = np.load(state_counts_path)
+
+
+def read_buffer_checkpoint_meta(dirname):
+    """Returns the buffer.json of a buffer checkpoint, or None if dirname
+    holds no complete one."""
+    path = os.path.join(dirname, 'buffer.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_buffer_checkpoint(dirname, checkpoint, base_dirname=None):
+    """Writes a checkpoint from `MemoryOptimizedReplayBuffer.get_checkpoint`
+    to dirname, as one .npy file per array of the buffer and a buffer.json
+    with the indices. The arrays are written in place, so an incremental
+    checkpoint only writes the changed rows. The frames of a
+    CompressedReplayBuffer are written whole, as they are compressed.
+    buffer.json is removed first and written last, so an interrupted write
+    leaves no complete checkpoint.
+
+    With base_dirname, the arrays of the checkpoint there are copied first,
+    and the changed rows are written on top of them.
+    """
+    os.makedirs(dirname, exist_ok=True)
+    meta_path = os.path.join(dirname, 'buffer.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    meta = checkpoint['meta']
+    for name, spec in meta['arrays'].items():
+        path = os.path.join(dirname, name + '.npy')
+        shape, dtype = tuple(spec['shape']), np.dtype(spec['dtype'])
+        if base_dirname is not None:
+            # Replaced rather than overwritten, as the file may be mapped
+            shutil.copyfile(os.path.join(base_dirname, name + '.npy'), path + '.tmp')
+            os.replace(path + '.tmp', path)
+        if os.path.exists(path):
+            array = np.load(path, mmap_mode='r+')
+            if array.shape != shape or array.dtype != dtype:
+                del array
+                os.remove(path)
+        if not os.path.exists(path):
+            array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+        for start, rows in checkpoint['chunks']:
+            array[start:start + len(rows[name])] = rows[name]
+        array.flush()
+        del array
+    if checkpoint['state_counts'] is not None:
+        np.save(os.path.join(dirname, 'state_counts.npy'), checkpoint['state_counts'])
+    frames = checkpoint.get('frames')
+    if frames is not None:
+        # Compressed chunks vary in size, so they are all rewritten, as one
+        # file with their lengths alongside, 0 for chunks never closed
+        with open(os.path.join(dirname, 'frames.bin.tmp'), 'wb') as f:
+            for data in frames['chunks']:
+                if data is not None:
+                    f.write(data)
+        os.replace(os.path.join(dirname, 'frames.bin.tmp'), os.path.join(dirname, 'frames.bin'))
+        np.save(os.path.join(dirname, 'frame_chunks.npy'),
+                np.array([0 if data is None else len(data) for data in frames['chunks']], dtype=np.int64))
+        if frames['open_frames'] is not None:
+            np.save(os.path.join(dirname, 'open_frames.npy'), frames['open_frames'])
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_path + '.tmp', meta_path)
+
+
+def get_frame_codec(codec):
+    """Returns the (compress, decompress) functions of bytes of the codec:
+    'lz4' (needs the lz4 package), 'zstd' (needs zstandard) or 'zlib'."""
+    if codec == 'lz4':
+        import lz4.frame
+        return lz4.frame.compress, lz4.frame.decompress
+    if codec == 'zstd':
+        import zstandard
+        # The decompressor is made per call, as it is used from two threads
+        return (zstandard.ZstdCompressor(level=3).compress,
+                lambda data: zstandard.ZstdDecompressor().decompress(data))
+    if codec == 'zlib':
+        import zlib
+        return functools.partial(zlib.compress, level=1), zlib.decompress
+    raise ValueError('Unknown frame codec {!r}, use lz4, zstd or zlib'.format(codec))
+
+
+class CompressedReplayBuffer(MemoryOptimizedReplayBuffer):
+    # The frames are checkpointed compressed instead of as rows
+    checkpoint_arrays = ['action', 'reward', 'done']
+
+    def __init__(self, size, frame_history_len, lander=False, float_obs=False, state_histogram_bins=None,
+                 codec='lz4', chunk_size=8, cache_chunks=512, prefetch=True):
+        """MemoryOptimizedReplayBuffer with the frames stored compressed.
+
+        The frames are compressed in chunks of `chunk_size` consecutive
+        buffer slots. The chunk being written is kept uncompressed and is
+        compressed when it is full. Chunks that are read are decompressed
+        into an LRU cache of `cache_chunks` chunks. With `prefetch`, the
+        indices of the next batch are drawn at the end of `sample`, and their
+        chunks are decompressed in a worker thread while the agent steps the
+        env and trains, so the next batch can only contain transitions stored
+        before the current `sample`.
+
+        Atari frames compress 5-10x, so the 1M frames of the typical Atari
+        buffer take about 1 gigabyte, plus 512 * 8 * 84 * 84 bytes ~= 29
+        megabytes of cache. Small chunks keep the decompression of a batch,
+        which touches up to 2 chunks per transition, cheap.
+
+        Parameters
+        ----------
+        codec: str
+            'lz4', 'zstd' or 'zlib', see `get_frame_codec`.
+        chunk_size: int
+            Number of consecutive frames compressed together.
+        cache_chunks: int
+            Number of decompressed chunks kept, should hold the chunks of a
+            batch, up to 2 per sampled transition.
+        prefetch: bool
+            Decompress the chunks of the next batch in a worker thread.
+
+        The other parameters are the same as MemoryOptimizedReplayBuffer's.
+        """
+        super(CompressedReplayBuffer, self).__init__(
+            size, frame_history_len, lander=lander, float_obs=float_obs,
+            state_histogram_bins=state_histogram_bins)
+        self.codec = codec
+        self.compress, self.decompress = get_frame_codec(codec)
+        self.chunk_size = chunk_size
+        self.cache_chunks = cache_chunks
+        self.prefetch = prefetch
+
+        self.frame_shape = None
+        self.frame_dtype = None
+        # Compressed bytes of each chunk, None for the open chunk and the
+        # chunks not written yet
+        self.chunks = [None] * ((size + chunk_size - 1) // chunk_size)
+        self.open_chunk = None
+        self.open_frames = None
+        self.cache = OrderedDict()
+        # Guards self.chunks and self.cache, shared with the prefetch thread
+        self.lock = threading.Lock()
+
+        self.executor = None
+        self.prefetch_future = None
+        self.next_idxes = None
+
+    def _chunk_len(self, chunk):
+        return min(self.chunk_size, self.size - chunk * self.chunk_size)
+
+    def _load_chunk(self, chunk):
+        """Returns the frames of a closed chunk, from the cache or decompressed
+        into it. None if the chunk isn't closed."""
+        with self.lock:
+            frames = self.cache.get(chunk)
+            if frames is not None:
+                self.cache.move_to_end(chunk)
+                return frames
+            data = self.chunks[chunk]
+        if data is None:
+            return None
+        frames = np.frombuffer(self.decompress(data), dtype=self.frame_dtype).reshape(
+            (-1,) + self.frame_shape)
+        with self.lock:
+            # The chunk may have been reopened for writing in the meantime
+            if self.chunks[chunk] is data:
+                self._cache_put(chunk, frames)
+        return frames
+
+    def _cache_put(self, chunk, frames):
+        self.cache[chunk] = frames
+        self.cache.move_to_end(chunk)
+        while len(self.cache) > self.cache_chunks:
+            self.cache.popitem(last=False)
+
+    def _get_frame(self, idx):
+        chunk, offset = divmod(idx, self.chunk_size)
+        if chunk == self.open_chunk:
+            return self.open_frames[offset]
+        frames = self._load_chunk(chunk)
+        assert frames is not None, 'Frame {} was never stored'.format(idx)
+        return frames[offset]
+
+    def _open_chunk(self, chunk):
+        # The slots of the chunk not overwritten yet keep their old frames
+        old_frames = self._load_chunk(chunk)
+        with self.lock:
+            self.chunks[chunk] = None
+            self.cache.pop(chunk, None)
+        if old_frames is not None:
+            self.open_frames[:len(old_frames)] = old_frames
+        self.open_chunk = chunk
+
+    def _close_chunk(self):
+        chunk = self.open_chunk
+        frames = self.open_frames[:self._chunk_len(chunk)]
+        data = self.compress(frames.tobytes())
+        with self.lock:
+            self.chunks[chunk] = data
+            # The latest frames are read for the next observations
+            self._cache_put(chunk, frames.copy())
+        self.open_chunk = None
+
+    def _encode_observation(self, idx):
+        end_idx   = idx + 1 # make noninclusive
+        start_idx = end_idx - self.frame_history_len
+        # low-dimensional observations, such as RAM state, are returned directly
+        if len(self.frame_shape) == 1:
+            return self._get_frame((end_idx - 1) % self.size)
+        # if there weren't enough frames ever in the buffer for context
+        if start_idx < 0 and self.num_in_buffer != self.size:
+            start_idx = 0
+        for idx in range(start_idx, end_idx - 1):
+            if self.done[idx % self.size]:
+                start_idx = idx + 1
+        missing_context = self.frame_history_len - (end_idx - start_idx)
+        frames = [np.zeros(self.frame_shape, dtype=self.frame_dtype) for _ in range(missing_context)]
+        for idx in range(start_idx, end_idx):
+            frames.append(self._get_frame(idx % self.size))
+        return np.concatenate(frames, 2)
+
+    def _prefetch_chunks(self, idxes):
+        chunks = set()
+        for idx in idxes:
+            # The frames of the observation and the next observation
+            for frame_idx in (idx - self.frame_history_len + 1, idx + 1):
+                chunks.add((frame_idx % self.size) // self.chunk_size)
+        for chunk in sorted(chunks):
+            if chunk != self.open_chunk:
+                self._load_chunk(chunk)
+
+    def _draw_idxes(self, batch_size):
+        return sample_n_unique(lambda: random.randint(0, self.num_in_buffer - 2), batch_size)
+
+    def sample(self, batch_size):
+        """Same as MemoryOptimizedReplayBuffer.sample. With prefetch, the
+        transitions were drawn, and their frames decompressed, after the
+        previous call."""
+        assert self.can_sample(batch_size)
+        if self.prefetch_future is not None:
+            self.prefetch_future.result()
+            self.prefetch_future = None
+        idxes = self.next_idxes
+        if idxes is None or len(idxes) != batch_size:
+            idxes = self._draw_idxes(batch_size)
+        batch = self._encode_sample(idxes)
+
+        self.next_idxes = None
+        if self.prefetch:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1)
+            self.next_idxes = self._draw_idxes(batch_size)
+            self.prefetch_future = self.executor.submit(self._prefetch_chunks, self.next_idxes)
+        return batch
+
+    def store_frame(self, frame):
+        """Same as MemoryOptimizedReplayBuffer.store_frame."""
+        if self.open_frames is None:
+            self.frame_shape = tuple(frame.shape)
+            self.frame_dtype = np.dtype(np.float32 if self.float_obs else np.uint8)
+            self.open_frames = np.zeros((self.chunk_size,) + self.frame_shape, dtype=self.frame_dtype)
+            self.action   = np.empty([self.size],                     dtype=np.int32)
+            self.reward   = np.empty([self.size],                     dtype=np.float32)
+            self.done     = np.empty([self.size],                     dtype=np.bool)
+            if self.state_histogram_bins is not None and frame.shape == (2,):
+                self.state_counts = np.zeros([self.state_histogram_bins] * 2, dtype=np.int64)
+        if self.state_counts is not None:
+            if self.num_in_buffer == self.size:
+                self._update_state_counts(self._get_frame(self.next_idx), -1)
+            self._update_state_counts(frame, 1)
+
+        chunk, offset = divmod(self.next_idx, self.chunk_size)
+        if chunk != self.open_chunk:
+            self._open_chunk(chunk)
+        self.open_frames[offset] = frame
+        if offset + 1 == self._chunk_len(chunk):
+            self._close_chunk()
+
+        ret = self.next_idx
+        self.next_idx = (self.next_idx + 1) % self.size
+        self.num_in_buffer = min(self.size, self.num_in_buffer + 1)
+        self.num_stored += 1
+
+        return ret
+
+    def frame_nbytes(self):
+        """Returns the bytes taken by the frames: the compressed chunks, the
+        open chunk and the cache."""
+        with self.lock:
+            nbytes = sum(len(data) for data in self.chunks if data is not None)
+            nbytes += sum(frames.nbytes for frames in self.cache.values())
+        if self.open_frames is not None:
+            nbytes += self.open_frames.nbytes
+        return nbytes
+
+    def get_checkpoint(self, since=None, copy=True):
+        """Same as MemoryOptimizedReplayBuffer.get_checkpoint, with all the
+        compressed chunks and the open chunk under 'frames'. The chunks are
+        bytes, so only the list of them is copied."""
+        checkpoint = super(CompressedReplayBuffer, self).get_checkpoint(since, copy)
+        checkpoint['meta']['frames'] = {
+            'codec': self.codec,
+            'chunk_size': self.chunk_size,
+            'shape': None if self.frame_shape is None else list(self.frame_shape),
+            'dtype': None if self.frame_dtype is None else self.frame_dtype.str,
+            'open_chunk': self.open_chunk,
+        }
+        with self.lock:
+            chunks = list(self.chunks)
+        open_frames = self.open_frames
+        if copy and open_frames is not None:
+            open_frames = open_frames.copy()
+        checkpoint['frames'] = {'chunks': chunks, 'open_frames': open_frames}
+        return checkpoint
+
+    def load_checkpoint(self, dirname, mmap_mode='c'):
+        """Same as MemoryOptimizedReplayBuffer.load_checkpoint. The
+        compressed frames are read into memory."""
+        meta = read_buffer_checkpoint_meta(dirname)
+        assert meta is not None and 'frames' in meta, \
+            'No complete compressed buffer checkpoint in {}'.format(dirname)
+        frames_meta = meta['frames']
+        assert frames_meta['codec'] == self.codec and frames_meta['chunk_size'] == self.chunk_size, \
+            'The checkpoint is of a buffer with a different codec or chunk size'
+        if self.prefetch_future is not None:
+            self.prefetch_future.result()
+            self.prefetch_future = None
+        super(CompressedReplayBuffer, self).load_checkpoint(dirname, mmap_mode=mmap_mode)
+
+        lengths = np.load(os.path.join(dirname, 'frame_chunks.npy'))
+        with open(os.path.join(dirname, 'frames.bin'), 'rb') as f:
+            chunks = [f.read(length) if length > 0 else None for length in lengths]
+        with self.lock:
+            self.chunks = chunks
+            self.cache.clear()
+        self.next_idxes = None
+        self.open_chunk = None
+        self.open_frames = None
+        if frames_meta['shape'] is not None:
+            self.frame_shape = tuple(frames_meta['shape'])
+            self.frame_dtype = np.dtype(frames_meta['dtype'])
+            self.open_frames = np.zeros((self.chunk_size,) + self.frame_shape, dtype=self.frame_dtype)
+            if frames_meta['open_chunk'] is not None:
+                self.open_frames[:] = np.load(os.path.join(dirname, 'open_frames.npy'))
+                self.open_chunk = frames_meta['open_chunk']
+
+
+def make_replay_buffer(size, frame_history_len, codec=None, **kwargs):
+    """Returns a CompressedReplayBuffer storing its frames with codec, or a
+    MemoryOptimizedReplayBuffer if codec is None. kwargs are passed to the
+    buffer."""
+    if codec:
+        return CompressedReplayBuffer(size, frame_history_len, codec=codec, **kwargs)
+    return MemoryOptimizedReplayBuffer(size, frame_history_len, **kwargs)
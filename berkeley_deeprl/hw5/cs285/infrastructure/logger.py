@@ -1,5 +1,4 @@
 import os
-from tensorboardX import SummaryWriter
 import numpy as np
 
 class Logger:
@@ -9,6 +8,11 @@ class Logger:
         print('logging outputs to ', log_dir)
         print('########################')
         self._n_logged_samples = n_logged_samples
+        # Imported here, so tensorboardX and its protobuf modules are only
+        # loaded once a run starts logging, not by scripts that import the
+        # trainer or the logger without creating a Logger. torch is still
+        # imported by the trainer itself.
+        from tensorboardX import SummaryWriter
         self._summ_writer = SummaryWriter(log_dir, flush_secs=1, max_queue=1)
 
     def log_scalar(self, scalar, name, step_):
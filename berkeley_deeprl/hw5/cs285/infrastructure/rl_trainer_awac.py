@@ -12,6 +12,9 @@ import torch
 from cs285.infrastructure import pytorch_util as ptu
 
 from cs285.infrastructure import utils
+from cs285.infrastructure import checkpoint
+from cs285.infrastructure import profiling
+from cs285.infrastructure import density_graphs
 from cs285.infrastructure.logger import Logger
 
 from cs285.agents.awac_agent import AWACAgent
@@ -27,6 +30,9 @@ import cs285.envs
 MAX_NVIDEO = 2
 MAX_VIDEO_LEN = 40 # we overwrite this in the code below
 
+# trainer attributes saved in checkpoints
+CHECKPOINT_TRAINER_STATE = ['total_envsteps', 'mean_episode_reward', 'best_mean_episode_reward', 'initial_return']
+
 
 class RL_Trainer(object):
 
@@ -115,6 +121,26 @@ class RL_Trainer(object):
 
         agent_class = self.params['agent_class']
         self.agent = agent_class(self.env, self.params['agent_params'])
+        self.density_graph_writer = None
+
+        #############
+        ## PROFILING
+        #############
+
+        # Phase timers, and a cProfile dump of a window of iterations
+        profiling.init_profiling(self.params.get('profile_phases', False))
+        self.cprofile_window = profiling.CProfileWindow(
+            self.params.get('cprofile_start_itr', -1),
+            self.params.get('cprofile_num_itrs', 1),
+            os.path.join(self.params['logdir'], 'cprofile.prof'))
+
+        #############
+        ## CHECKPOINTS
+        #############
+
+        # A resumed run keeps checkpointing to the directory it resumed from
+        self.checkpointer = checkpoint.Checkpointer(
+            self.params.get('resume_from') or os.path.join(self.params['logdir'], 'checkpoint'))
 
     def run_training_loop(self, n_iter, collect_policy, eval_policy,
                           buffer_name=None,
@@ -133,12 +159,16 @@ class RL_Trainer(object):
         # init vars at beginning of training
         self.total_envsteps = 0
         self.start_time = time.time()
+        start_itr = 0
+        if self.params.get('resume_from'):
+            start_itr = self.load_checkpoint()
 
         print_period = 1000 if isinstance(self.agent, AWACAgent) else 1
 
-        for itr in range(n_iter):
+        for itr in range(start_itr, n_iter):
             if itr % print_period == 0:
                 print("\n\n********** Iteration %i ************"%itr)
+            self.cprofile_window.step(itr)
 
             # decide if videos should be rendered/logged at this iteration
             if itr % self.params['video_log_freq'] == 0 and self.params['video_log_freq'] != -1:
@@ -155,19 +185,21 @@ class RL_Trainer(object):
                 self.logmetrics = False
 
             # collect trajectories, to be used for training
-            if isinstance(self.agent, AWACAgent):
-                self.agent.step_env()
-                envsteps_this_batch = 1
-                train_video_paths = None
-                paths = None
-            else:
-                use_batchsize = self.params['batch_size']
-                if itr==0:
-                    use_batchsize = self.params['batch_size_initial']
-                paths, envsteps_this_batch, train_video_paths = (
-                    self.collect_training_trajectories(
-                        itr, initial_expertdata, collect_policy, use_batchsize)
-                )
+            with profiling.phase('collect'):
+                if isinstance(self.agent, AWACAgent):
+                    self.agent.step_env()
+                    envsteps_this_batch = 1
+                    train_video_paths = None
+                    paths = None
+                else:
+                    use_batchsize = self.params['batch_size']
+                    if itr==0:
+                        use_batchsize = self.params['batch_size_initial']
+                    paths, envsteps_this_batch, train_video_paths = (
+                        self.collect_training_trajectories(
+                            itr, initial_expertdata, collect_policy, use_batchsize)
+                    )
+            profiling.count('EnvSteps', envsteps_this_batch)
 
             
             if (not self.agent.offline_exploitation) or (self.agent.t <= self.agent.num_exploration_steps):
@@ -180,28 +212,49 @@ class RL_Trainer(object):
             # add collected data to replay buffer
             if isinstance(self.agent, AWACAgent):
                 if (not self.agent.offline_exploitation) or (self.agent.t <= self.agent.num_exploration_steps):
-                    self.agent.add_to_replay_buffer(paths)
+                    with profiling.phase('replay_insert'):
+                        self.agent.add_to_replay_buffer(paths)
 
             # train agent (using sampled data from replay buffer)
             if itr % print_period == 0:
                 print("\nTraining agent...")
-            all_logs = self.train_agent()
+            with profiling.phase('train'):
+                all_logs = self.train_agent()
 
             # Log densities and output trajectories
             if isinstance(self.agent, AWACAgent) and (itr % print_period == 0):
-                self.dump_density_graphs(itr)
+                with profiling.phase('density_graphs'):
+                    self.dump_density_graphs(itr)
+                    # Pointmass plots the last trajectory of each env when asked
+                    for env in [self.env, self.eval_env]:
+                        if hasattr(env, 'get_last_trajectory'):
+                            env.get_last_trajectory()
 
             # log/save
             if self.logvideo or self.logmetrics:
                 # perform logging
                 print('\nBeginning logging procedure...')
-                if isinstance(self.agent, AWACAgent):
-                    self.perform_dqn_logging(all_logs)
-                else:
-                    self.perform_logging(itr, paths, eval_policy, train_video_paths, all_logs)
+                with profiling.phase('logging'):
+                    if isinstance(self.agent, AWACAgent):
+                        self.perform_dqn_logging(all_logs)
+                    else:
+                        self.perform_logging(itr, paths, eval_policy, train_video_paths, all_logs)
 
                 if self.params['save_params']:
-                    self.agent.save('{}/agent_itr_{}.pt'.format(self.params['logdir'], itr))
+                    with profiling.phase('save'):
+                        self.agent.save('{}/agent_itr_{}.pt'.format(self.params['logdir'], itr))
+
+            checkpoint_freq = self.params.get('checkpoint_freq') or 0
+            if checkpoint_freq > 0 and (itr + 1) % checkpoint_freq == 0:
+                with profiling.phase('checkpoint'):
+                    self.save_checkpoint(itr)
+
+            self.log_profiling(itr)
+
+        self.cprofile_window.close()
+        self.checkpointer.close()
+        if self.density_graph_writer is not None:
+            self.density_graph_writer.close()
 
     ####################################
     ####################################
@@ -226,7 +279,8 @@ class RL_Trainer(object):
 
         # collect data to be used for training
         print("\nCollecting data to be used for training...")
-        paths, envsteps_this_batch = utils.sample_trajectories(self.env, collect_policy, num_transitions_to_sample, self.params['ep_len'])
+        with profiling.phase('sample_trajectories'):
+            paths, envsteps_this_batch = utils.sample_trajectories(self.env, collect_policy, num_transitions_to_sample, self.params['ep_len'])
 
         # collect more rollouts with the same policy, to be saved as videos in tensorboard
         train_video_paths = None
@@ -243,8 +297,11 @@ class RL_Trainer(object):
     def train_agent(self):
         all_logs = []
         for train_step in range(self.params['num_agent_train_steps_per_iter']):
-            ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch = self.agent.sample(self.params['train_batch_size'])
-            train_log = self.agent.train(ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch)
+            with profiling.phase('sample'):
+                ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch = self.agent.sample(self.params['train_batch_size'])
+            profiling.count('Samples', len(ob_batch))
+            with profiling.phase('update'):
+                train_log = self.agent.train(ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch)
             all_logs.append(train_log)
         return all_logs
 
@@ -285,7 +342,8 @@ class RL_Trainer(object):
 
         logs.update(last_log)
         
-        eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(self.eval_env, self.agent.eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
+        with profiling.phase('eval'):
+            eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(self.eval_env, self.agent.eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
         
         eval_returns = [eval_path["reward"].sum() for eval_path in eval_paths]
         eval_ep_lens = [len(eval_path["reward"]) for eval_path in eval_paths]
@@ -315,7 +373,8 @@ class RL_Trainer(object):
 
         # collect eval trajectories, for logging
         print("\nCollecting data for eval...")
-        eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(self.env, eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
+        with profiling.phase('eval'):
+            eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(self.env, eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
 
         # save eval rollouts as videos in tensorboard event file
         if self.logvideo and train_video_paths != None:
@@ -374,43 +433,38 @@ class RL_Trainer(object):
 
             self.logger.flush()
 
-    def dump_density_graphs(self, itr):
-        import matplotlib.pyplot as plt
-        self.fig = plt.figure()
-        filepath = lambda name: self.params['logdir']+'/curr_{}.png'.format(name)
+    def save_checkpoint(self, itr):
+        trainer_state = {name: getattr(self, name) for name in CHECKPOINT_TRAINER_STATE if hasattr(self, name)}
+        self.checkpointer.save(itr, self.agent, trainer_state)
 
-        num_states = self.agent.replay_buffer.num_in_buffer - 2
-        states = self.agent.replay_buffer.obs[:num_states]
-        if num_states <= 0: return
-        
-        H, xedges, yedges = np.histogram2d(states[:,0], states[:,1], range=[[0., 1.], [0., 1.]], density=True)
-        plt.imshow(np.rot90(H), interpolation='bicubic')
-        plt.colorbar()
-        plt.title('State Density')
-        self.fig.savefig(filepath('state_density'), bbox_inches='tight')
-
-        plt.clf()
-        ii, jj = np.meshgrid(np.linspace(0, 1), np.linspace(0, 1))
-        obs = np.stack([ii.flatten(), jj.flatten()], axis=1)
-        density = self.agent.exploration_model.forward_np(obs)
-        density = density.reshape(ii.shape)
-        plt.imshow(density[::-1])
-        plt.colorbar()
-        plt.title('RND Value')
-        self.fig.savefig(filepath('rnd_value'), bbox_inches='tight')
-
-        plt.clf()
-        exploitation_values = self.agent.exploitation_critic.qa_values(obs).mean(-1)
-        exploitation_values = exploitation_values.reshape(ii.shape)
-        plt.imshow(exploitation_values[::-1])
-        plt.colorbar()
-        plt.title('Predicted Exploitation Value')
-        self.fig.savefig(filepath('exploitation_value'), bbox_inches='tight')
-
-        plt.clf()
-        exploration_values = self.agent.exploration_critic.qa_values(obs).mean(-1)
-        exploration_values = exploration_values.reshape(ii.shape)
-        plt.imshow(exploration_values[::-1])
-        plt.colorbar()
-        plt.title('Predicted Exploration Value')
-        self.fig.savefig(filepath('exploration_value'), bbox_inches='tight')
+    def load_checkpoint(self):
+        """
+        Restores the agent and trainer from params['resume_from'], and returns
+        the iteration to continue from.
+        """
+        itr, trainer_state = self.checkpointer.load(self.agent)
+        for name, value in trainer_state.items():
+            setattr(self, name, value)
+        print('Resuming from iteration {} of {}'.format(itr + 1, self.params['resume_from']))
+        return itr + 1
+
+    def log_profiling(self, itr):
+        """
+        Logs the phase timers and throughputs every profile_log_freq
+        iterations (scalar_log_freq by default), when profiling is enabled.
+        """
+        if not profiling.enabled:
+            return
+        log_freq = self.params.get('profile_log_freq') or self.params['scalar_log_freq']
+        if log_freq <= 0 or itr % log_freq != 0:
+            return
+        for key, value in profiling.get_logs().items():
+            self.logger.log_scalar(value, key, itr)
+        self.logger.flush()
+
+    def dump_density_graphs(self, itr):
+        graphs = density_graphs.compute_density_graphs(self.agent)
+        if graphs is None: return
+        if self.density_graph_writer is None:
+            self.density_graph_writer = density_graphs.DensityGraphWriter(self.params['logdir'])
+        self.density_graph_writer.write(itr, graphs)
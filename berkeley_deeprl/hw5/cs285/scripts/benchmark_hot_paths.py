@@ -0,0 +1,387 @@
+"""
+Benchmarks the hot paths of the cs285 infrastructure on the CPU: the replay
+buffers, trajectory sampling, the DQN critic and RND updates, and the
+Pointmass environment.
+
+Each benchmark is run for a few parameter settings. The time of one call is
+measured like timeit (the number of calls per repeat is picked so a repeat
+takes at least --min_time). The peak memory allocated by one call is measured
+with tracemalloc, which sees NumPy arrays but not torch tensors, and the peak
+resident memory of the process after the setup is reported as well.
+
+The results can be written to JSON and compared against a previous run, e.g.
+to check a branch for regressions:
+
+    python cs285/scripts/benchmark_hot_paths.py --json master.json
+    python cs285/scripts/benchmark_hot_paths.py --json branch.json --compare master.json
+    python cs285/scripts/benchmark_hot_paths.py --filter ReplayBuffer
+"""
+import argparse
+import collections
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+Benchmark = collections.namedtuple('Benchmark', ['name', 'setup', 'params'])
+
+BENCHMARKS = []
+
+# Number of torch threads, set from the command line
+TORCH_THREADS = 1
+
+
+def benchmark(name, params):
+    """
+    Registers setup(**p) for each p in params. setup builds everything the
+    benchmark needs and returns the function to time.
+    """
+    def register(setup):
+        BENCHMARKS.append(Benchmark(name, setup, params))
+        return setup
+    return register
+
+
+def _init_torch():
+    import torch
+    from cs285.infrastructure import pytorch_util as ptu
+    torch.set_num_threads(TORCH_THREADS)
+    torch.manual_seed(0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ptu.init_gpu(use_gpu=False)
+
+
+def _random_paths(num_transitions, ob_dim=2, path_length=50):
+    """
+    Paths in the format expected by ReplayBuffer.add_rollouts.
+    """
+    paths = []
+    for start in range(0, num_transitions, path_length):
+        n = min(path_length, num_transitions - start)
+        terminals = np.zeros(n, dtype=np.float32)
+        terminals[-1] = 1
+        paths.append({
+            'observations': np.random.rand(n, ob_dim).astype(np.float32),
+            'next_observations': np.random.rand(n, ob_dim).astype(np.float32),
+            'rewards': np.random.randn(n).astype(np.float32),
+            'actions': np.random.randint(5, size=n).astype(np.float32),
+            'terminals': terminals,
+        })
+    return paths
+
+
+def _frame(obs):
+    if obs == 'atari':
+        return np.random.randint(256, size=(84, 84, 1), dtype=np.uint8)
+    return np.random.randn(8).astype(np.float32)
+
+
+def _filled_buffer(obs, size, codec=None):
+    from cs285.infrastructure.dqn_utils import CompressedReplayBuffer, MemoryOptimizedReplayBuffer
+    lander = obs == 'lander'
+    if codec:
+        buffer = CompressedReplayBuffer(size, 1 if lander else 4, lander=lander, codec=codec)
+    else:
+        buffer = MemoryOptimizedReplayBuffer(size, 1 if lander else 4, lander=lander)
+    for t in range(size):
+        idx = buffer.store_frame(_frame(obs))
+        buffer.store_effect(idx, np.random.randint(5), np.random.randn(), t % 100 == 99)
+    return buffer
+
+
+class _RandomPolicy(object):
+    def __init__(self, action_space):
+        self.action_space = action_space
+
+    def get_action(self, obs):
+        return self.action_space.sample()
+
+
+#############
+## BENCHMARKS
+#############
+
+@benchmark('ReplayBuffer.add_rollouts', [{'num_in_buffer': 10000}, {'num_in_buffer': 100000}])
+def setup_add_rollouts(num_in_buffer, batch_size=1000):
+    """
+    Adds one batch of rollouts to a buffer already holding num_in_buffer
+    transitions.
+    """
+    from cs285.infrastructure.replay_buffer import ReplayBuffer
+    base = ReplayBuffer()
+    base.add_rollouts(_random_paths(num_in_buffer))
+    new_paths = _random_paths(batch_size)
+
+    def add_rollouts():
+        buffer = copy.copy(base)
+        buffer.paths = list(base.paths)
+        buffer.unconcatenated_rews = list(base.unconcatenated_rews)
+        buffer.add_rollouts(new_paths)
+    return add_rollouts
+
+
+@benchmark('ReplayBuffer.sample_random_data', [{'batch_size': 32}, {'batch_size': 1024}])
+def setup_sample_random_data(batch_size, num_in_buffer=100000):
+    from cs285.infrastructure.replay_buffer import ReplayBuffer
+    buffer = ReplayBuffer()
+    buffer.add_rollouts(_random_paths(num_in_buffer))
+    return lambda: buffer.sample_random_data(batch_size)
+
+
+@benchmark('MemoryOptimizedReplayBuffer.store_frame', [
+    {'obs': 'lander'},
+    {'obs': 'atari'},
+    {'obs': 'atari', 'codec': 'zlib'},
+])
+def setup_store_frame(obs, size=10000, codec=None):
+    """
+    Stores a frame and its effect, in a buffer that has wrapped around.
+    """
+    buffer = _filled_buffer(obs, size, codec)
+    frame = _frame(obs)
+
+    def store_frame():
+        idx = buffer.store_frame(frame)
+        buffer.store_effect(idx, 0, 0.0, False)
+    return store_frame
+
+
+@benchmark('MemoryOptimizedReplayBuffer.sample', [
+    {'obs': 'lander', 'batch_size': 32},
+    {'obs': 'atari', 'batch_size': 32},
+    {'obs': 'atari', 'batch_size': 256},
+    {'obs': 'atari', 'batch_size': 32, 'codec': 'zlib'},
+])
+def setup_memory_optimized_sample(obs, batch_size, size=10000, codec=None):
+    """
+    With a codec, the frames of a batch are mostly decompressed in the
+    sample call, as the prefetch thread has no time to run in between.
+    """
+    buffer = _filled_buffer(obs, size, codec)
+    return lambda: buffer.sample(batch_size)
+
+
+@benchmark('MemoryOptimizedReplayBuffer.encode_recent_observation', [{'obs': 'lander'}, {'obs': 'atari'}])
+def setup_encode_recent_observation(obs, size=10000):
+    buffer = _filled_buffer(obs, size)
+    buffer.store_frame(_frame(obs))
+    return buffer.encode_recent_observation
+
+
+@benchmark('utils.sample_trajectories', [{'num_transitions': 1000}, {'num_transitions': 10000}])
+def setup_sample_trajectories(num_transitions):
+    """
+    Samples from PointmassEasy with a random policy.
+    """
+    from cs285.envs.pointmass.pointmass import Pointmass
+    from cs285.infrastructure import utils
+    env = Pointmass(difficulty=0)
+    env.action_space.seed(0)
+    policy = _RandomPolicy(env.action_space)
+    return lambda: utils.sample_trajectories(env, policy, num_transitions, 50)
+
+
+@benchmark('DQNCritic.update', [{'batch_size': 32}, {'batch_size': 256}])
+def setup_dqn_critic_update(batch_size):
+    _init_torch()
+    from cs285.critics.dqn_critic import DQNCritic
+    from cs285.infrastructure.dqn_utils import create_lander_q_network, pointmass_optimizer
+    hparams = {
+        'env_name': 'PointmassHard-v0',
+        'ob_dim': 2,
+        'ac_dim': 5,
+        'double_q': True,
+        'grad_norm_clipping': 10,
+        'gamma': 0.95,
+        'q_func': create_lander_q_network,
+    }
+    critic = DQNCritic(hparams, pointmass_optimizer())
+    ob_no = np.random.rand(batch_size, 2).astype(np.float32)
+    ac_na = np.random.randint(5, size=batch_size)
+    next_ob_no = np.random.rand(batch_size, 2).astype(np.float32)
+    reward_n = np.random.randn(batch_size).astype(np.float32)
+    terminal_n = (np.random.rand(batch_size) < 0.02).astype(np.float32)
+    return lambda: critic.update(ob_no, ac_na, next_ob_no, reward_n, terminal_n)
+
+
+@benchmark('RNDModel.update', [{'batch_size': 256}, {'batch_size': 1024}])
+def setup_rnd_update(batch_size):
+    _init_torch()
+    from cs285.exploration.rnd_model import RNDModel
+    from cs285.infrastructure.dqn_utils import pointmass_optimizer
+    hparams = {'ob_dim': 2, 'rnd_output_size': 5, 'rnd_n_layers': 2, 'rnd_size': 400}
+    model = RNDModel(hparams, pointmass_optimizer())
+    ob_no = np.random.rand(batch_size, 2).astype(np.float32)
+    return lambda: model.update(ob_no)
+
+
+@benchmark('Pointmass.__init__', [{'difficulty': 0}, {'difficulty': 3}])
+def setup_pointmass_init(difficulty):
+    from cs285.envs.pointmass.pointmass import Pointmass
+    return lambda: Pointmass(difficulty=difficulty)
+
+
+@benchmark('Pointmass.step', [{'difficulty': 0}, {'difficulty': 3}])
+def setup_pointmass_step(difficulty):
+    """
+    One step with a random action, resetting at the end of episodes.
+    """
+    from cs285.envs.pointmass.pointmass import Pointmass
+    env = Pointmass(difficulty=difficulty)
+    env.reset()
+    actions = np.random.randint(5, size=1000)
+    t = [0]
+
+    def step():
+        t[0] += 1
+        _, _, done, _ = env.step(actions[t[0] % len(actions)])
+        if done:
+            env.reset()
+    return step
+
+
+#############
+## RUNNER
+#############
+
+def run(bench, params, repeat, min_time):
+    np.random.seed(0)
+    fn = bench.setup(**params)
+    max_rss = _max_rss()
+
+    # Warm up, then measure the peak memory of one call
+    fn()
+    tracemalloc.start()
+    fn()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1000000:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    times = [t / number for t in timer.repeat(repeat, number)]
+
+    return {
+        'name': bench.name,
+        'params': params,
+        'number': number,
+        'repeat': repeat,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'peak_memory': peak_memory,
+        'max_rss': max_rss,
+    }
+
+
+def _max_rss():
+    """
+    Peak resident memory of the process, in bytes.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)), universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metadata(args):
+    meta = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'git_revision': _git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'threads': args.threads,
+        'repeat': args.repeat,
+        'min_time': args.min_time,
+    }
+    if 'torch' in sys.modules:
+        meta['torch'] = sys.modules['torch'].__version__
+    return meta
+
+
+def _format_bytes(n):
+    for unit in ['B', 'KB', 'MB']:
+        if abs(n) < 1024:
+            return '{:.0f}{}'.format(n, unit)
+        n /= 1024.
+    return '{:.1f}GB'.format(n)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filter', action='append',
+                        help='only run benchmarks whose name contains this, can be repeated')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min_time', type=float, default=0.2,
+                        help='minimum time of one repeat, in seconds')
+    parser.add_argument('--threads', type=int, default=1, help='torch threads')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results of a previous run to compare against')
+    args = parser.parse_args()
+
+    global TORCH_THREADS
+    TORCH_THREADS = args.threads
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {_key(r): r for r in json.load(f)['results']}
+
+    results = []
+    for bench in BENCHMARKS:
+        if args.filter and not any(f in bench.name for f in args.filter):
+            continue
+        for params in bench.params:
+            # The code under test prints progress, keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run(bench, params, args.repeat, args.min_time)
+            results.append(result)
+
+            line = '{:<60} {:>10.1f}us  peak {:>7}  max rss {:>7}'.format(
+                '{} {}'.format(bench.name, ' '.join('{}={}'.format(k, v) for k, v in params.items())),
+                result['min'] * 1e6, _format_bytes(result['peak_memory']),
+                _format_bytes(result['max_rss']))
+            previous = baseline.get(_key(result))
+            if previous is not None:
+                line += '  {:.2f}x baseline'.format(result['min'] / previous['min'])
+            print(line)
+            sys.stdout.flush()
+
+    if args.json:
+        report = {'meta': _metadata(args), 'results': results}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Measures how long it takes to start up the cs285 modules, the same way
+`python -X importtime` does. Each statement runs in a fresh interpreter.
+Reports the best wall time over the repeats and the modules with the
+largest self import time.
+
+Usage:
+    python cs285/scripts/benchmark_startup.py
+    python cs285/scripts/benchmark_startup.py --stmt "import cs285.envs" --top 20 --json startup.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+DEFAULT_STATEMENTS = [
+    'import cs285.envs',
+    'import cs285.envs.pointmass.pointmass',
+    'from cs285.infrastructure.dqn_utils import register_custom_envs; '
+    'import gym; register_custom_envs(); gym.make("PointmassEasy-v0")',
+    'import cs285.infrastructure.rl_trainer',
+]
+
+
+def parse_importtime(stderr):
+    """
+    Parses the `-X importtime` report.
+
+    Returns:
+        A list of (module, self_us, cumulative_us, depth), in import order.
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def measure(stmt, repeat):
+    """
+    Runs stmt `repeat` times in a fresh interpreter.
+
+    Returns:
+        The best wall time in seconds, and the import report of that run.
+    """
+    best_time, best_modules = None, None
+    for _ in range(repeat):
+        start = time.time()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', stmt],
+            stderr=subprocess.PIPE, universal_newlines=True)
+        elapsed = time.time() - start
+        if result.returncode != 0:
+            raise RuntimeError('{!r} failed:\n{}'.format(stmt, result.stderr[-2000:]))
+        if best_time is None or elapsed < best_time:
+            best_time, best_modules = elapsed, parse_importtime(result.stderr)
+    return best_time, best_modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stmt', action='append',
+                        help='statement to time, can be repeated (default: the main cs285 entry points)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10, help='number of slowest modules to report')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for stmt in args.stmt or DEFAULT_STATEMENTS:
+        wall_time, modules = measure(stmt, args.repeat)
+        top_level = [m for m in modules if m[3] == 0]
+        slowest = sorted(modules, key=lambda m: -m[1])[:args.top]
+        results.append({
+            'stmt': stmt,
+            'wall_time': wall_time,
+            'import_time': sum(m[2] for m in top_level) / 1e6,
+            'num_modules': len(modules),
+            'slowest_modules': [{'module': m[0], 'self': m[1] / 1e6, 'cumulative': m[2] / 1e6}
+                                for m in slowest],
+        })
+
+        print('\n{}'.format(stmt))
+        print('  wall time {:.3f}s, imports {:.3f}s, {} modules'.format(
+            wall_time, results[-1]['import_time'], len(modules)))
+        for m in slowest:
+            print('  {:>8.1f}ms self {:>8.1f}ms cumulative  {}'.format(m[1] / 1e3, m[2] / 1e3, m[0]))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -71,6 +71,13 @@ def main():
     parser.add_argument('--which_gpu', '-gpu_id', default=0)
     parser.add_argument('--scalar_log_freq', type=int, default=int(1e3))
     parser.add_argument('--save_params', action='store_true')
+    parser.add_argument('--profile_phases', action='store_true')
+    parser.add_argument('--profile_log_freq', type=int) # defaults to scalar_log_freq
+    parser.add_argument('--cprofile_start_itr', type=int, default=-1) # -1 to disable
+    parser.add_argument('--cprofile_num_itrs', type=int, default=1)
+    parser.add_argument('--checkpoint_freq', type=int, default=0) # iterations between checkpoints, 0 to disable
+    parser.add_argument('--resume_from', type=str) # checkpoint directory of a previous run
+    parser.add_argument('--replay_buffer_codec', type=str, choices=['lz4', 'zstd', 'zlib']) # compress the replay buffer
 
     parser.add_argument('--use_boltzmann', action='store_true')
 
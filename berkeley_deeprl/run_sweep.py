@@ -0,0 +1,248 @@
+"""
+Usage:
+
+```
+python run_sweep.py --spec sweep.json --num_workers 4 --threads_per_run 2
+```
+
+Runs every configuration of a grid / random search over one of the
+`hw*/cs285/scripts/run_hw*.py` scripts on a local pool of processes.
+An example spec:
+
+```
+{
+    "name": "dqn_lr",
+    "script": "hw3/cs285/scripts/run_hw3_dqn.py",
+    "base": {"env_name": "LunarLander-v3", "exp_name": "q2_dqn"},
+    "grid": {"seed": [1, 2, 3], "double_q": [true, false]},
+    "random": {
+        "num_samples": 4,
+        "params": {"learning_rate": {"loguniform": [1e-4, 1e-2]}}
+    },
+    "metrics": ["Eval_AverageReturn", "Train_AverageReturn"]
+}
+```
+
+Every run gets a directory `<hw>/data/sweeps/<name>/<config hash>/` holding
+its config, stdout and a `done.json` marker; configurations whose marker
+already exists are skipped, so an interrupted sweep can simply be restarted.
+Boolean parameters are passed as `store_true` flags.
+"""
+import argparse
+import glob
+import hashlib
+import itertools
+import json
+import os
+import queue
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# run inside each worker process before handing over to the run_hw*.py script
+BOOTSTRAP = """
+import os, runpy, sys
+cpus = os.environ.get('SWEEP_CPUS')
+if cpus and hasattr(os, 'sched_setaffinity'):
+    os.sched_setaffinity(0, [int(c) for c in cpus.split(',')])
+import torch
+torch.set_num_threads(int(os.environ['SWEEP_NUM_THREADS']))
+script = sys.argv[1]
+sys.argv = sys.argv[1:]
+runpy.run_path(script, run_name='__main__')
+"""
+
+
+def config_hash(script, config):
+    payload = json.dumps({'script': script, 'config': config}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:10]
+
+
+def sample_param(dist, rng):
+    (kind, args), = dist.items()
+    if kind == 'choice':
+        return args[rng.randint(len(args))]
+    if kind == 'uniform':
+        return float(rng.uniform(*args))
+    if kind == 'loguniform':
+        return float(np.exp(rng.uniform(np.log(args[0]), np.log(args[1]))))
+    if kind == 'randint':
+        return int(rng.randint(*args))
+    raise ValueError('Unknown distribution {}'.format(kind))
+
+
+def expand_spec(spec):
+    """
+        Turn a sweep spec into the list of configurations to run: the cross
+        product of `grid`, each combined with `random.num_samples` draws
+        from `random.params` (or used as-is if there is no random section).
+    """
+    grid = spec.get('grid', {})
+    keys = sorted(grid.keys())
+    grid_points = [dict(zip(keys, values))
+                   for values in itertools.product(*[grid[k] for k in keys])]
+
+    random_spec = spec.get('random', {})
+    rng = np.random.RandomState(random_spec.get('seed', 0))
+    configs = []
+    for point in grid_points:
+        for _ in range(random_spec.get('num_samples', 1)):
+            config = dict(spec.get('base', {}))
+            config.update(point)
+            for name, dist in sorted(random_spec.get('params', {}).items()):
+                config[name] = sample_param(dist, rng)
+            configs.append(config)
+    return configs
+
+
+def config_to_args(config):
+    args = []
+    for name, value in sorted(config.items()):
+        if value is True:
+            args.append('--' + name)
+        elif value is not False and value is not None:
+            args.extend(['--' + name, str(value)])
+    return args
+
+
+def get_last_scalars(logdir, tags):
+    """
+        requires tensorflow, as cs285/scripts/read_results.py
+    """
+    import tensorflow as tf
+
+    values = {}
+    for eventfile in sorted(glob.glob(os.path.join(logdir, 'events*'))):
+        for e in tf.compat.v1.train.summary_iterator(eventfile):
+            for v in e.summary.value:
+                if v.tag in tags:
+                    values[v.tag] = v.simple_value
+    return values
+
+
+class SweepRunner(object):
+
+    def __init__(self, spec, num_workers, threads_per_run, pin_cpus=True):
+        self.spec = spec
+        self.script = os.path.realpath(spec['script'])
+        # the hw directory is the one containing the cs285 package
+        self.hw_dir = os.path.dirname(os.path.dirname(os.path.dirname(self.script)))
+        self.sweep_dir = os.path.join(self.hw_dir, 'data', 'sweeps', spec['name'])
+        self.num_workers = num_workers
+        self.threads_per_run = threads_per_run
+
+        # one disjoint set of cores per worker slot
+        self.free_slots = queue.Queue()
+        n_cpus = os.cpu_count() or 1
+        for slot in range(num_workers):
+            if pin_cpus and (slot + 1) * threads_per_run <= n_cpus:
+                cpus = list(range(slot * threads_per_run, (slot + 1) * threads_per_run))
+            else:
+                cpus = None
+            self.free_slots.put(cpus)
+
+    def run_dir(self, run_hash):
+        return os.path.join(self.sweep_dir, run_hash)
+
+    def is_done(self, run_hash):
+        return os.path.exists(os.path.join(self.run_dir(run_hash), 'done.json'))
+
+    def launch(self, run_hash, config):
+        run_dir = self.run_dir(run_hash)
+        os.makedirs(run_dir, exist_ok=True)
+        with open(os.path.join(run_dir, 'config.json'), 'w') as f:
+            json.dump(config, f, indent=2, sort_keys=True)
+
+        config = dict(config)
+        config['exp_name'] = '{}_{}'.format(config.get('exp_name', self.spec['name']), run_hash)
+
+        cpus = self.free_slots.get()
+        env = dict(os.environ)
+        env['SWEEP_NUM_THREADS'] = str(self.threads_per_run)
+        env['OMP_NUM_THREADS'] = str(self.threads_per_run)
+        env['MKL_NUM_THREADS'] = str(self.threads_per_run)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [self.hw_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+        if cpus is not None:
+            env['SWEEP_CPUS'] = ','.join(str(c) for c in cpus)
+
+        start_time = time.time()
+        try:
+            with open(os.path.join(run_dir, 'stdout.log'), 'w') as log_file:
+                returncode = subprocess.call(
+                    [sys.executable, '-c', BOOTSTRAP, self.script] + config_to_args(config),
+                    cwd=self.hw_dir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        finally:
+            self.free_slots.put(cpus)
+
+        result = {
+            'returncode': returncode,
+            'logdir': self.find_logdir(run_dir),
+            'duration': time.time() - start_time,
+        }
+        print('[{}] returncode {} after {:.0f}s'.format(run_hash, returncode, result['duration']))
+        if returncode == 0:
+            with open(os.path.join(run_dir, 'done.json'), 'w') as f:
+                json.dump(result, f, indent=2)
+        return result
+
+    def find_logdir(self, run_dir):
+        # every cs285 Logger prints its log_dir on construction
+        with open(os.path.join(run_dir, 'stdout.log')) as f:
+            for line in f:
+                if line.startswith('logging outputs to'):
+                    return line[len('logging outputs to'):].strip()
+        return None
+
+    def run(self):
+        runs = [(config_hash(self.spec['script'], config), config)
+                for config in expand_spec(self.spec)]
+        todo = [(h, c) for h, c in runs if not self.is_done(h)]
+        print('{} runs in sweep, {} already completed'.format(len(runs), len(runs) - len(todo)))
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            list(executor.map(lambda run: self.launch(*run), todo))
+
+        return self.collect_summary(runs)
+
+    def collect_summary(self, runs):
+        metrics = self.spec.get('metrics', ['Eval_AverageReturn'])
+        summary = []
+        for run_hash, config in runs:
+            row = {'hash': run_hash, 'config': config, 'done': self.is_done(run_hash)}
+            if row['done']:
+                with open(os.path.join(self.run_dir(run_hash), 'done.json')) as f:
+                    logdir = json.load(f)['logdir']
+                if logdir is not None:
+                    row.update(get_last_scalars(os.path.join(self.hw_dir, logdir), metrics))
+            summary.append(row)
+
+        with open(os.path.join(self.sweep_dir, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        for row in summary:
+            print(row['hash'], ' '.join('{}={}'.format(m, row.get(m)) for m in metrics))
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spec', type=str, required=True)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--threads_per_run', type=int, default=1)
+    parser.add_argument('--no_pin_cpus', action='store_true')
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+    spec.setdefault('name', os.path.splitext(os.path.basename(args.spec))[0])
+
+    runner = SweepRunner(spec, args.num_workers, args.threads_per_run,
+                         pin_cpus=not args.no_pin_cpus)
+    runner.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,11 @@
 from configparser import Interpolation
+import argparse
 import gym
 import math
 import random
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
-from collections import namedtuple, deque
 from itertools import count
 from PIL import Image
 
@@ -15,6 +15,21 @@ import torch.optim as optim
 import torch.nn.functional as F
 import torchvision.transforms as T
 
+parser = argparse.ArgumentParser()
+parser.add_argument('--num_episodes', type=int, default=1000000)
+# replay ratio: updates_per_step optimization steps every env_steps_per_update env steps
+parser.add_argument('--env_steps_per_update', type=int, default=1)
+parser.add_argument('--updates_per_step', type=int, default=1)
+# copy the policy net to the target net every N env steps, or every
+# TARGET_UPDATE episodes if 0
+parser.add_argument('--target_update_steps', type=int, default=0)
+# no live plots; per-episode metrics are saved to --log_path instead
+parser.add_argument('--headless', action='store_true')
+parser.add_argument('--plot_every', type=int, default=1)
+parser.add_argument('--log_path', type=str, default='cart_pole_dqn_metrics.npz')
+parser.add_argument('--log_flush_every', type=int, default=100)
+args = parser.parse_args()
+
 # setup environment
 env = gym.make('CartPole-v0').unwrapped
 
@@ -23,31 +38,90 @@ is_ipython = 'inline' in matplotlib.get_backend()
 if is_ipython:
     from IPython import display
 
-plt.ion()
+if not args.headless:
+    plt.ion()
 
 # if gpu is to be used
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 # print("device: ", device)
 print("cuda: ", torch.cuda.is_available())
 
-Transition = namedtuple('Transition',
-                        ('state', 'action', 'next_state', 'reward'))
-
-
 class ReplayMemory(object):
-
-    def __init__(self, capacity):
-        self.memory = deque([], maxlen=capacity)
-
-    def push(self, *args):
+    """
+    Ring buffer of transitions held in preallocated tensors.
+
+    The transition in slot i has its state in states[i] and, if it is not
+    final, its next state in states[i + 1], which is also the state of the
+    following transition of the episode. Every state is thus stored once, and
+    the slot after the newest transition is never sampled since its state may
+    already have been overwritten by that next state.
+    """
+
+    def __init__(self, capacity, state_shape):
+        self.capacity = capacity
+        self.states = torch.zeros((capacity,) + tuple(state_shape), device=device)
+        self.actions = torch.zeros(capacity, device=device, dtype=torch.long)
+        self.rewards = torch.zeros(capacity, device=device)
+        self.non_final = torch.zeros(capacity, device=device, dtype=torch.bool)
+        self.position = 0
+        self.num_pushed = 0
+        self.last_next_state = None
+
+    def push(self, state, action, next_state, reward):
         """Save a transition"""
-        self.memory.append(Transition(*args))
+        i = self.position
+        nxt = (i + 1) % self.capacity
+        # The state is already stored if it is the next state of the previous transition
+        if state is not self.last_next_state:
+            self.states[i] = state[0]
+        self.actions[i:i + 1] = action.view(-1)
+        self.rewards[i:i + 1] = reward.view(-1)
+        self.non_final[i] = next_state is not None
+        if next_state is not None:
+            self.states[nxt] = next_state[0]
+        self.last_next_state = next_state
+        self.position = nxt
+        self.num_pushed += 1
 
     def sample(self, batch_size):
-        return random.sample(self.memory, batch_size)
+        """
+        Returns state, action, reward and next state batches, and the mask of
+        non-final transitions. Next states of final transitions are arbitrary.
+        """
+        ages = torch.randint(0, len(self), (batch_size,), device=device)
+        idx = (self.position - 1 - ages) % self.capacity
+        next_idx = (idx + 1) % self.capacity
+        return (self.states[idx], self.actions[idx].unsqueeze(1), self.rewards[idx],
+                self.states[next_idx], self.non_final[idx])
 
     def __len__(self):
-        return len(self.memory)
+        return min(self.num_pushed, self.capacity - 1)
+
+
+class MetricsLog(object):
+    """
+    Per-episode metrics kept in preallocated numpy arrays (grown by doubling)
+    and saved to an .npz file every flush_every episodes.
+    """
+
+    def __init__(self, path, names, flush_every=100, capacity=1024):
+        self.path = path
+        self.flush_every = flush_every
+        self.arrays = {name: np.zeros(capacity) for name in names}
+        self.size = 0
+
+    def append(self, **values):
+        if self.size == len(next(iter(self.arrays.values()))):
+            for name, array in self.arrays.items():
+                self.arrays[name] = np.concatenate([array, np.zeros_like(array)])
+        for name, value in values.items():
+            self.arrays[name][self.size] = value
+        self.size += 1
+        if self.size % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        np.savez(self.path, **{name: array[:self.size] for name, array in self.arrays.items()})
 
 
 class DQN(nn.Module):
@@ -165,7 +239,7 @@ target_net.eval()
 # optimizer = optim.RMSprop(policy_net.parameters())
 optimizer = optim.Adam(policy_net.parameters())
 # print("optimizer: ", optimizer)
-memory = ReplayMemory(10000)
+memory = ReplayMemory(10000, init_screen.shape[1:])
 
 
 steps_done = 0
@@ -230,29 +304,15 @@ def plot_action_selected(actions):
     # plt.pause(0.001)
 
 def optimize_model():
-    loss = 0
+    # Returns the loss of the update, or None if the memory is too small to
+    # sample a batch and no update was made
     if len(memory) < BATCH_SIZE: #128
-        return loss
-    transitions = memory.sample(BATCH_SIZE)
-    # print("transitions: ", transitions)
-    # Transpose the batch (see https://stackoverflow.com/a/19343/3343043 for
-    # detailed explanation). This converts batch-array of Transitions
-    # to Transition of batch-arrays.
-    batch = Transition(*zip(*transitions))
-
-    # Compute a mask of non-final states and concatenate the batch elements
-    # (a final state would've been the one after which simulation ended)
-    non_final_mask = torch.tensor(tuple(map(lambda s: s is not None,
-                                            batch.next_state)), device=device, dtype=torch.bool)
-    # print("non final mask: ", non_final_mask)
-    non_final_next_states = torch.cat([s for s in batch.next_state
-                                       if s is not None])
-    # print("non final next states: ", non_final_next_states.shape)
-    state_batch = torch.cat(batch.state)
-    # print(type(state_batch))
-    action_batch = torch.cat(batch.action)
-    reward_batch = torch.cat(batch.reward)
-    # print("reward type: ", type(batch.reward[0]))
+        return None
+    # Gather the batch from the memory tensors. non_final_mask marks the
+    # transitions whose next state is not final (a final state would've been
+    # the one after which simulation ended)
+    state_batch, action_batch, reward_batch, next_state_batch, non_final_mask = \
+        memory.sample(BATCH_SIZE)
 
     # Compute Q(s_t, a) - the model computes Q(s_t), then we select the
     # columns of actions taken. These are the actions which would've been taken
@@ -265,10 +325,9 @@ def optimize_model():
     # on the "older" target_net; selecting their best reward with max(1)[0].
     # This is merged based on the mask, such that we'll have either the expected
     # state value or 0 in case the state was final.
-    next_state_values = torch.zeros(BATCH_SIZE, device=device)
-    # print(type(next_state_values))
-    next_state_values[non_final_mask] = target_net(
-        non_final_next_states).max(1)[0].detach()
+    # target_net is in eval mode, so evaluating the whole batch and masking
+    # gives the same values without a data-dependent batch size
+    next_state_values = target_net(next_state_batch).max(1)[0].detach() * non_final_mask
 
     # Compute the expected Q values
     expected_state_action_values = (next_state_values * GAMMA) + reward_batch
@@ -292,9 +351,13 @@ def optimize_model():
     return loss.item()
 
 
-num_episodes = 1000000
-# num_episodes = 10
+num_episodes = args.num_episodes
 ave_losses = []
+metrics = MetricsLog(args.log_path,
+                     ['duration', 'ave_loss', 'greedy_fraction', 'env_steps', 'updates'],
+                     flush_every=args.log_flush_every)
+env_steps = 0
+num_updates = 0
 for i_episode in range(num_episodes):
     # Initialize the environment and state
     env.reset()
@@ -325,23 +388,41 @@ for i_episode in range(num_episodes):
         # Move to the next state
         state = next_state
 
-        # Perform one step of the optimization (on the policy network)
-        losses.append(optimize_model())
+        env_steps += 1
+
+        # Perform the optimization steps (on the policy network) due at this env step
+        if env_steps % args.env_steps_per_update == 0:
+            for _ in range(args.updates_per_step):
+                loss = optimize_model()
+                if loss is not None:
+                    losses.append(loss)
+                    num_updates += 1
+
+        # Update the target network on the env step schedule
+        if args.target_update_steps and env_steps % args.target_update_steps == 0:
+            target_net.load_state_dict(policy_net.state_dict())
+
         if done:
             episode_durations.append(t + 1)
-            # average_loss = sum(losses)/(t+1)
-            ave_losses.append(sum(losses)/(t+1))
+            ave_losses.append(sum(losses)/max(len(losses), 1))
             actions.append(sum(temp_actions)/(t+1))
-            plot_durations()
-            plot_loss(ave_losses)
-            plot_action_selected(actions)
+            metrics.append(duration=t + 1, ave_loss=ave_losses[-1],
+                           greedy_fraction=actions[-1], env_steps=env_steps,
+                           updates=num_updates)
+            if not args.headless and i_episode % args.plot_every == 0:
+                plot_durations()
+                plot_loss(ave_losses)
+                plot_action_selected(actions)
             break
     # Update the target network, copying all weights and biases in DQN
-    if i_episode % TARGET_UPDATE == 0:
+    if not args.target_update_steps and i_episode % TARGET_UPDATE == 0:
         target_net.load_state_dict(policy_net.state_dict())
 
+metrics.flush()
 print('Complete')
-env.render()
+if not args.headless:
+    env.render()
 env.close()
-plt.ioff()
-plt.show()
+if not args.headless:
+    plt.ioff()
+    plt.show()
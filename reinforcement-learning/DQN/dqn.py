@@ -3,7 +3,6 @@ from gym.wrappers import Monitor
 import itertools
 import numpy as np
 import os
-import random
 import sys
 import tensorflow as tf
 
@@ -11,46 +10,26 @@ if "../" not in sys.path:
   sys.path.append("../")
 
 from lib import plotting
-from collections import deque, namedtuple
+from lib.atari.state_processor import FrameStack
+from lib.atari.replay_memory import FrameReplayMemory
+from lib.instrumentation import ScalarAggregator, AsyncCheckpointer
 
 env = gym.envs.make("Breakout-v0")
 
 # Atari Actions: 0 (noop), 1 (fire), 2 (left) and 3 (right) are valid actions
 VALID_ACTIONS = [0, 1, 2, 3]
 
-class StateProcessor():
-    """
-    Processes a raw Atari images. Resizes it and converts it to grayscale.
-    """
-    def __init__(self):
-        # Build the Tensorflow graph
-        with tf.variable_scope("state_processor"):
-            self.input_state = tf.placeholder(shape=[210, 160, 3], dtype=tf.uint8)
-            self.output = tf.image.rgb_to_grayscale(self.input_state)
-            self.output = tf.image.crop_to_bounding_box(self.output, 34, 0, 160, 160)
-            self.output = tf.image.resize_images(
-                self.output, [84, 84], method=tf.image.ResizeMethod.NEAREST_NEIGHBOR)
-            self.output = tf.squeeze(self.output)
-
-    def process(self, sess, state):
-        """
-        Args:
-            sess: A Tensorflow session object
-            state: A [210, 160, 3] Atari RGB State
-
-        Returns:
-            A processed [84, 84] state representing grayscale values.
-        """
-        return sess.run(self.output, { self.input_state: state })
-
 class Estimator():
     """Q-Value Estimator neural network.
 
     This network is used for both the Q-Network and the Target Network.
+    Summaries are computed and written on every summary_every-th update only.
     """
 
-    def __init__(self, scope="estimator", summaries_dir=None):
+    def __init__(self, scope="estimator", summaries_dir=None, summary_every=100):
         self.scope = scope
+        self.summary_every = summary_every
+        self.num_updates = 0
         # Writes Tensorboard summaries to disk
         self.summary_writer = None
         with tf.variable_scope(scope):
@@ -140,11 +119,15 @@ class Estimator():
           The calculated loss on the batch.
         """
         feed_dict = { self.X_pl: s, self.y_pl: y, self.actions_pl: a }
+        write_summaries = self.summary_writer and self.num_updates % self.summary_every == 0
+        self.num_updates += 1
+        if not write_summaries:
+            _, loss = sess.run([self.train_op, self.loss], feed_dict)
+            return loss
         summaries, global_step, _, loss = sess.run(
             [self.summaries, tf.contrib.framework.get_global_step(), self.train_op, self.loss],
             feed_dict)
-        if self.summary_writer:
-            self.summary_writer.add_summary(summaries, global_step)
+        self.summary_writer.add_summary(summaries, global_step)
         return loss
 
 def copy_model_parameters(sess, estimator1, estimator2):
@@ -206,7 +189,10 @@ def deep_q_learning(sess,
                     epsilon_end=0.1,
                     epsilon_decay_steps=500000,
                     batch_size=32,
-                    record_video_every=50):
+                    record_video_every=50,
+                    summary_every=100,
+                    checkpoint_every_steps=None,
+                    checkpoint_every_seconds=600):
     """
     Q-Learning algorithm for off-policy TD control using Function Approximation.
     Finds the optimal greedy policy while following an epsilon-greedy policy.
@@ -216,7 +202,7 @@ def deep_q_learning(sess,
         env: OpenAI environment
         q_estimator: Estimator object used for the q values
         target_estimator: Estimator object used for the targets
-        state_processor: A StateProcessor object
+        state_processor: A FrameStack object that preprocesses and stacks the frames
         num_episodes: Number of episodes to run for
         experiment_dir: Directory to save Tensorflow summaries in
         replay_memory_size: Size of the replay memory
@@ -231,15 +217,17 @@ def deep_q_learning(sess,
         epsilon_decay_steps: Number of steps to decay epsilon over
         batch_size: Size of batches to sample from the replay memory
         record_video_every: Record a video every N episodes
+        summary_every: Write the aggregated per-step scalars every N steps
+        checkpoint_every_steps: If set, save a checkpoint every N steps
+        checkpoint_every_seconds: If set, save a checkpoint every N seconds.
+          Checkpoints are written from a background thread.
 
     Returns:
         An EpisodeStats object with two numpy arrays for episode_lengths and episode_rewards.
     """
 
-    Transition = namedtuple("Transition", ["state", "action", "reward", "next_state", "done"])
-
-    # The replay memory
-    replay_memory = []
+    # The replay memory, storing every frame once
+    replay_memory = FrameReplayMemory(replay_memory_size)
 
     # Keeps track of useful statistics
     stats = plotting.EpisodeStats(
@@ -265,6 +253,13 @@ def deep_q_learning(sess,
 
     total_t = sess.run(tf.contrib.framework.get_global_step())
 
+    # Per-step scalars are averaged in memory and written every summary_every steps
+    scalars = ScalarAggregator(q_estimator.summary_writer, flush_every=summary_every)
+    checkpointer = AsyncCheckpointer(
+        saver, sess, checkpoint_path,
+        every_steps=checkpoint_every_steps,
+        every_seconds=checkpoint_every_seconds)
+
     # The epsilon decay schedule
     epsilons = np.linspace(epsilon_start, epsilon_end, epsilon_decay_steps)
 
@@ -275,22 +270,22 @@ def deep_q_learning(sess,
 
     # Populate the replay memory with initial experience
     print("Populating replay memory...")
-    state = env.reset()
-    state = state_processor.process(sess, state)
-    state = np.stack([state] * 4, axis=2)
+    state = state_processor.reset(env.reset())[0]
+    frame_idx = replay_memory.store_frame(state[:,:,-1])
     for i in range(replay_memory_init_size):
         action_probs = policy(sess, state, epsilons[min(total_t, epsilon_decay_steps-1)])
         action = np.random.choice(np.arange(len(action_probs)), p=action_probs)
         next_state, reward, done, _ = env.step(VALID_ACTIONS[action])
-        next_state = state_processor.process(sess, next_state)
-        next_state = np.append(state[:,:,1:], np.expand_dims(next_state, 2), axis=2)
-        replay_memory.append(Transition(state, action, reward, next_state, done))
+        # Training starts with a new episode, so the last transition is stored as terminal
+        last = i == replay_memory_init_size - 1
+        replay_memory.store_effect(frame_idx, action, reward, done or last)
+        if last:
+            break
         if done:
-            state = env.reset()
-            state = state_processor.process(sess, state)
-            state = np.stack([state] * 4, axis=2)
+            state = state_processor.reset(env.reset())[0]
         else:
-            state = next_state
+            state = state_processor.push(next_state)[0]
+        frame_idx = replay_memory.store_frame(state[:,:,-1])
 
     # Record videos
     # Use the gym env Monitor wrapper
@@ -301,13 +296,12 @@ def deep_q_learning(sess,
 
     for i_episode in range(num_episodes):
 
-        # Save the current checkpoint
-        saver.save(tf.get_default_session(), checkpoint_path)
+        # Save the current checkpoint if one is due
+        checkpointer.maybe_save(total_t)
 
         # Reset the environment
-        state = env.reset()
-        state = state_processor.process(sess, state)
-        state = np.stack([state] * 4, axis=2)
+        state = state_processor.reset(env.reset())[0]
+        frame_idx = replay_memory.store_frame(state[:,:,-1])
         loss = None
 
         # One step in the environment
@@ -317,9 +311,8 @@ def deep_q_learning(sess,
             epsilon = epsilons[min(total_t, epsilon_decay_steps-1)]
 
             # Add epsilon to Tensorboard
-            episode_summary = tf.Summary()
-            episode_summary.value.add(simple_value=epsilon, tag="epsilon")
-            q_estimator.summary_writer.add_summary(episode_summary, total_t)
+            scalars.record("epsilon", epsilon)
+            scalars.maybe_flush(total_t)
 
             # Maybe update the target estimator
             if total_t % update_target_estimator_every == 0:
@@ -335,23 +328,19 @@ def deep_q_learning(sess,
             action_probs = policy(sess, state, epsilon)
             action = np.random.choice(np.arange(len(action_probs)), p=action_probs)
             next_state, reward, done, _ = env.step(VALID_ACTIONS[action])
-            next_state = state_processor.process(sess, next_state)
-            next_state = np.append(state[:,:,1:], np.expand_dims(next_state, 2), axis=2)
-
-            # If our replay memory is full, pop the first element
-            if len(replay_memory) == replay_memory_size:
-                replay_memory.pop(0)
 
-            # Save transition to replay memory
-            replay_memory.append(Transition(state, action, reward, next_state, done))   
+            # Save transition to replay memory, overwriting the oldest one once it is full
+            replay_memory.store_effect(frame_idx, action, reward, done)
+            if not done:
+                next_state = state_processor.push(next_state)[0]
+                frame_idx = replay_memory.store_frame(next_state[:,:,-1])
 
             # Update statistics
             stats.episode_rewards[i_episode] += reward
             stats.episode_lengths[i_episode] = t
 
             # Sample a minibatch from the replay memory
-            samples = random.sample(replay_memory, batch_size)
-            states_batch, action_batch, reward_batch, next_states_batch, done_batch = map(np.array, zip(*samples))
+            states_batch, action_batch, reward_batch, next_states_batch, done_batch = replay_memory.sample(batch_size)
 
             # Calculate q values and targets (Double DQN)
             q_values_next = q_estimator.predict(sess, next_states_batch)
@@ -361,7 +350,6 @@ def deep_q_learning(sess,
                 discount_factor * q_values_next_target[np.arange(batch_size), best_actions]
 
             # Perform gradient descent update
-            states_batch = np.array(states_batch)
             loss = q_estimator.update(sess, states_batch, action_batch, targets_batch)
 
             if done:
@@ -381,6 +369,8 @@ def deep_q_learning(sess,
             episode_lengths=stats.episode_lengths[:i_episode+1],
             episode_rewards=stats.episode_rewards[:i_episode+1])
 
+    scalars.flush(total_t)
+    checkpointer.close(total_t)
     env.monitor.close()
     return stats
 
@@ -398,7 +388,7 @@ q_estimator = Estimator(scope="q", summaries_dir=experiment_dir)
 target_estimator = Estimator(scope="target_q")
 
 # State processor
-state_processor = StateProcessor()
+state_processor = FrameStack()
 
 with tf.Session() as sess:
     sess.run(tf.global_variables_initializer())
@@ -0,0 +1,142 @@
+import sys
+import os
+import multiprocessing
+import numpy as np
+
+from inspect import getsourcefile
+current_path = os.path.dirname(os.path.abspath(getsourcefile(lambda:0)))
+import_path = os.path.abspath(os.path.join(current_path, "../.."))
+
+if import_path not in sys.path:
+  sys.path.append(import_path)
+
+from lib.atari import helpers as atari_helpers
+from lib.atari.state_processor import FrameStack
+
+STACK_SIZE = 4
+STATE_SHAPE = (84, 84, STACK_SIZE)
+# Each environment's frames are kept in a FrameStack buffer
+BUFFER_SHAPE = (84, 84, 2 * STACK_SIZE)
+
+
+def make_atari_env(env_name, wrap=True):
+  import gym
+  env = gym.envs.make(env_name)
+  # remove the timelimitwrapper
+  env = env.env
+  if wrap:
+    env = atari_helpers.AtariEnvWrapper(env)
+  return env
+
+
+def _env_worker(remote, parent_remote, env_name, index, shared_buffers, seed):
+  """
+  Runs in a subprocess: steps one environment and writes each preprocessed
+  frame into its FrameStack slot of the shared buffer.
+  """
+  parent_remote.close()
+  buffers = np.frombuffer(shared_buffers, dtype=np.uint8).reshape((-1,) + BUFFER_SHAPE)
+  frames = FrameStack(stack_size=STACK_SIZE, buffer=buffers[index:index + 1])
+  env = make_atari_env(env_name)
+  if seed is not None:
+    env.seed(seed + index)
+
+  frames.reset(env.reset())
+  remote.send(None)
+  try:
+    while True:
+      cmd, data = remote.recv()
+      if cmd == "step":
+        next_state, reward, done, _ = env.step(data)
+        if done:
+          # The stacks of all environments move on each step, so the new
+          # episode's first frame is also pushed
+          next_state = env.reset()
+          frames.reset(next_state)
+        frames.push(next_state)
+        remote.send((reward, done))
+      elif cmd == "reset":
+        frames.reset(env.reset())
+        remote.send(None)
+      elif cmd == "close":
+        break
+  except KeyboardInterrupt:
+    pass
+  finally:
+    env.close()
+    remote.close()
+
+
+class SubprocessEnvPool(object):
+  """
+  A pool of Atari environments, each stepped in its own process. Frame
+  preprocessing and stacking happen in the subprocesses, which write each
+  new frame into a shared-memory FrameStack buffer, so only actions,
+  rewards and done flags go through pipes.
+
+  Must be created before any Tensorflow session, the subprocesses are forked.
+
+  Args:
+    env_name: Name of the gym Atari environment
+    num_envs: Number of environment subprocesses
+    seed: If set, environment i is seeded with seed + i
+  """
+  def __init__(self, env_name, num_envs, seed=None):
+    self.num_envs = num_envs
+    ctx = multiprocessing.get_context("fork")
+    self._shared_buffers = ctx.RawArray("B", int(num_envs * np.prod(BUFFER_SHAPE)))
+    # Same layout as the FrameStacks of the subprocesses, which all move on each step
+    self.frames = FrameStack(num_envs, STACK_SIZE, buffer=np.frombuffer(
+      self._shared_buffers, dtype=np.uint8).reshape((num_envs,) + BUFFER_SHAPE))
+
+    self.remotes, self.processes = [], []
+    for index in range(num_envs):
+      remote, worker_remote = ctx.Pipe()
+      p = ctx.Process(
+        target=_env_worker,
+        args=(worker_remote, remote, env_name, index, self._shared_buffers, seed))
+      p.daemon = True
+      p.start()
+      worker_remote.close()
+      self.remotes.append(remote)
+      self.processes.append(p)
+
+    for remote in self.remotes:
+      remote.recv()
+
+  @property
+  def states(self):
+    """
+    The current [num_envs, 84, 84, 4] states, as a view that the next step overwrites.
+    """
+    return self.frames.states
+
+  def step(self, actions):
+    """
+    Steps all environments. Environments that are done are reset.
+
+    Args:
+      actions: One action per environment
+
+    Returns:
+      rewards and dones arrays of shape [num_envs]. The new states are in self.states.
+    """
+    for remote, action in zip(self.remotes, actions):
+      remote.send(("step", int(action)))
+    results = [remote.recv() for remote in self.remotes]
+    self.frames.start = (self.frames.start + 1) % STACK_SIZE
+    rewards, dones = zip(*results)
+    return np.array(rewards, dtype=np.float32), np.array(dones, dtype=np.bool_)
+
+  def reset(self):
+    for remote in self.remotes:
+      remote.send(("reset", None))
+    for remote in self.remotes:
+      remote.recv()
+    return self.states
+
+  def close(self):
+    for remote in self.remotes:
+      remote.send(("close", None))
+    for p in self.processes:
+      p.join()
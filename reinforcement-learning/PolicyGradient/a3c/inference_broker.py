@@ -0,0 +1,81 @@
+import time
+import threading
+import queue
+import numpy as np
+import tensorflow as tf
+
+
+class _Request(object):
+  def __init__(self, state):
+    self.state = state
+    self.result = None
+    self.done = threading.Event()
+
+
+class InferenceBroker(object):
+  """
+  Batches policy predictions requested by many worker threads into a single
+  session run. Requests are queued and served once max_batch_size of them
+  are waiting or max_latency seconds have passed since the first one.
+
+  Args:
+    policy_net: The policy estimator to predict with, usually the global one
+    max_batch_size: Maximum number of states in one prediction, e.g. the number of workers
+    max_latency: Maximum time in seconds a request waits for others to batch with
+  """
+  def __init__(self, policy_net, max_batch_size, max_latency=0.002):
+    self.policy_net = policy_net
+    self.max_batch_size = max_batch_size
+    self.max_latency = max_latency
+    self.requests = queue.Queue()
+    self.stopped = False
+
+  def predict(self, state):
+    """
+    Called from worker threads. Blocks until the action probabilities for
+    state are available.
+    """
+    request = _Request(state)
+    self.requests.put(request)
+    while not request.done.wait(0.1):
+      if self.stopped:
+        raise tf.errors.CancelledError(None, None, "Inference broker stopped")
+    return request.result
+
+  def _next_batch(self, timeout):
+    batch = [self.requests.get(timeout=timeout)]
+    deadline = time.time() + self.max_latency
+    while len(batch) < self.max_batch_size:
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        break
+      try:
+        batch.append(self.requests.get(timeout=remaining))
+      except queue.Empty:
+        break
+    return batch
+
+  def serve_once(self, sess, timeout=None):
+    """
+    Serves one batch of requests. Returns the number of requests served.
+    """
+    try:
+      batch = self._next_batch(timeout)
+    except queue.Empty:
+      return 0
+    feed_dict = { self.policy_net.states: np.array([r.state for r in batch]) }
+    probs = sess.run(self.policy_net.predictions["probs"], feed_dict)
+    for request, p in zip(batch, probs):
+      request.result = p
+      request.done.set()
+    return len(batch)
+
+  def run(self, sess, coord):
+    with sess.as_default(), sess.graph.as_default():
+      try:
+        while not coord.should_stop():
+          self.serve_once(sess, timeout=0.1)
+      except tf.errors.CancelledError:
+        return
+      finally:
+        self.stopped = True
@@ -0,0 +1,48 @@
+import sys
+import os
+import threading
+import unittest
+import numpy as np
+import tensorflow as tf
+
+from inspect import getsourcefile
+current_path = os.path.dirname(os.path.abspath(getsourcefile(lambda:0)))
+import_path = os.path.abspath(os.path.join(current_path, "../.."))
+
+if import_path not in sys.path:
+  sys.path.append(import_path)
+
+from inference_broker import InferenceBroker
+from estimators import PolicyEstimator
+
+VALID_ACTIONS = [0, 1, 2, 3]
+
+class InferenceBrokerTest(tf.test.TestCase):
+  def testBatchedPredict(self):
+    policy_net = PolicyEstimator(len(VALID_ACTIONS))
+    broker = InferenceBroker(policy_net, max_batch_size=3, max_latency=1.0)
+    states = np.random.randint(0, 256, size=(3, 84, 84, 4)).astype(np.uint8)
+
+    with self.test_session() as sess:
+      sess.run(tf.initialize_all_variables())
+      results = [None] * len(states)
+
+      def request(i):
+        results[i] = broker.predict(states[i])
+
+      threads = [threading.Thread(target=request, args=(i,)) for i in range(len(states))]
+      for t in threads:
+        t.start()
+      # All three requests are served by a single prediction
+      self.assertEqual(broker.serve_once(sess), 3)
+      for t in threads:
+        t.join()
+
+      expected = sess.run(policy_net.predictions["probs"], { policy_net.states: states })
+
+    for i in range(len(states)):
+      self.assertAllClose(results[i], expected[i])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -16,8 +16,7 @@ if import_path not in sys.path:
 from gym.wrappers import Monitor
 import gym
 
-from lib.atari.state_processor import StateProcessor
-from lib.atari import helpers as atari_helpers
+from lib.atari.state_processor import FrameStack
 from estimators import ValueEstimator, PolicyEstimator
 from worker import make_copy_params_op
 
@@ -41,7 +40,7 @@ class PolicyMonitor(object):
     self.global_policy_net = policy_net
     self.summary_writer = summary_writer
     self.saver = saver
-    self.sp = StateProcessor()
+    self.frames = FrameStack()
 
     self.checkpoint_path = os.path.abspath(os.path.join(summary_writer.get_logdir(), "../checkpoints/model"))
 
@@ -71,14 +70,14 @@ class PolicyMonitor(object):
 
       # Run an episode
       done = False
-      state = atari_helpers.atari_make_initial_state(self.sp.process(self.env.reset()))
+      state = self.frames.reset(self.env.reset())[0]
       total_reward = 0.0
       episode_length = 0
       while not done:
         action_probs = self._policy_net_predict(state, sess)
         action = np.random.choice(np.arange(len(action_probs)), p=action_probs)
         next_state, reward, done, _ = self.env.step(action)
-        next_state = atari_helpers.atari_make_next_state(state, self.sp.process(next_state))
+        next_state = self.frames.push(next_state)[0]
         total_reward += reward
         episode_length += 1
         state = next_state
@@ -0,0 +1,167 @@
+import sys
+import os
+import itertools
+import numpy as np
+import tensorflow as tf
+
+from inspect import getsourcefile
+current_path = os.path.dirname(os.path.abspath(getsourcefile(lambda:0)))
+import_path = os.path.abspath(os.path.join(current_path, "../.."))
+
+if import_path not in sys.path:
+  sys.path.append(import_path)
+
+
+def make_batched_train_op(estimator, num_envs):
+  """
+  Creates an op that applies the gradients of the estimator's loss to the
+  estimator itself. The loss is summed over the experience of num_envs
+  environments, so it is divided by num_envs to keep the step size of a
+  thread worker's update, and the gradients are clipped like in
+  worker.make_train_op.
+  """
+  grads_and_vars = estimator.optimizer.compute_gradients(estimator.loss / num_envs)
+  grads, variables = zip(*[(grad, var) for grad, var in grads_and_vars if grad is not None])
+  grads, _ = tf.clip_by_global_norm(grads, 5.0)
+  return estimator.optimizer.apply_gradients(list(zip(grads, variables)),
+          global_step=tf.contrib.framework.get_global_step())
+
+
+class ProcessWorker(object):
+  """
+  Drives a SubprocessEnvPool in lockstep. Policy and value predictions for all
+  environments are made in one batched call to the global networks, and the
+  global networks are trained on the experience of all environments at once.
+
+  Args:
+    env_pool: A SubprocessEnvPool
+    policy_net: Instance of the globally shared policy net
+    value_net: Instance of the globally shared value net
+    global_counter: Iterator that holds the global step
+    discount_factor: Reward discount factor
+    summary_writer: A tf.train.SummaryWriter for Tensorboard summaries
+    max_global_steps: If set, stop coordinator when global_counter > max_global_steps
+  """
+  def __init__(self, env_pool, policy_net, value_net, global_counter, discount_factor=0.99, summary_writer=None, max_global_steps=None):
+    self.name = "process_worker"
+    self.env_pool = env_pool
+    self.discount_factor = discount_factor
+    self.max_global_steps = max_global_steps
+    self.global_step = tf.contrib.framework.get_global_step()
+    self.policy_net = policy_net
+    self.value_net = value_net
+    self.global_counter = global_counter
+    self.local_counter = itertools.count()
+    self.summary_writer = summary_writer
+
+    with tf.variable_scope(self.name):
+      self.pnet_train_op = make_batched_train_op(self.policy_net, env_pool.num_envs)
+      self.vnet_train_op = make_batched_train_op(self.value_net, env_pool.num_envs)
+
+  def run(self, sess, coord, t_max):
+    with sess.as_default(), sess.graph.as_default():
+      try:
+        while not coord.should_stop():
+          # Collect some experience
+          rollout, local_t, global_t = self.run_n_steps(t_max, sess)
+
+          if self.max_global_steps is not None and global_t >= self.max_global_steps:
+            tf.logging.info("Reached global step {}. Stopping.".format(global_t))
+            coord.request_stop()
+            return
+
+          # Update the global networks
+          self.update(rollout, sess)
+
+      except tf.errors.CancelledError:
+        return
+
+  def _policy_net_predict(self, states, sess):
+    feed_dict = { self.policy_net.states: states }
+    return sess.run(self.policy_net.predictions["probs"], feed_dict)
+
+  def _value_net_predict(self, states, sess):
+    feed_dict = { self.value_net.states: states }
+    return sess.run(self.value_net.predictions["logits"], feed_dict)
+
+  def run_n_steps(self, n, sess):
+    """
+    Runs n steps in every environment of the pool.
+
+    Returns:
+      A (states, actions, rewards, dones, bootstrap_states) tuple of arrays
+      with leading dimensions [n, num_envs], the local and the global step.
+    """
+    num_envs = self.env_pool.num_envs
+    states = np.empty((n,) + self.env_pool.states.shape, dtype=np.uint8)
+    actions = np.empty((n, num_envs), dtype=np.int32)
+    rewards = np.empty((n, num_envs), dtype=np.float32)
+    dones = np.empty((n, num_envs), dtype=np.bool_)
+
+    for t in range(n):
+      states[t] = self.env_pool.states
+      action_probs = self._policy_net_predict(states[t], sess)
+      # Sample one action per environment
+      cum_probs = np.cumsum(action_probs, axis=1)
+      u = np.random.rand(num_envs, 1) * cum_probs[:, -1:]
+      actions[t] = np.minimum((cum_probs < u).sum(axis=1), action_probs.shape[1] - 1)
+      rewards[t], dones[t] = self.env_pool.step(actions[t])
+
+      local_t = next(self.local_counter)
+      for _ in range(num_envs):
+        global_t = next(self.global_counter)
+
+      if local_t % 100 == 0:
+        tf.logging.info("{}: local Step {}, global step {}".format(self.name, local_t, global_t))
+
+    bootstrap_states = self.env_pool.states.copy()
+    return (states, actions, rewards, dones, bootstrap_states), local_t, global_t
+
+  def update(self, rollout, sess):
+    """
+    Updates global policy and value networks based on collected experience
+
+    Args:
+      rollout: The experience returned by run_n_steps
+      sess: A Tensorflow session
+    """
+    states, actions, rewards, dones, bootstrap_states = rollout
+    n, num_envs = actions.shape
+
+    # Values of all visited states and of the bootstrap states in one call
+    flat_states = states.reshape((n * num_envs,) + states.shape[2:])
+    values = self._value_net_predict(np.concatenate([flat_states, bootstrap_states]), sess)
+    state_values = values[:-num_envs].reshape(n, num_envs)
+
+    value_targets = np.empty((n, num_envs), dtype=np.float32)
+    reward = values[-num_envs:]
+    for t in reversed(range(n)):
+      reward = rewards[t] + self.discount_factor * reward * (1.0 - dones[t])
+      value_targets[t] = reward
+    policy_targets = value_targets - state_values
+
+    feed_dict = {
+      self.policy_net.states: flat_states,
+      self.policy_net.targets: policy_targets.reshape(-1),
+      self.policy_net.actions: actions.reshape(-1),
+      self.value_net.states: flat_states,
+      self.value_net.targets: value_targets.reshape(-1),
+    }
+
+    global_step, pnet_loss, vnet_loss, _, _, pnet_summaries, vnet_summaries = sess.run([
+      self.global_step,
+      self.policy_net.loss,
+      self.value_net.loss,
+      self.pnet_train_op,
+      self.vnet_train_op,
+      self.policy_net.summaries,
+      self.value_net.summaries
+    ], feed_dict)
+
+    # Write summaries
+    if self.summary_writer is not None:
+      self.summary_writer.add_summary(pnet_summaries, global_step)
+      self.summary_writer.add_summary(vnet_summaries, global_step)
+      self.summary_writer.flush()
+
+    return pnet_loss, vnet_loss, pnet_summaries, vnet_summaries
@@ -0,0 +1,70 @@
+import sys
+import os
+import itertools
+import unittest
+import numpy as np
+import tensorflow as tf
+
+from inspect import getsourcefile
+current_path = os.path.dirname(os.path.abspath(getsourcefile(lambda:0)))
+import_path = os.path.abspath(os.path.join(current_path, "../.."))
+
+if import_path not in sys.path:
+  sys.path.append(import_path)
+
+from env_pool import SubprocessEnvPool
+from process_worker import ProcessWorker
+from estimators import ValueEstimator, PolicyEstimator
+
+VALID_ACTIONS = [0, 1, 2, 3]
+NUM_ENVS = 2
+
+class ProcessWorkerTest(tf.test.TestCase):
+  def setUp(self):
+    super(ProcessWorkerTest, self).setUp()
+
+    self.env_pool = SubprocessEnvPool("Breakout-v0", NUM_ENVS, seed=0)
+    self.discount_factor = 0.99
+    self.global_step = tf.Variable(0, name="global_step", trainable=False)
+    self.global_counter = itertools.count()
+
+    with tf.variable_scope("global") as vs:
+      self.global_policy_net = PolicyEstimator(len(VALID_ACTIONS))
+      self.global_value_net = ValueEstimator(reuse=True)
+
+  def tearDown(self):
+    self.env_pool.close()
+    super(ProcessWorkerTest, self).tearDown()
+
+  def testEnvPoolStep(self):
+    self.assertEqual(self.env_pool.states.shape, (NUM_ENVS, 84, 84, 4))
+    rewards, dones = self.env_pool.step([1] * NUM_ENVS)
+    self.assertEqual(rewards.shape, (NUM_ENVS,))
+    self.assertEqual(dones.shape, (NUM_ENVS,))
+
+  def testRunNStepsAndUpdate(self):
+    w = ProcessWorker(
+      env_pool=self.env_pool,
+      policy_net=self.global_policy_net,
+      value_net=self.global_value_net,
+      global_counter=self.global_counter,
+      discount_factor=self.discount_factor)
+
+    with self.test_session() as sess:
+      sess.run(tf.initialize_all_variables())
+      rollout, local_t, global_t = w.run_n_steps(10, sess)
+      policy_net_loss, value_net_loss, policy_net_summaries, value_net_summaries = w.update(rollout, sess)
+
+    states, actions, rewards, dones, bootstrap_states = rollout
+    self.assertEqual(states.shape, (10, NUM_ENVS, 84, 84, 4))
+    self.assertEqual(actions.shape, (10, NUM_ENVS))
+    self.assertEqual(bootstrap_states.shape, (NUM_ENVS, 84, 84, 4))
+    self.assertEqual(global_t, 10 * NUM_ENVS - 1)
+    self.assertIsNotNone(policy_net_loss)
+    self.assertIsNotNone(value_net_loss)
+    self.assertIsNotNone(policy_net_summaries)
+    self.assertIsNotNone(value_net_summaries)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,93 @@
+import sys
+import os
+import unittest
+import numpy as np
+
+from inspect import getsourcefile
+current_path = os.path.dirname(os.path.abspath(getsourcefile(lambda:0)))
+import_path = os.path.abspath(os.path.join(current_path, "../.."))
+
+if import_path not in sys.path:
+  sys.path.append(import_path)
+
+from lib.atari.state_processor import StateProcessor, FrameStack
+from lib.atari import helpers as atari_helpers
+
+try:
+  import tensorflow as tf
+except ImportError:
+  tf = None
+
+
+def random_frames(n, seed=0):
+  return np.random.RandomState(seed).randint(0, 256, size=(n, 210, 160, 3)).astype(np.uint8)
+
+
+class FrameStackTest(unittest.TestCase):
+  def setUp(self):
+    self.sp = StateProcessor()
+
+  def testReset(self):
+    frame = random_frames(1)[0]
+    stack = FrameStack()
+    states = stack.reset(frame)
+    expected = atari_helpers.atari_make_initial_state(self.sp.process(frame))
+    self.assertEqual(states.shape, (1, 84, 84, 4))
+    np.testing.assert_array_equal(states[0], expected)
+
+  def testPushMatchesAppend(self):
+    frames = random_frames(11)
+    stack = FrameStack()
+    stack.reset(frames[0])
+    expected = atari_helpers.atari_make_initial_state(self.sp.process(frames[0]))
+    # More pushes than twice the stack size, so the buffer wraps around
+    for frame in frames[1:]:
+      states = stack.push(frame)
+      expected = atari_helpers.atari_make_next_state(expected, self.sp.process(frame))
+      np.testing.assert_array_equal(states[0], expected)
+
+  def testResetSomeEnvs(self):
+    frames = random_frames(3 * 6).reshape(6, 3, 210, 160, 3)
+    stack = FrameStack(num_envs=3)
+    stack.reset(frames[0])
+    expected = [atari_helpers.atari_make_initial_state(self.sp.process(f)) for f in frames[0]]
+    for t in range(1, 6):
+      stack.push(frames[t])
+      expected = [atari_helpers.atari_make_next_state(s, self.sp.process(f))
+                  for s, f in zip(expected, frames[t])]
+      if t == 3:
+        # A new episode in the second environment only
+        stack.reset(frames[t][1:2], env_ids=[1])
+        expected[1] = atari_helpers.atari_make_initial_state(self.sp.process(frames[t][1]))
+      for env_id in range(3):
+        np.testing.assert_array_equal(stack.states[env_id], expected[env_id])
+
+
+class StateProcessorTest(unittest.TestCase):
+  def testProcessBatchMatchesProcess(self):
+    sp = StateProcessor()
+    frames = random_frames(5)
+    processed = sp.process_batch(frames)
+    self.assertEqual(processed.shape, (5, 84, 84))
+    self.assertEqual(processed.dtype, np.uint8)
+    for frame, state in zip(frames, processed):
+      np.testing.assert_array_equal(state, sp.process(frame))
+
+  @unittest.skipIf(tf is None, "Tensorflow is not installed")
+  def testProcessMatchesTensorflow(self):
+    # The graph of the former Tensorflow StateProcessor
+    with tf.Graph().as_default():
+      input_state = tf.placeholder(shape=[210, 160, 3], dtype=tf.uint8)
+      output = tf.image.rgb_to_grayscale(input_state)
+      output = tf.image.crop_to_bounding_box(output, 34, 0, 160, 160)
+      output = tf.image.resize_images(
+          output, [84, 84], method=tf.image.ResizeMethod.NEAREST_NEIGHBOR)
+      output = tf.squeeze(output)
+      with tf.Session() as sess:
+        for frame in random_frames(5):
+          expected = sess.run(output, { input_state: frame })
+          np.testing.assert_array_equal(StateProcessor().process(frame), expected)
+
+
+if __name__ == '__main__':
+  unittest.main()
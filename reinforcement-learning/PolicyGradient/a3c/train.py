@@ -22,6 +22,9 @@ from lib.atari import helpers as atari_helpers
 from estimators import ValueEstimator, PolicyEstimator
 from policy_monitor import PolicyMonitor
 from worker import Worker
+from env_pool import SubprocessEnvPool
+from process_worker import ProcessWorker
+from inference_broker import InferenceBroker
 
 
 tf.flags.DEFINE_string("model_dir", "/tmp/a3c", "Directory to write Tensorboard summaries and videos to.")
@@ -31,6 +34,9 @@ tf.flags.DEFINE_integer("max_global_steps", None, "Stop training after this many
 tf.flags.DEFINE_integer("eval_every", 300, "Evaluate the policy every N seconds")
 tf.flags.DEFINE_boolean("reset", False, "If set, delete the existing model directory and start training from scratch.")
 tf.flags.DEFINE_integer("parallelism", None, "Number of threads to run. If not set we run [num_cpu_cores] threads.")
+tf.flags.DEFINE_boolean("batch_inference", False, "If set, worker threads get their action probabilities from a central broker that batches them into one prediction.")
+tf.flags.DEFINE_float("inference_latency_ms", 2.0, "Maximum time a prediction request waits to be batched with others.")
+tf.flags.DEFINE_string("worker_mode", "thread", "thread: one A3C worker thread per env. process: envs run in [parallelism] subprocesses, predictions and updates are batched over all of them.")
 
 FLAGS = tf.flags.FLAGS
 
@@ -66,6 +72,11 @@ if FLAGS.reset:
 if not os.path.exists(CHECKPOINT_DIR):
   os.makedirs(CHECKPOINT_DIR)
 
+# Env subprocesses are forked, so start them before Tensorflow spawns any threads
+env_pool = None
+if FLAGS.worker_mode == "process":
+  env_pool = SubprocessEnvPool(FLAGS.env, NUM_WORKERS)
+
 summary_writer = tf.summary.FileWriter(os.path.join(MODEL_DIR, "train"))
 
 with tf.device("/cpu:0"):
@@ -81,9 +92,26 @@ with tf.device("/cpu:0"):
   # Global step iterator
   global_counter = itertools.count()
 
+  # Central inference broker shared by the worker threads
+  inference_broker = None
+  if FLAGS.batch_inference and env_pool is None:
+    inference_broker = InferenceBroker(
+      policy_net=policy_net,
+      max_batch_size=NUM_WORKERS,
+      max_latency=FLAGS.inference_latency_ms / 1000.0)
+
   # Create worker graphs
   workers = []
-  for worker_id in range(NUM_WORKERS):
+  if env_pool is not None:
+    workers.append(ProcessWorker(
+      env_pool=env_pool,
+      policy_net=policy_net,
+      value_net=value_net,
+      global_counter=global_counter,
+      discount_factor = 0.99,
+      summary_writer=summary_writer,
+      max_global_steps=FLAGS.max_global_steps))
+  for worker_id in range(NUM_WORKERS if env_pool is None else 0):
     # We only write summaries in one of the workers because they're
     # pretty much identical and writing them on all workers
     # would be a waste of space
@@ -99,7 +127,8 @@ with tf.device("/cpu:0"):
       global_counter=global_counter,
       discount_factor = 0.99,
       summary_writer=worker_summary_writer,
-      max_global_steps=FLAGS.max_global_steps)
+      max_global_steps=FLAGS.max_global_steps,
+      inference_broker=inference_broker)
     workers.append(worker)
 
   saver = tf.train.Saver(keep_checkpoint_every_n_hours=2.0, max_to_keep=10)
@@ -124,6 +153,10 @@ with tf.Session() as sess:
 
   # Start worker threads
   worker_threads = []
+  if inference_broker is not None:
+    t = threading.Thread(target=lambda: inference_broker.run(sess, coord))
+    t.start()
+    worker_threads.append(t)
   for worker in workers:
     worker_fn = lambda worker=worker: worker.run(sess, coord, FLAGS.t_max)
     t = threading.Thread(target=worker_fn)
@@ -136,3 +169,6 @@ with tf.Session() as sess:
 
   # Wait for all workers to finish
   coord.join(worker_threads)
+
+if env_pool is not None:
+  env_pool.close()
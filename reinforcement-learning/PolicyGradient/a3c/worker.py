@@ -14,8 +14,7 @@ if import_path not in sys.path:
   sys.path.append(import_path)
 
 # from lib import plotting
-from lib.atari.state_processor import StateProcessor
-from lib.atari import helpers as atari_helpers
+from lib.atari.state_processor import FrameStack
 from estimators import ValueEstimator, PolicyEstimator
 
 Transition = collections.namedtuple("Transition", ["state", "action", "reward", "next_state", "done"])
@@ -63,8 +62,11 @@ class Worker(object):
     discount_factor: Reward discount factor
     summary_writer: A tf.train.SummaryWriter for Tensorboard summaries
     max_global_steps: If set, stop coordinator when global_counter > max_global_steps
+    inference_broker: If set, action probabilities are requested from this
+      InferenceBroker, batched with those of the other workers, instead of
+      from the local policy net
   """
-  def __init__(self, name, env, policy_net, value_net, global_counter, discount_factor=0.99, summary_writer=None, max_global_steps=None):
+  def __init__(self, name, env, policy_net, value_net, global_counter, discount_factor=0.99, summary_writer=None, max_global_steps=None, inference_broker=None):
     self.name = name
     self.discount_factor = discount_factor
     self.max_global_steps = max_global_steps
@@ -73,9 +75,10 @@ class Worker(object):
     self.global_value_net = value_net
     self.global_counter = global_counter
     self.local_counter = itertools.count()
-    self.sp = StateProcessor()
+    self.frames = FrameStack()
     self.summary_writer = summary_writer
     self.env = env
+    self.inference_broker = inference_broker
 
     # Create local policy/value nets that are not updated asynchronously
     with tf.variable_scope(name):
@@ -90,12 +93,24 @@ class Worker(object):
     self.vnet_train_op = make_train_op(self.value_net, self.global_value_net)
     self.pnet_train_op = make_train_op(self.policy_net, self.global_policy_net)
 
-    self.state = None
+  @property
+  def state(self):
+    """
+    The current [84, 84, 4] state, a view of the frame stack that is
+    overwritten by the next step.
+    """
+    return self.frames.states[0]
+
+  def reset_state(self, frame):
+    """
+    Starts a new episode from its first raw Atari frame.
+    """
+    self.frames.reset(frame)
 
   def run(self, sess, coord, t_max):
     with sess.as_default(), sess.graph.as_default():
       # Initial state
-      self.state = atari_helpers.atari_make_initial_state(self.sp.process(self.env.reset()))
+      self.reset_state(self.env.reset())
       try:
         while not coord.should_stop():
           # Copy Parameters from the global networks
@@ -116,6 +131,8 @@ class Worker(object):
         return
 
   def _policy_net_predict(self, state, sess):
+    if self.inference_broker is not None:
+      return self.inference_broker.predict(state)
     feed_dict = { self.policy_net.states: [state] }
     preds = sess.run(self.policy_net.predictions, feed_dict)
     return preds["probs"][0]
@@ -125,18 +142,24 @@ class Worker(object):
     preds = sess.run(self.value_net.predictions, feed_dict)
     return preds["logits"][0]
 
+  def _value_net_predict_batch(self, states, sess):
+    feed_dict = { self.value_net.states: states }
+    preds = sess.run(self.value_net.predictions, feed_dict)
+    return preds["logits"]
+
   def run_n_steps(self, n, sess):
     transitions = []
+    state = self.state.copy()
     for _ in range(n):
       # Take a step
-      action_probs = self._policy_net_predict(self.state, sess)
+      action_probs = self._policy_net_predict(state, sess)
       action = np.random.choice(np.arange(len(action_probs)), p=action_probs)
       next_state, reward, done, _ = self.env.step(action)
-      next_state = atari_helpers.atari_make_next_state(self.state, self.sp.process(next_state))
+      next_state = self.frames.push(next_state)[0].copy()
 
       # Store transition
       transitions.append(Transition(
-        state=self.state, action=action, reward=reward, next_state=next_state, done=done))
+        state=state, action=action, reward=reward, next_state=next_state, done=done))
 
       # Increase local and global counters
       local_t = next(self.local_counter)
@@ -146,10 +169,10 @@ class Worker(object):
         tf.logging.info("{}: local Step {}, global step {}".format(self.name, local_t, global_t))
 
       if done:
-        self.state = atari_helpers.atari_make_initial_state(self.sp.process(self.env.reset()))
+        self.reset_state(self.env.reset())
         break
       else:
-        self.state = next_state
+        state = next_state
     return transitions, local_t, global_t
 
   def update(self, transitions, sess):
@@ -161,10 +184,17 @@ class Worker(object):
       sess: A Tensorflow session
     """
 
+    # Evaluate all states, and the last next_state if we need to bootstrap
+    # from it, in a single call
+    value_states = [t.state for t in transitions]
+    if not transitions[-1].done:
+      value_states.append(transitions[-1].next_state)
+    values = self._value_net_predict_batch(np.array(value_states), sess)
+
     # If we episode was not done we bootstrap the value from the last state
     reward = 0.0
     if not transitions[-1].done:
-      reward = self._value_net_predict(transitions[-1].next_state, sess)
+      reward = values[-1]
 
     # Accumulate minibatch exmaples
     states = []
@@ -172,9 +202,10 @@ class Worker(object):
     value_targets = []
     actions = []
 
-    for transition in transitions[::-1]:
+    for i in reversed(range(len(transitions))):
+      transition = transitions[i]
       reward = transition.reward + self.discount_factor * reward
-      policy_target = (reward - self._value_net_predict(transition.state, sess))
+      policy_target = (reward - values[i])
       # Accumulate updates
       states.append(transition.state)
       actions.append(transition.action)
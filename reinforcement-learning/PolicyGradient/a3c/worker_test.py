@@ -83,13 +83,19 @@ class WorkerTest(tf.test.TestCase):
 
     with self.test_session() as sess:
       sess.run(tf.initialize_all_variables())
-      state = self.sp.process(self.env.reset())
-      processed_state = atari_helpers.atari_make_initial_state(state)
-      w.state = processed_state
+      frame = w.env.reset()
+      w.reset_state(frame)
       transitions, local_t, global_t = w.run_n_steps(10, sess)
       policy_net_loss, value_net_loss, policy_net_summaries, value_net_summaries = w.update(transitions, sess)
 
     self.assertEqual(len(transitions), 10)
+    initial_state = atari_helpers.atari_make_initial_state(self.sp.process(frame))
+    self.assertAllEqual(transitions[0].state, initial_state)
+    for t in transitions:
+      # The next state is the state shifted by one new frame
+      self.assertAllEqual(t.next_state[:, :, :3], t.state[:, :, 1:])
+    for t, next_t in zip(transitions[:-1], transitions[1:]):
+      self.assertAllEqual(t.next_state, next_t.state)
     self.assertIsNotNone(policy_net_loss)
     self.assertIsNotNone(value_net_loss)
     self.assertIsNotNone(policy_net_summaries)
@@ -28,4 +28,30 @@ def atari_make_initial_state(state):
   return np.stack([state] * 4, axis=2)
 
 def atari_make_next_state(state, next_state):
-  return np.append(state[:,:,1:], np.expand_dims(next_state, 2), axis=2)
\ No newline at end of file
+  return np.append(state[:,:,1:], np.expand_dims(next_state, 2), axis=2)
+
+# Row/column indices of a TF NEAREST_NEIGHBOR resize from 160x160 to 84x84
+_RESIZE_IDX = (np.arange(84) * 160) // 84
+_GRAY_WEIGHTS = np.array([0.2989, 0.5870, 0.1140], dtype=np.float32)
+
+def atari_process_frames(states):
+  """
+  NumPy equivalent of StateProcessor's former Tensorflow graph (grayscale,
+  crop to 160x160, nearest neighbor resize to 84x84) for a batch of frames.
+
+  Args:
+    states: A [N, 210, 160, 3] batch of Atari RGB States
+
+  Returns:
+    A processed [N, 84, 84] uint8 batch of grayscale states.
+  """
+  cropped = states[:, 34:194][:, _RESIZE_IDX[:, None], _RESIZE_IDX]
+  gray = np.dot(cropped, _GRAY_WEIGHTS) * (255.5 / 255.0)
+  return gray.astype(np.uint8)
+
+def atari_process_frame(state):
+  """
+  Processes a single [210, 160, 3] Atari RGB State into a [84, 84] uint8
+  grayscale state without a Tensorflow session, e.g. in environment subprocesses.
+  """
+  return atari_process_frames(state[None])[0]
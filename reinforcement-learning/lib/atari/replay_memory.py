@@ -0,0 +1,104 @@
+import numpy as np
+
+class FrameReplayMemory():
+    """
+    Replay memory for Atari frames that stores every processed frame once in
+    a preallocated ring buffer. The stacked states of a transition are
+    rebuilt from the frame indices when sampling, so the memory needs
+    size * 84 * 84 bytes for frames instead of two [84, 84, 4] stacks per
+    transition, and evicting the oldest transition is O(1).
+
+    Usage: store the first frame of an episode with store_frame, then after
+    each env step store_effect for that frame and store_frame for the next
+    one. After a terminal step, the next stored frame is the first frame of
+    the new episode, so the next_state of terminal transitions is not
+    meaningful, it is masked by done in the targets anyway.
+
+    Args:
+        size: Maximum number of frames (and transitions) to keep
+        frame_history_len: Number of frames in a state
+    """
+    def __init__(self, size, frame_history_len=4):
+        self.size = size
+        self.frame_history_len = frame_history_len
+
+        self.frames = np.empty((size, 84, 84), dtype=np.uint8)
+        self.actions = np.empty(size, dtype=np.int32)
+        self.rewards = np.empty(size, dtype=np.float32)
+        self.dones = np.zeros(size, dtype=np.bool_)
+
+        self.next_idx = 0
+        self.num_in_buffer = 0
+
+    def __len__(self):
+        # Transitions whose next frame is stored as well
+        return max(self.num_in_buffer - 1, 0)
+
+    def can_sample(self, batch_size):
+        return len(self) >= batch_size
+
+    def store_frame(self, frame):
+        """
+        Args:
+            frame: A processed [84, 84] frame
+
+        Returns:
+            The index of the frame, to pass to store_effect.
+        """
+        idx = self.next_idx
+        self.frames[idx] = frame
+        # The effect of this frame is not known yet
+        self.dones[idx] = False
+        self.next_idx = (self.next_idx + 1) % self.size
+        self.num_in_buffer = min(self.size, self.num_in_buffer + 1)
+        return idx
+
+    def store_effect(self, idx, action, reward, done):
+        self.actions[idx] = action
+        self.rewards[idx] = reward
+        self.dones[idx] = done
+
+    def _encode_states(self, idxs):
+        """
+        Builds the [len(idxs), 84, 84, frame_history_len] states ending at the
+        frames idxs. Frames from before the start of an episode, or older than
+        the oldest stored frame, are replaced by the first frame of the
+        episode, like the initial state of an episode.
+        """
+        k = self.frame_history_len
+        frame_idxs = (idxs[:, None] + np.arange(-(k - 1), 1)) % self.size
+
+        # Frame j of a stack belongs to a previous episode if any of frames
+        # j .. k-2 ended an episode
+        dones = self.dones[frame_idxs[:, :-1]]
+        invalid = np.cumsum(dones[:, ::-1], axis=1)[:, ::-1] > 0
+        ages = (self.next_idx - 1 - idxs)[:, None] % self.size + np.arange(k - 1, 0, -1)
+        invalid |= ages >= self.num_in_buffer
+
+        first_valid = invalid.sum(axis=1)
+        src = np.maximum(np.arange(k)[None, :], first_valid[:, None])
+        frame_idxs = np.take_along_axis(frame_idxs, src, axis=1)
+
+        return np.ascontiguousarray(self.frames[frame_idxs].transpose(0, 2, 3, 1))
+
+    def sample(self, batch_size):
+        """
+        Samples a batch of transitions uniformly.
+
+        Returns:
+            states_batch, action_batch, reward_batch, next_states_batch and
+            done_batch as contiguous arrays.
+        """
+        assert self.can_sample(batch_size)
+        # Age 0 is the newest frame, whose next frame is not stored yet
+        ages = np.random.randint(1, self.num_in_buffer, size=batch_size)
+        idxs = (self.next_idx - 1 - ages) % self.size
+        next_idxs = (idxs + 1) % self.size
+
+        return (
+            self._encode_states(idxs),
+            self.actions[idxs],
+            self.rewards[idxs],
+            self._encode_states(next_idxs),
+            self.dones[idxs],
+        )
@@ -1,28 +1,101 @@
 import numpy as np
-import tensorflow as tf
+
+from lib.atari import helpers as atari_helpers
 
 class StateProcessor():
     """
     Processes a raw Atari iamges. Resizes it and converts it to grayscale.
     """
-    def __init__(self):
-        # Build the Tensorflow graph
-        with tf.variable_scope("state_processor"):
-            self.input_state = tf.placeholder(shape=[210, 160, 3], dtype=tf.uint8)
-            self.output = tf.image.rgb_to_grayscale(self.input_state)
-            self.output = tf.image.crop_to_bounding_box(self.output, 34, 0, 160, 160)
-            self.output = tf.image.resize_images(
-                self.output, [84, 84], method=tf.image.ResizeMethod.NEAREST_NEIGHBOR)
-            self.output = tf.squeeze(self.output)
-
     def process(self, state, sess=None):
         """
         Args:
-            sess: A Tensorflow session object
             state: A [210, 160, 3] Atari RGB State
+            sess: Unused, kept for compatibility with the former Tensorflow
+              implementation
+
+        Returns:
+            A processed [84, 84] state representing grayscale values.
+        """
+        return atari_helpers.atari_process_frame(state)
+
+    def process_batch(self, states):
+        """
+        Args:
+            states: A [N, 210, 160, 3] batch of Atari RGB States, e.g. one per environment
+
+        Returns:
+            A processed [N, 84, 84] batch of grayscale states.
+        """
+        return atari_helpers.atari_process_frames(np.asarray(states))
+
+
+class FrameStack():
+    """
+    Keeps the last stack_size processed frames of num_envs environments in a
+    circular buffer. Every frame is written at two positions, p and
+    p + stack_size, so the current stack is always a contiguous window of the
+    buffer and `states` is a view rather than a copy. The view is overwritten
+    by the next push: copy it if it needs to outlive the step.
+
+    Args:
+        num_envs: Number of environments whose frames are stacked
+        stack_size: Number of frames in a state
+        buffer: Optional [num_envs, 84, 84, 2 * stack_size] uint8 array to
+          keep the frames in, e.g. a view of shared memory
+    """
+    def __init__(self, num_envs=1, stack_size=4, buffer=None):
+        self.num_envs = num_envs
+        self.stack_size = stack_size
+        if buffer is None:
+            buffer = np.zeros((num_envs, 84, 84, 2 * stack_size), dtype=np.uint8)
+        assert buffer.shape == (num_envs, 84, 84, 2 * stack_size) and buffer.dtype == np.uint8
+        self.buffer = buffer
+        # Position of the oldest frame of the current stack
+        self.start = 0
+
+    @property
+    def states(self):
+        """
+        The current [num_envs, 84, 84, stack_size] states, as a view.
+        """
+        return self.buffer[..., self.start:self.start + self.stack_size]
+
+    def reset(self, frames, env_ids=None):
+        """
+        Starts new episodes: the stacks of env_ids are filled with copies of
+        their first frame.
+
+        Args:
+            frames: [len(env_ids), 210, 160, 3] raw Atari frames
+            env_ids: Environments to reset, defaults to all of them
+
+        Returns:
+            The current states of all environments.
+        """
+        frames = np.asarray(frames)
+        if frames.ndim == 3:
+            frames = frames[None]
+        if env_ids is None:
+            env_ids = np.arange(self.num_envs)
+        processed = atari_helpers.atari_process_frames(frames)
+        self.buffer[env_ids] = processed[..., None]
+        return self.states
+
+    def push(self, frames):
+        """
+        Appends one new frame per environment to the stacks.
+
+        Args:
+            frames: [num_envs, 210, 160, 3] raw Atari frames
 
         Returns:
-            A processed [84, 84, 1] state representing grayscale values.
+            The current states of all environments.
         """
-        sess = sess or tf.get_default_session()
-        return sess.run(self.output, { self.input_state: state })
\ No newline at end of file
+        frames = np.asarray(frames)
+        if frames.ndim == 3:
+            frames = frames[None]
+        processed = atari_helpers.atari_process_frames(frames)
+        self.buffer[..., self.start] = processed
+        self.buffer[..., self.start + self.stack_size] = processed
+        self.start = (self.start + 1) % self.stack_size
+        return self.states
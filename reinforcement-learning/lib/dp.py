@@ -0,0 +1,256 @@
+"""
+Vectorized dynamic programming over the dense transition tensors of a
+lib.envs DiscreteEnv. The same algorithms as the DP notebooks, but each
+sweep over the states is one matrix-vector product, so grids with 10^5 to
+10^6 states are solved in seconds. Transitions flagged done end the
+episode, so the value of their next state is not counted. For the
+Gridworld, whose terminal states loop on themselves with reward 0, this
+gives the same values as the notebooks.
+"""
+import collections
+import warnings
+
+import numpy as np
+
+TabularModel = collections.namedtuple("TabularModel", ["nS", "nA", "T", "R"])
+
+
+def build_model(env, sparse=None, dtype=np.float64):
+    """
+    Builds the transition matrix and expected rewards of a DiscreteEnv.
+
+    Args:
+        env: A lib.envs DiscreteEnv.
+        sparse: Whether to build a scipy.sparse matrix. Defaults to sparse
+            for more than 2000 states, where the dense matrix gets too big.
+        dtype: np.float64 or np.float32. float32 halves the memory and is
+            faster, but theta has to stay well above its precision.
+
+    Returns:
+        A TabularModel with T of shape [S * A, S], where row s * nA + a holds
+        the probabilities of continuing in each next state after taking a in
+        s (episode ending transitions are left out), and R of shape [S, A]
+        with the expected rewards.
+    """
+    nS, nA = env.nS, env.nA
+    probs = env.transition_probs
+    K = probs.shape[2]
+    R = (probs * env.transition_rewards).sum(axis=2).astype(dtype)
+    rows = np.repeat(np.arange(nS * nA), K)
+    cols = env.transition_next_states.reshape(-1)
+    data = (probs * ~env.transition_dones).reshape(-1).astype(dtype)
+
+    if sparse is None:
+        sparse = nS > 2000
+    if sparse:
+        import scipy.sparse
+        keep = data > 0
+        # Duplicate (row, col) entries are summed
+        T = scipy.sparse.csr_matrix((data[keep], (rows[keep], cols[keep])), shape=(nS * nA, nS))
+    else:
+        T = np.zeros((nS * nA, nS), dtype=dtype)
+        np.add.at(T, (rows, cols), data)
+    return TabularModel(nS, nA, T, R)
+
+
+def _as_model(env, sparse, dtype):
+    if isinstance(env, TabularModel):
+        return env
+    return build_model(env, sparse=sparse, dtype=dtype)
+
+
+def q_values(model, V, discount_factor=1.0):
+    """
+    One step lookahead for all states and actions at once.
+
+    Returns:
+        An [S, A] array with the expected value of each action.
+    """
+    return model.R + discount_factor * (model.T @ V).reshape(model.nS, model.nA)
+
+
+def greedy_policy(Q):
+    """
+    Returns the deterministic [S, A] policy taking the best action of Q,
+    ties are resolved like np.argmax.
+    """
+    policy = np.zeros(Q.shape)
+    policy[np.arange(len(Q)), np.argmax(Q, axis=1)] = 1.0
+    return policy
+
+
+def _policy_matrix(model, policy):
+    """
+    Returns the [S, S] transition matrix and [S] expected rewards of a policy.
+    """
+    nS, nA = model.nS, model.nA
+    policy = np.asarray(policy, dtype=model.R.dtype)
+    r_pi = (policy * model.R).sum(axis=1)
+    if isinstance(model.T, np.ndarray):
+        P_pi = np.einsum('sa,san->sn', policy, model.T.reshape(nS, nA, nS))
+    else:
+        import scipy.sparse
+        # W[s, s * nA + a] = policy[s, a]
+        W = scipy.sparse.csr_matrix(
+            (policy.reshape(-1), np.arange(nS * nA), np.arange(0, nS * nA + 1, nA)),
+            shape=(nS, nS * nA))
+        P_pi = (W @ model.T).tocsr()
+    return P_pi, r_pi
+
+
+def _iterate(backup, V, theta, max_iterations, name):
+    """
+    Applies V = backup(V) until the largest change is below theta.
+    """
+    for i in range(max_iterations):
+        new_V = backup(V)
+        delta = np.max(np.abs(new_V - V)) if len(V) else 0.0
+        V = new_V
+        if delta < theta:
+            return V, i + 1
+    warnings.warn("{} did not converge in {} iterations (last change {:.3g})".format(
+        name, max_iterations, delta))
+    return V, max_iterations
+
+
+def policy_eval(policy, env, discount_factor=1.0, theta=0.00001, V=None,
+                max_iterations=100000, sparse=None, dtype=np.float64):
+    """
+    Evaluate a policy given an environment and a full description of the environment's dynamics.
+
+    Args:
+        policy: [S, A] shaped matrix representing the policy.
+        env: A DiscreteEnv, or a TabularModel from build_model to reuse.
+        discount_factor: Gamma discount factor.
+        theta: We stop evaluation once our value function change is less than theta for all states.
+        V: Initial value function, zeros by default.
+        max_iterations: Warns and stops after this many sweeps.
+        sparse, dtype: See build_model.
+
+    Returns:
+        Vector of length env.nS representing the value function.
+    """
+    model = _as_model(env, sparse, dtype)
+    P_pi, r_pi = _policy_matrix(model, policy)
+    V = np.zeros(model.nS, dtype=model.R.dtype) if V is None else np.asarray(V, dtype=model.R.dtype)
+    V, _ = _iterate(lambda V: r_pi + discount_factor * (P_pi @ V),
+                    V, theta, max_iterations, "Policy evaluation")
+    return V
+
+
+def policy_eval_exact(policy, env, discount_factor=1.0, sparse=None, dtype=np.float64):
+    """
+    Evaluates a policy by solving the linear Bellman equations directly,
+    which is much faster than sweeping when episodes are long. With
+    discount_factor=1 every state has to reach the end of the episode
+    under the policy, otherwise the system is singular.
+
+    Args:
+        policy: [S, A] shaped matrix representing the policy.
+        env: A DiscreteEnv, or a TabularModel from build_model to reuse.
+        discount_factor: Gamma discount factor.
+        sparse, dtype: See build_model.
+
+    Returns:
+        Vector of length env.nS representing the value function.
+    """
+    model = _as_model(env, sparse, dtype)
+    P_pi, r_pi = _policy_matrix(model, policy)
+    if isinstance(P_pi, np.ndarray):
+        A = np.eye(model.nS, dtype=P_pi.dtype) - discount_factor * P_pi
+        return np.linalg.solve(A, r_pi)
+    import scipy.sparse
+    import scipy.sparse.linalg
+    A = scipy.sparse.identity(model.nS, dtype=P_pi.dtype, format='csc') - discount_factor * P_pi
+    return scipy.sparse.linalg.spsolve(A.tocsc(), r_pi).astype(model.R.dtype)
+
+
+def value_iteration(env, theta=0.0001, discount_factor=1.0, max_iterations=100000,
+                    sparse=None, dtype=np.float64):
+    """
+    Value Iteration Algorithm.
+
+    Args:
+        env: A DiscreteEnv, or a TabularModel from build_model to reuse.
+        theta: We stop once our value function change is less than theta for all states.
+        discount_factor: Gamma discount factor.
+        max_iterations: Warns and stops after this many sweeps.
+        sparse, dtype: See build_model.
+
+    Returns:
+        A tuple (policy, V) of the optimal policy and the optimal value function.
+    """
+    model = _as_model(env, sparse, dtype)
+    V = np.zeros(model.nS, dtype=model.R.dtype)
+    V, _ = _iterate(lambda V: q_values(model, V, discount_factor).max(axis=1),
+                    V, theta, max_iterations, "Value iteration")
+    policy = greedy_policy(q_values(model, V, discount_factor))
+    return policy, V
+
+
+def policy_iteration(env, discount_factor=1.0, theta=0.00001, exact=True, max_iterations=1000,
+                     sparse=None, dtype=np.float64):
+    """
+    Policy Iteration Algorithm. Iteratively evaluates and improves a policy,
+    starting from the uniform random policy, until it is stable.
+
+    Args:
+        env: A DiscreteEnv, or a TabularModel from build_model to reuse.
+        discount_factor: Gamma discount factor.
+        theta: Stopping threshold of the policy evaluations if not exact.
+        exact: Evaluate the policies with policy_eval_exact. Otherwise with
+            policy_eval, starting from the values of the previous policy.
+        max_iterations: Warns and stops after this many improvements.
+        sparse, dtype: See build_model.
+
+    Returns:
+        A tuple (policy, V) of the optimal policy and its value function.
+    """
+    model = _as_model(env, sparse, dtype)
+    policy = np.ones([model.nS, model.nA]) / model.nA
+    V = None
+    for _ in range(max_iterations):
+        if exact:
+            V = policy_eval_exact(policy, model, discount_factor)
+        else:
+            V = policy_eval(policy, model, discount_factor, theta, V=V)
+        new_policy = greedy_policy(q_values(model, V, discount_factor))
+        if np.array_equal(new_policy, policy):
+            return policy, V
+        policy = new_policy
+    warnings.warn("Policy iteration did not converge in {} iterations".format(max_iterations))
+    return policy, V
+
+
+def modified_policy_iteration(env, discount_factor=1.0, theta=0.0001, eval_sweeps=10,
+                              max_iterations=100000, sparse=None, dtype=np.float64):
+    """
+    Modified Policy Iteration. Like policy iteration, but each policy is only
+    evaluated with eval_sweeps sweeps before the next improvement. With
+    eval_sweeps=1 this is value iteration.
+
+    Args:
+        env: A DiscreteEnv, or a TabularModel from build_model to reuse.
+        discount_factor: Gamma discount factor.
+        theta: We stop once an improvement step changes the values by less than theta.
+        eval_sweeps: Number of evaluation sweeps per policy.
+        max_iterations: Warns and stops after this many improvements.
+        sparse, dtype: See build_model.
+
+    Returns:
+        A tuple (policy, V) of the optimal policy and the optimal value function.
+    """
+    model = _as_model(env, sparse, dtype)
+    V = np.zeros(model.nS, dtype=model.R.dtype)
+    for _ in range(max_iterations):
+        Q = q_values(model, V, discount_factor)
+        new_V = Q.max(axis=1)
+        delta = np.max(np.abs(new_V - V)) if len(V) else 0.0
+        V = new_V
+        if delta < theta:
+            return greedy_policy(Q), V
+        P_pi, r_pi = _policy_matrix(model, greedy_policy(Q))
+        for _ in range(eval_sweeps - 1):
+            V = r_pi + discount_factor * (P_pi @ V)
+    warnings.warn("Modified policy iteration did not converge in {} iterations".format(max_iterations))
+    return greedy_policy(q_values(model, V, discount_factor)), V
@@ -0,0 +1,181 @@
+"""
+Vectorized version of the BlackjackEnv rules: many hands are played at
+once with NumPy instead of one hand with Python lists, and the episodes
+are returned as flat columns for Monte Carlo estimation.
+"""
+import collections
+
+import numpy as np
+
+# 1 = Ace, 2-10 = Number cards, Jack/Queen/King = 10
+deck = np.array([1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10])
+
+# One row per step, ordered by episode and then by step
+BlackjackEpisodes = collections.namedtuple("BlackjackEpisodes", [
+    "episode", "step", "player_sum", "dealer_card", "usable_ace", "action", "reward", "done"])
+
+
+class _Hands(object):
+    """
+    Hands stored as the sum with aces counted as 1, whether they hold an
+    ace and the number of cards.
+    """
+    def __init__(self, n):
+        self.raw_sum = np.zeros(n, dtype=np.int64)
+        self.has_ace = np.zeros(n, dtype=np.bool_)
+        self.num_cards = np.zeros(n, dtype=np.int64)
+
+    def add(self, cards, mask=None):
+        if mask is None:
+            mask = np.ones(len(self.raw_sum), dtype=np.bool_)
+        self.raw_sum += np.where(mask, cards, 0)
+        self.has_ace |= mask & (cards == 1)
+        self.num_cards += mask
+
+    def usable_ace(self):
+        return self.has_ace & (self.raw_sum + 10 <= 21)
+
+    def sum(self):
+        return self.raw_sum + 10 * self.usable_ace()
+
+
+def draw_cards(np_random, n):
+    return deck[np_random.integers(len(deck), size=n)]
+
+
+def simulate(policy, num_episodes, np_random=None, natural=False):
+    """
+    Plays num_episodes hands of blackjack in parallel, with the same rules
+    as BlackjackEnv.
+
+    Args:
+        policy: Either a function of the player_sum, dealer_card and
+            usable_ace arrays returning an array of actions (1 = hit,
+            0 = stick), or an integer array of actions of shape [32, 11, 2]
+            indexed by the observation.
+        num_episodes: Number of hands to play.
+        np_random: A np.random.Generator, a new one by default.
+        natural: Pay out 1.5 on a natural blackjack win, like BlackjackEnv.
+
+    Returns:
+        BlackjackEpisodes with one row per step. player_sum, dealer_card and
+        usable_ace are the observation the action was taken in.
+    """
+    if np_random is None:
+        np_random = np.random.default_rng()
+    if not callable(policy):
+        table = np.asarray(policy)
+        policy = lambda player_sum, dealer_card, usable_ace: table[player_sum, dealer_card, usable_ace.astype(np.int64)]
+
+    n = num_episodes
+    dealer = _Hands(n)
+    player = _Hands(n)
+    dealer.add(draw_cards(np_random, n))
+    dealer_card = dealer.raw_sum.copy()
+    dealer.add(draw_cards(np_random, n))
+    player.add(draw_cards(np_random, n))
+    player.add(draw_cards(np_random, n))
+
+    # Auto-draw another card if the score is less than 12
+    low = player.sum() < 12
+    while low.any():
+        player.add(draw_cards(np_random, n), low)
+        low = player.sum() < 12
+
+    columns = collections.defaultdict(list)
+    rewards = np.zeros(n)
+    active = np.ones(n, dtype=np.bool_)
+    stuck = np.zeros(n, dtype=np.bool_)
+    t = 0
+    while active.any():
+        player_sum = player.sum()
+        usable_ace = player.usable_ace()
+        actions = np.asarray(policy(player_sum, dealer_card, usable_ace)).astype(np.int64)
+        hit = active & (actions == 1)
+        player.add(draw_cards(np_random, n), hit)
+        bust = hit & (player.sum() > 21)
+        stick = active & (actions == 0)
+        rewards[bust] = -1.0
+        stuck |= stick
+
+        idx = np.flatnonzero(active)
+        columns["episode"].append(idx)
+        columns["step"].append(np.full(len(idx), t))
+        columns["player_sum"].append(player_sum[idx])
+        columns["dealer_card"].append(dealer_card[idx])
+        columns["usable_ace"].append(usable_ace[idx])
+        columns["action"].append(actions[idx])
+        columns["done"].append((bust | stick)[idx])
+
+        active &= ~(bust | stick)
+        t += 1
+
+    # Stick: play out the dealers hand, and score
+    drawing = stuck & (dealer.sum() < 17)
+    while drawing.any():
+        dealer.add(draw_cards(np_random, n), drawing)
+        drawing = stuck & (dealer.sum() < 17)
+    player_score = np.where(player.sum() > 21, 0, player.sum())
+    dealer_score = np.where(dealer.sum() > 21, 0, dealer.sum())
+    outcome = np.sign(player_score - dealer_score).astype(np.float64)
+    if natural:
+        is_natural = (player.num_cards == 2) & player.has_ace & (player.raw_sum == 11)
+        outcome[is_natural & (outcome == 1)] = 1.5
+    rewards[stuck] = outcome[stuck]
+
+    columns = {k: np.concatenate(v) for k, v in columns.items()}
+    order = np.lexsort((columns["step"], columns["episode"]))
+    columns = {k: v[order] for k, v in columns.items()}
+    # Rewards are only given at the last step
+    columns["reward"] = np.where(columns["done"], rewards[columns["episode"]], 0.0)
+    return BlackjackEpisodes(**columns)
+
+
+def mc_prediction(episodes, discount_factor=1.0, first_visit=True):
+    """
+    Monte Carlo prediction from the columns returned by simulate.
+
+    Args:
+        episodes: BlackjackEpisodes.
+        discount_factor: Gamma discount factor.
+        first_visit: Only count the first visit of a state in each episode,
+            otherwise every visit.
+
+    Returns:
+        A tuple (V, counts) of [32, 11, 2] arrays indexed by the observation,
+        with the average return and the number of returns of each state.
+    """
+    episode = episodes.episode
+    # Discounted return of each step, episodes being contiguous and ordered by step
+    G = np.zeros(len(episode))
+    for t in range(episodes.step.max(initial=-1), -1, -1):
+        rows = np.flatnonzero(episodes.step == t)
+        following = rows + 1
+        has_next = (following < len(episode))
+        has_next[has_next] = episode[following[has_next]] == episode[rows[has_next]]
+        G[rows] = episodes.reward[rows]
+        G[rows[has_next]] += discount_factor * G[following[has_next]]
+
+    states = np.ravel_multi_index(
+        (episodes.player_sum, episodes.dealer_card, episodes.usable_ace.astype(np.int64)), (32, 11, 2))
+    rows = np.arange(len(episode))
+    if first_visit:
+        _, rows = np.unique(episode * (32 * 11 * 2) + states, return_index=True)
+
+    returns_sum = np.zeros(32 * 11 * 2)
+    counts = np.zeros(32 * 11 * 2, dtype=np.int64)
+    np.add.at(returns_sum, states[rows], G[rows])
+    np.add.at(counts, states[rows], 1)
+    V = np.divide(returns_sum, counts, out=np.zeros_like(returns_sum), where=counts > 0)
+    return V.reshape(32, 11, 2), counts.reshape(32, 11, 2)
+
+
+def value_dict(V, counts):
+    """
+    Converts arrays from mc_prediction to the state -> value dictionary of the
+    MC notebooks, for states that have been visited.
+    """
+    V_dict = collections.defaultdict(float)
+    for player_sum, dealer_card, usable_ace in zip(*np.nonzero(counts)):
+        V_dict[(int(player_sum), int(dealer_card), bool(usable_ace))] = V[player_sum, dealer_card, usable_ace]
+    return V_dict
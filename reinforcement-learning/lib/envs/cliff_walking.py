@@ -13,21 +13,6 @@ class CliffWalkingEnv(discrete.DiscreteEnv):
 
     metadata = {'render.modes': ['human', 'ansi']}
 
-    def _limit_coordinates(self, coord):
-        coord[0] = min(coord[0], self.shape[0] - 1)
-        coord[0] = max(coord[0], 0)
-        coord[1] = min(coord[1], self.shape[1] - 1)
-        coord[1] = max(coord[1], 0)
-        return coord
-
-    def _calculate_transition_prob(self, current, delta):
-        new_position = np.array(current) + np.array(delta)
-        new_position = self._limit_coordinates(new_position).astype(int)
-        new_state = np.ravel_multi_index(tuple(new_position), self.shape)
-        reward = -100.0 if self._cliff[tuple(new_position)] else -1.0
-        is_done = self._cliff[tuple(new_position)] or (tuple(new_position) == (3,11))
-        return [(1.0, new_state, reward, is_done)]
-
     def __init__(self):
         self.shape = (4, 12)
 
@@ -35,24 +20,27 @@ class CliffWalkingEnv(discrete.DiscreteEnv):
         nA = 4
 
         # Cliff Location
-        self._cliff = np.zeros(self.shape, dtype=np.bool)
+        self._cliff = np.zeros(self.shape, dtype=np.bool_)
         self._cliff[3, 1:-1] = True
 
-        # Calculate transition probabilities
-        P = {}
-        for s in range(nS):
-            position = np.unravel_index(s, self.shape)
-            P[s] = { a : [] for a in range(nA) }
-            P[s][UP] = self._calculate_transition_prob(position, [-1, 0])
-            P[s][RIGHT] = self._calculate_transition_prob(position, [0, 1])
-            P[s][DOWN] = self._calculate_transition_prob(position, [1, 0])
-            P[s][LEFT] = self._calculate_transition_prob(position, [0, -1])
+        # Calculate transition probabilities for all states and actions at once
+        y, x = np.unravel_index(np.arange(nS), self.shape)
+        dy = np.array([-1, 0, 1, 0])  # UP, RIGHT, DOWN, LEFT
+        dx = np.array([0, 1, 0, -1])
+        ns_y = np.clip(y[:, None] + dy, 0, self.shape[0] - 1)
+        ns_x = np.clip(x[:, None] + dx, 0, self.shape[1] - 1)
+        next_states = np.ravel_multi_index((ns_y, ns_x), self.shape)
+        in_cliff = self._cliff[ns_y, ns_x]
+        rewards = np.where(in_cliff, -100.0, -1.0)
+        dones = in_cliff | ((ns_y == 3) & (ns_x == 11))
+        self._set_deterministic_transitions(next_states, rewards, dones)
 
         # We always start in state (3, 0)
         isd = np.zeros(nS)
         isd[np.ravel_multi_index((3,0), self.shape)] = 1.0
 
-        super(CliffWalkingEnv, self).__init__(nS, nA, P, isd)
+        # DiscreteEnv builds P from the transition arrays
+        super(CliffWalkingEnv, self).__init__(nS, nA, None, isd)
 
     def render(self, mode='human', close=False):
         self._render(mode, close)
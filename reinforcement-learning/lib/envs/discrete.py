@@ -1,9 +1,51 @@
+import collections.abc
 import numpy as np
 
 from gym import Env, spaces
 from gym.utils import seeding
 from gym.envs.toy_text.utils import categorical_sample
 
+# Environments with at most this many (state, action) pairs get P as a plain
+# dict, larger ones a TransitionTable
+EAGER_TRANSITIONS = 10000
+
+
+class TransitionTable(collections.abc.Mapping):
+    """
+    Read-only view of dense (nS, nA, K) transition arrays with the same
+    interface as P, T[s][a] == [(probability, nextstate, reward, done), ...].
+    The lists of a state are built when it is first accessed and then kept,
+    so large environments don't have to build millions of tuples up front.
+    Outcomes with probability 0 are left out.
+    """
+
+    def __init__(self, probs, next_states, rewards, dones):
+        self.probs = probs
+        self.next_states = next_states
+        self.rewards = rewards
+        self.dones = dones
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.probs)
+
+    def __iter__(self):
+        return iter(range(len(self.probs)))
+
+    def __getitem__(self, s):
+        P_s = self._cache.get(s)
+        if P_s is None:
+            if not 0 <= s < len(self.probs):
+                raise KeyError(s)
+            P_s = self._cache[s] = {
+                a: [(p, ns, r, d) for p, ns, r, d in zip(
+                        self.probs[s, a].tolist(), self.next_states[s, a].tolist(),
+                        self.rewards[s, a].tolist(), self.dones[s, a].tolist()) if p > 0]
+                for a in range(self.probs.shape[1])
+            }
+        return P_s
+
+
 class DiscreteEnv(Env):
 
     """
@@ -12,16 +54,21 @@ class DiscreteEnv(Env):
     - nA: number of actions
     - P: transitions (*)
     - isd: initial state distribution (**)
+    - transition_probs, transition_next_states, transition_rewards,
+      transition_dones: dense (nS, nA, K) arrays of the same transitions (***)
 
     (*) dictionary of lists, where
       P[s][a] == [(probability, nextstate, reward, done), ...]
     (**) list or array of length nS
+    (***) K is the largest number of outcomes of a (state, action) pair.
+      Missing outcomes have probability 0, stay in s and have reward 0.
+      Subclasses can set these arrays before calling __init__ with P=None,
+      P is then built from them, as a TransitionTable for large environments.
 
 
     """
 
     def __init__(self, nS, nA, P, isd):
-        self.P = P
         self.isd = isd
         self.lastaction = None  # for rendering
         self.nS = nS
@@ -30,9 +77,46 @@ class DiscreteEnv(Env):
         self.action_space = spaces.Discrete(self.nA)
         self.observation_space = spaces.Discrete(self.nS)
 
+        if P is None:
+            P = TransitionTable(self.transition_probs, self.transition_next_states,
+                                self.transition_rewards, self.transition_dones)
+            if nS * nA <= EAGER_TRANSITIONS:
+                P = dict(P)
+        self.P = P
+        if not hasattr(self, 'transition_probs'):
+            self._build_transition_tensors()
+        self._cum_probs = np.cumsum(self.transition_probs, axis=2)
+
         self.seed()
         self.s = categorical_sample(self.isd, self.np_random)
 
+    def _set_deterministic_transitions(self, next_states, rewards, dones):
+        """
+        Sets the dense transition arrays of deterministic dynamics from
+        [nS, nA] arrays of next states, rewards and dones.
+        """
+        self.transition_next_states = np.asarray(next_states, dtype=np.int64)[..., None]
+        self.transition_probs = np.ones(self.transition_next_states.shape)
+        self.transition_rewards = np.broadcast_to(
+            np.asarray(rewards, dtype=np.float64)[..., None], self.transition_probs.shape).copy()
+        self.transition_dones = np.asarray(dones, dtype=np.bool_)[..., None]
+
+    def _build_transition_tensors(self):
+        K = max(len(P_sa) for P_s in self.P.values() for P_sa in P_s.values())
+        shape = (self.nS, self.nA, K)
+        self.transition_probs = np.zeros(shape)
+        self.transition_next_states = np.empty(shape, dtype=np.int64)
+        self.transition_next_states[:] = np.arange(self.nS)[:, None, None]
+        self.transition_rewards = np.zeros(shape)
+        self.transition_dones = np.zeros(shape, dtype=np.bool_)
+        for s, P_s in self.P.items():
+            for a, transitions in P_s.items():
+                for i, (p, ns, r, d) in enumerate(transitions):
+                    self.transition_probs[s, a, i] = p
+                    self.transition_next_states[s, a, i] = ns
+                    self.transition_rewards[s, a, i] = r
+                    self.transition_dones[s, a, i] = d
+
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
         return [seed]
@@ -43,9 +127,33 @@ class DiscreteEnv(Env):
         return int(self.s)
 
     def step(self, a):
-        transitions = self.P[self.s][a]
-        i = categorical_sample([t[0] for t in transitions], self.np_random)
-        p, s, r, d = transitions[i]
+        # Same sampling as categorical_sample, on the precomputed cumulative probabilities
+        i = np.argmax(self._cum_probs[self.s, a] > self.np_random.random())
+        p = self.transition_probs[self.s, a, i]
+        s = self.transition_next_states[self.s, a, i]
+        r = self.transition_rewards[self.s, a, i]
+        d = self.transition_dones[self.s, a, i]
         self.s = s
         self.lastaction = a
-        return (int(s), r, d, {"prob": p})
+        return (int(s), float(r), bool(d), {"prob": float(p)})
+
+    def step_batch(self, states, actions):
+        """
+        Steps many independent copies of the environment at once. The state
+        of this environment (self.s) is not used or changed.
+
+        Args:
+            states: Array of current states
+            actions: Array of actions, one per state
+
+        Returns:
+            next_states, rewards, dones and probs arrays of the same length
+        """
+        states = np.asarray(states)
+        actions = np.asarray(actions)
+        cum_probs = self._cum_probs[states, actions]
+        u = self.np_random.random(states.shape)
+        i = np.argmax(cum_probs > u[..., None], axis=-1)
+        idx = (states, actions, i)
+        return (self.transition_next_states[idx], self.transition_rewards[idx],
+                self.transition_dones[idx], self.transition_probs[idx])
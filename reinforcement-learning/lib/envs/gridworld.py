@@ -43,47 +43,29 @@ class GridworldEnv(discrete.DiscreteEnv):
         MAX_Y = shape[0]
         MAX_X = shape[1]
 
-        P = {}
-        grid = np.arange(nS).reshape(shape)
-        it = np.nditer(grid, flags=['multi_index'])
-
-        while not it.finished:
-            s = it.iterindex
-            y, x = it.multi_index
-
-            # P[s][a] = (prob, next_state, reward, is_done)
-            P[s] = {a : [] for a in range(nA)}
-
-            is_done = lambda s: s == 0 or s == (nS - 1)
-            reward = 0.0 if is_done(s) else -1.0
-
-            # We're stuck in a terminal state
-            if is_done(s):
-                P[s][UP] = [(1.0, s, reward, True)]
-                P[s][RIGHT] = [(1.0, s, reward, True)]
-                P[s][DOWN] = [(1.0, s, reward, True)]
-                P[s][LEFT] = [(1.0, s, reward, True)]
-            # Not a terminal state
-            else:
-                ns_up = s if y == 0 else s - MAX_X
-                ns_right = s if x == (MAX_X - 1) else s + 1
-                ns_down = s if y == (MAX_Y - 1) else s + MAX_X
-                ns_left = s if x == 0 else s - 1
-                P[s][UP] = [(1.0, ns_up, reward, is_done(ns_up))]
-                P[s][RIGHT] = [(1.0, ns_right, reward, is_done(ns_right))]
-                P[s][DOWN] = [(1.0, ns_down, reward, is_done(ns_down))]
-                P[s][LEFT] = [(1.0, ns_left, reward, is_done(ns_left))]
-
-            it.iternext()
+        # P[s][a] = (prob, next_state, reward, is_done), computed for all
+        # states and actions at once
+        y, x = np.divmod(np.arange(nS), MAX_X)
+        dy = np.array([-1, 0, 1, 0])  # UP, RIGHT, DOWN, LEFT
+        dx = np.array([0, 1, 0, -1])
+        ns_y = np.clip(y[:, None] + dy, 0, MAX_Y - 1)
+        ns_x = np.clip(x[:, None] + dx, 0, MAX_X - 1)
+        next_states = ns_y * MAX_X + ns_x
+
+        is_done = lambda s: (s == 0) | (s == (nS - 1))
+        terminal = is_done(np.arange(nS))
+        # We're stuck in a terminal state
+        next_states[terminal] = np.arange(nS)[terminal, None]
+        rewards = np.where(terminal, 0.0, -1.0)[:, None].repeat(nA, axis=1)
+        self._set_deterministic_transitions(next_states, rewards, is_done(next_states))
 
         # Initial state distribution is uniform
         isd = np.ones(nS) / nS
 
         # We expose the model of the environment for educational purposes
         # This should not be used in any model-free learning algorithm
-        self.P = P
-
-        super(GridworldEnv, self).__init__(nS, nA, P, isd)
+        # DiscreteEnv builds P from the transition arrays
+        super(GridworldEnv, self).__init__(nS, nA, None, isd)
 
     def _render(self, mode='human', close=False):
         """ Renders the current gridworld layout
@@ -14,20 +14,6 @@ class WindyGridworldEnv(discrete.DiscreteEnv):
 
     metadata = {'render.modes': ['human', 'ansi']}
 
-    def _limit_coordinates(self, coord):
-        coord[0] = min(coord[0], self.shape[0] - 1)
-        coord[0] = max(coord[0], 0)
-        coord[1] = min(coord[1], self.shape[1] - 1)
-        coord[1] = max(coord[1], 0)
-        return coord
-
-    def _calculate_transition_prob(self, current, delta, winds):
-        new_position = np.array(current) + np.array(delta) + np.array([-1, 0]) * winds[tuple(current)]
-        new_position = self._limit_coordinates(new_position).astype(int)
-        new_state = np.ravel_multi_index(tuple(new_position), self.shape)
-        is_done = tuple(new_position) == (3, 7)
-        return [(1.0, new_state, -1.0, is_done)]
-
     def __init__(self):
         self.shape = (7, 10)
 
@@ -39,21 +25,23 @@ class WindyGridworldEnv(discrete.DiscreteEnv):
         winds[:,[3,4,5,8]] = 1
         winds[:,[6,7]] = 2
 
-        # Calculate transition probabilities
-        P = {}
-        for s in range(nS):
-            position = np.unravel_index(s, self.shape)
-            P[s] = { a : [] for a in range(nA) }
-            P[s][UP] = self._calculate_transition_prob(position, [-1, 0], winds)
-            P[s][RIGHT] = self._calculate_transition_prob(position, [0, 1], winds)
-            P[s][DOWN] = self._calculate_transition_prob(position, [1, 0], winds)
-            P[s][LEFT] = self._calculate_transition_prob(position, [0, -1], winds)
+        # Calculate transition probabilities for all states and actions at
+        # once, the wind of the current cell pushes up
+        y, x = np.unravel_index(np.arange(nS), self.shape)
+        dy = np.array([-1, 0, 1, 0])  # UP, RIGHT, DOWN, LEFT
+        dx = np.array([0, 1, 0, -1])
+        ns_y = np.clip(y[:, None] + dy - winds[y, x][:, None].astype(int), 0, self.shape[0] - 1)
+        ns_x = np.clip(x[:, None] + dx, 0, self.shape[1] - 1)
+        next_states = np.ravel_multi_index((ns_y, ns_x), self.shape)
+        dones = (ns_y == 3) & (ns_x == 7)
+        self._set_deterministic_transitions(next_states, -np.ones(next_states.shape), dones)
 
         # We always start in state (3, 0)
         isd = np.zeros(nS)
         isd[np.ravel_multi_index((3,0), self.shape)] = 1.0
 
-        super(WindyGridworldEnv, self).__init__(nS, nA, P, isd)
+        # DiscreteEnv builds P from the transition arrays
+        super(WindyGridworldEnv, self).__init__(nS, nA, None, isd)
 
     def render(self, mode='human', close=False):
         self._render(mode, close)
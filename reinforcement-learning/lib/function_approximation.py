@@ -0,0 +1,84 @@
+"""
+The linear action-value estimator of the Function Approximation exercise:
+RBF features of the standardized state and one SGDRegressor per action.
+States are featurized in batches, so plotting.plot_cost_to_go_mountain_car
+evaluates the whole grid with a few matrix products through predict_batch.
+"""
+import numpy as np
+import sklearn.pipeline
+import sklearn.preprocessing
+from sklearn.kernel_approximation import RBFSampler
+from sklearn.linear_model import SGDRegressor
+
+
+class Estimator():
+    """
+    Value Function approximator.
+    """
+
+    def __init__(self, env, n_components=100, gammas=(5.0, 2.0, 1.0, 0.5), num_samples=10000):
+        # Feature Preprocessing: Normalize to zero mean and unit variance
+        # We use a few samples from the observation space to do this
+        observation_examples = np.array([env.observation_space.sample() for x in range(num_samples)])
+        self.scaler = sklearn.preprocessing.StandardScaler()
+        self.scaler.fit(observation_examples)
+
+        # RBF kernels with different variances to cover different parts of the space
+        self.featurizer = sklearn.pipeline.FeatureUnion([
+            ("rbf{}".format(i + 1), RBFSampler(gamma=gamma, n_components=n_components))
+            for i, gamma in enumerate(gammas)])
+        self.featurizer.fit(self.scaler.transform(observation_examples))
+
+        # We create a separate model for each action in the environment's
+        # action space. Alternatively we could somehow encode the action
+        # into the features, but this way it's easier to code up.
+        self.models = []
+        initial_features = self.featurize_states([env.observation_space.sample()])
+        for _ in range(env.action_space.n):
+            model = SGDRegressor(learning_rate="constant")
+            # We need to call partial_fit once to initialize the model
+            # or we get a NotFittedError when trying to make a prediction
+            model.partial_fit(initial_features, [0])
+            self.models.append(model)
+
+    def featurize_states(self, states):
+        """
+        Returns the featurized representation of an [N, D] array of states.
+        """
+        return self.featurizer.transform(self.scaler.transform(np.asarray(states, dtype=np.float64)))
+
+    def featurize_state(self, state):
+        """
+        Returns the featurized representation for a state.
+        """
+        return self.featurize_states([state])[0]
+
+    def predict(self, s, a=None):
+        """
+        Makes value function predictions.
+
+        Args:
+            s: state to make a prediction for
+            a: (Optional) action to make a prediction for
+
+        Returns
+            If an action a is given this returns a single number as the prediction.
+            If no action is given this returns a vector or predictions for all actions
+            in the environment where pred[i] is the prediction for action i.
+        """
+        values = self.predict_batch([s])[0]
+        return values if a is None else values[a]
+
+    def predict_batch(self, states):
+        """
+        Returns the [N, nA] action values of an [N, D] array of states.
+        """
+        features = self.featurize_states(states)
+        return np.stack([model.predict(features) for model in self.models], axis=1)
+
+    def update(self, s, a, y):
+        """
+        Updates the estimator parameters for a given state and action towards
+        the target y.
+        """
+        self.models[a].partial_fit(self.featurize_states([s]), [y])
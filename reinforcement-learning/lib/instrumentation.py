@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import defaultdict
+
+import tensorflow as tf
+
+class ScalarAggregator():
+    """
+    Aggregates scalars in memory and writes their means to a summary writer
+    once every flush_every steps, instead of one tf.Summary per value.
+
+    Args:
+        summary_writer: A tf.summary.FileWriter
+        flush_every: Minimum number of steps between two writes
+    """
+    def __init__(self, summary_writer, flush_every=100):
+        self.summary_writer = summary_writer
+        self.flush_every = flush_every
+        self.sums = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.last_flush_step = None
+
+    def record(self, tag, value):
+        self.sums[tag] += value
+        self.counts[tag] += 1
+
+    def maybe_flush(self, step):
+        if self.last_flush_step is None or step - self.last_flush_step >= self.flush_every:
+            self.flush(step)
+
+    def flush(self, step):
+        self.last_flush_step = step
+        if not self.counts:
+            return
+        summary = tf.Summary()
+        for tag, count in self.counts.items():
+            summary.value.add(simple_value=self.sums[tag] / count, tag=tag)
+        self.summary_writer.add_summary(summary, step)
+        self.sums.clear()
+        self.counts.clear()
+
+
+class AsyncCheckpointer():
+    """
+    Saves checkpoints from a background thread, every every_steps steps
+    and/or every every_seconds seconds. A save that is due while the previous
+    one is still being written is skipped. As training goes on during a save,
+    variables may come from slightly different steps.
+
+    Args:
+        saver: A tf.train.Saver
+        sess: The Tensorflow session to save
+        checkpoint_path: Path prefix of the checkpoints
+        every_steps: If set, save every N steps
+        every_seconds: If set, save every N seconds
+    """
+    def __init__(self, saver, sess, checkpoint_path, every_steps=None, every_seconds=600):
+        self.saver = saver
+        self.sess = sess
+        self.checkpoint_path = checkpoint_path
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.last_save_step = None
+        self.last_save_time = time.time()
+        self.thread = None
+
+    def _due(self, step):
+        if self.last_save_step is None:
+            return True
+        if self.every_steps is not None and step - self.last_save_step >= self.every_steps:
+            return True
+        if self.every_seconds is not None and time.time() - self.last_save_time >= self.every_seconds:
+            return True
+        return False
+
+    def maybe_save(self, step):
+        if not self._due(step) or (self.thread is not None and self.thread.is_alive()):
+            return False
+        self.last_save_step = step
+        self.last_save_time = time.time()
+        self.thread = threading.Thread(target=self.saver.save, args=(self.sess, self.checkpoint_path))
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def close(self, step=None):
+        """
+        Waits for a pending save. If step is given, saves a last checkpoint synchronously.
+        """
+        if self.thread is not None:
+            self.thread.join()
+        if step is not None:
+            self.saver.save(self.sess, self.checkpoint_path)
+            self.last_save_step = step
@@ -1,3 +1,5 @@
+import os
+import warnings
 import matplotlib
 import numpy as np
 import pandas as pd
@@ -7,11 +9,47 @@ from mpl_toolkits.mplot3d import Axes3D
 
 EpisodeStats = namedtuple("Stats",["episode_lengths", "episode_rewards"])
 
-def plot_cost_to_go_mountain_car(env, estimator, num_tiles=20):
+def _finish_figure(fig, noshow=False, filename=None):
+    """
+    Shows the figure, or saves it to filename and closes it for headless use.
+    """
+    if filename is not None:
+        fig.savefig(filename)
+        plt.close(fig)
+    elif noshow:
+        plt.close(fig)
+    else:
+        plt.show()
+
+
+def _suffixed(filename, suffix):
+    if filename is None:
+        return None
+    root, ext = os.path.splitext(filename)
+    return "{}_{}{}".format(root, suffix, ext or ".png")
+
+
+def predict_grid(estimator, states, chunk_size=10000):
+    """
+    Predicts the action values of an [N, D] array of states. Estimators with
+    a predict_batch(states) method returning [N, nA] values, e.g.
+    lib.function_approximation.Estimator, are called on chunks of at most
+    chunk_size states, others once per state with predict.
+    """
+    if not hasattr(estimator, "predict_batch"):
+        warnings.warn("The estimator has no predict_batch method, calling predict on each of "
+                      "the {} states".format(len(states)))
+        return np.array([estimator.predict(s) for s in states])
+    return np.concatenate([estimator.predict_batch(states[i:i + chunk_size])
+                           for i in range(0, len(states), chunk_size)])
+
+
+def plot_cost_to_go_mountain_car(env, estimator, num_tiles=20, chunk_size=10000, noshow=False, filename=None):
     x = np.linspace(env.observation_space.low[0], env.observation_space.high[0], num=num_tiles)
     y = np.linspace(env.observation_space.low[1], env.observation_space.high[1], num=num_tiles)
     X, Y = np.meshgrid(x, y)
-    Z = np.apply_along_axis(lambda _: -np.max(estimator.predict(_)), 2, np.dstack([X, Y]))
+    states = np.stack([X.ravel(), Y.ravel()], axis=1)
+    Z = -np.max(predict_grid(estimator, states, chunk_size), axis=1).reshape(X.shape)
 
     fig = plt.figure(figsize=(10, 5))
     ax = fig.add_subplot(111, projection='3d')
@@ -22,27 +60,43 @@ def plot_cost_to_go_mountain_car(env, estimator, num_tiles=20):
     ax.set_zlabel('Value')
     ax.set_title("Mountain \"Cost To Go\" Function")
     fig.colorbar(surf)
-    plt.show()
+    _finish_figure(fig, noshow, filename)
+    return fig
 
 
-def plot_value_function(V, title="Value Function"):
+def plot_value_function(V, title="Value Function", counts=None, noshow=False, filename=None):
     """
     Plots the value function as a surface plot.
+
+    V is either a dict from (player sum, dealer showing, usable ace) to value,
+    or an array indexed the same way, e.g. from blackjack_batch.mc_prediction.
+    For an array, the plotted range covers the states with non-zero counts,
+    the visit counts returned alongside V, or the whole array without them.
+    With filename, the two plots are saved to files with a _no_usable_ace /
+    _usable_ace suffix.
     """
-    min_x = min(k[0] for k in V.keys())
-    max_x = max(k[0] for k in V.keys())
-    min_y = min(k[1] for k in V.keys())
-    max_y = max(k[1] for k in V.keys())
+    if isinstance(V, np.ndarray):
+        visited = np.ones(V.shape, dtype=bool) if counts is None else (np.asarray(counts) > 0)
+        if not visited.any():
+            raise ValueError("No state was visited")
+        xs, ys, _ = np.nonzero(visited)
+    else:
+        xs = np.array([k[0] for k in V.keys()])
+        ys = np.array([k[1] for k in V.keys()])
 
-    x_range = np.arange(min_x, max_x + 1)
-    y_range = np.arange(min_y, max_y + 1)
+    x_range = np.arange(xs.min(), xs.max() + 1)
+    y_range = np.arange(ys.min(), ys.max() + 1)
     X, Y = np.meshgrid(x_range, y_range)
 
     # Find value for all (x, y) coordinates
-    Z_noace = np.apply_along_axis(lambda _: V[(_[0], _[1], False)], 2, np.dstack([X, Y]))
-    Z_ace = np.apply_along_axis(lambda _: V[(_[0], _[1], True)], 2, np.dstack([X, Y]))
+    if isinstance(V, np.ndarray):
+        Z_noace = V[X, Y, 0]
+        Z_ace = V[X, Y, 1]
+    else:
+        Z_noace = np.array([V.get((x, y, False), 0.0) for x, y in zip(X.ravel(), Y.ravel())]).reshape(X.shape)
+        Z_ace = np.array([V.get((x, y, True), 0.0) for x, y in zip(X.ravel(), Y.ravel())]).reshape(X.shape)
 
-    def plot_surface(X, Y, Z, title):
+    def plot_surface(X, Y, Z, title, filename):
         fig = plt.figure(figsize=(20, 10))
         ax = fig.add_subplot(111, projection='3d')
         surf = ax.plot_surface(X, Y, Z, rstride=1, cstride=1,
@@ -53,24 +107,22 @@ def plot_value_function(V, title="Value Function"):
         ax.set_title(title)
         ax.view_init(ax.elev, -120)
         fig.colorbar(surf)
-        plt.show()
-
-    plot_surface(X, Y, Z_noace, "{} (No Usable Ace)".format(title))
-    plot_surface(X, Y, Z_ace, "{} (Usable Ace)".format(title))
+        _finish_figure(fig, noshow, filename)
+        return fig
 
+    fig1 = plot_surface(X, Y, Z_noace, "{} (No Usable Ace)".format(title), _suffixed(filename, "no_usable_ace"))
+    fig2 = plot_surface(X, Y, Z_ace, "{} (Usable Ace)".format(title), _suffixed(filename, "usable_ace"))
+    return fig1, fig2
 
 
-def plot_episode_stats(stats, smoothing_window=10, noshow=False):
+def plot_episode_stats(stats, smoothing_window=10, noshow=False, filename=None):
     # Plot the episode length over time
     fig1 = plt.figure(figsize=(10,5))
     plt.plot(stats.episode_lengths)
     plt.xlabel("Episode")
     plt.ylabel("Episode Length")
     plt.title("Episode Length over Time")
-    if noshow:
-        plt.close(fig1)
-    else:
-        plt.show(fig1)
+    _finish_figure(fig1, noshow, _suffixed(filename, "length"))
 
     # Plot the episode reward over time
     fig2 = plt.figure(figsize=(10,5))
@@ -79,10 +131,7 @@ def plot_episode_stats(stats, smoothing_window=10, noshow=False):
     plt.xlabel("Episode")
     plt.ylabel("Episode Reward (Smoothed)")
     plt.title("Episode Reward over Time (Smoothed over window size {})".format(smoothing_window))
-    if noshow:
-        plt.close(fig2)
-    else:
-        plt.show(fig2)
+    _finish_figure(fig2, noshow, _suffixed(filename, "reward"))
 
     # Plot time steps and episode number
     fig3 = plt.figure(figsize=(10,5))
@@ -90,9 +139,6 @@ def plot_episode_stats(stats, smoothing_window=10, noshow=False):
     plt.xlabel("Time Steps")
     plt.ylabel("Episode")
     plt.title("Episode per time step")
-    if noshow:
-        plt.close(fig3)
-    else:
-        plt.show(fig3)
+    _finish_figure(fig3, noshow, _suffixed(filename, "time"))
 
     return fig1, fig2, fig3
@@ -0,0 +1,158 @@
+# Same tabular Q-learning as q_learning.py, but run on thousands of episodes at once.
+# The Taxi dynamics are read once from env.P into dense arrays, then every
+# episode of the batch takes its epsilon-greedy step together with NumPy.
+# When several episodes update the same (state, action) in one step, the
+# update uses the mean of their targets.
+
+import argparse
+import itertools
+import time
+
+import gym
+import numpy as np
+
+
+def extract_tables(env):
+    """
+    Reads the deterministic dynamics of a gym DiscreteEnv such as Taxi-v3.
+
+    Returns:
+        next_states, rewards, dones: [nS, nA] arrays
+        initial_distribution: [nS] distribution of the initial state
+    """
+    nS, nA = env.observation_space.n, env.action_space.n
+    next_states = np.zeros((nS, nA), dtype=np.int64)
+    rewards = np.zeros((nS, nA), dtype=np.float64)
+    dones = np.zeros((nS, nA), dtype=np.bool_)
+    for s in range(nS):
+        for a in range(nA):
+            (prob, next_state, reward, done), = env.P[s][a]
+            assert prob == 1.0, "Only deterministic environments are supported"
+            next_states[s, a] = next_state
+            rewards[s, a] = reward
+            dones[s, a] = done
+    initial_distribution = getattr(env, 'initial_state_distrib', None)
+    if initial_distribution is None:
+        initial_distribution = env.isd
+    return next_states, rewards, dones, np.asarray(initial_distribution, dtype=np.float64)
+
+
+def batched_q_learning(tables, num_episodes, batch_size=1024, alpha=0.1, gamma=0.6,
+                       epsilon=0.1, max_steps=10000, seed=0):
+    """
+    Runs num_episodes episodes of Q-learning, batch_size of them at a time.
+
+    Returns:
+        q_table, and the number of steps and penalties of every episode
+    """
+    next_states, rewards, dones, initial_distribution = tables
+    nS, nA = next_states.shape
+    rng = np.random.default_rng(seed)
+    q_table = np.zeros((nS, nA))
+    q_flat = q_table.reshape(-1)
+
+    batch_size = min(batch_size, num_episodes)
+    states = rng.choice(nS, size=batch_size, p=initial_distribution)
+    episode_ids = np.arange(batch_size)
+    launched = batch_size
+    steps = np.zeros(batch_size, dtype=np.int64)
+    penalties = np.zeros(batch_size, dtype=np.int64)
+    all_epochs = np.zeros(num_episodes, dtype=np.int64)
+    all_penalties = np.zeros(num_episodes, dtype=np.int64)
+
+    while len(states):
+        # Epsilon-greedy actions for all episodes
+        actions = np.argmax(q_table[states], axis=1)
+        explore = rng.random(len(states)) < epsilon
+        actions[explore] = rng.integers(nA, size=explore.sum())
+
+        next_s = next_states[states, actions]
+        reward = rewards[states, actions]
+        done = dones[states, actions]
+
+        # Q-learning targets, averaged over episodes updating the same entry
+        targets = reward + gamma * np.max(q_table[next_s], axis=1) * ~done
+        flat = states * nA + actions
+        sums = np.bincount(flat, weights=targets, minlength=nS * nA)
+        counts = np.bincount(flat, minlength=nS * nA)
+        updated = counts > 0
+        q_flat[updated] += alpha * (sums[updated] / counts[updated] - q_flat[updated])
+
+        steps += 1
+        penalties += reward == -10
+        states = next_s
+
+        # Record finished episodes and start new ones in their place
+        finished = done | (steps >= max_steps)
+        if finished.any():
+            all_epochs[episode_ids[finished]] = steps[finished]
+            all_penalties[episode_ids[finished]] = penalties[finished]
+            n_new = min(finished.sum(), num_episodes - launched)
+            restart = np.flatnonzero(finished)[:n_new]
+            states[restart] = rng.choice(nS, size=n_new, p=initial_distribution)
+            episode_ids[restart] = np.arange(launched, launched + n_new)
+            steps[restart] = 0
+            penalties[restart] = 0
+            launched += n_new
+            keep = ~finished
+            keep[restart] = True
+            states, episode_ids, steps, penalties = \
+                states[keep], episode_ids[keep], steps[keep], penalties[keep]
+
+    return q_table, all_epochs, all_penalties
+
+
+def evaluate(tables, q_table, episodes=100, max_steps=1000, seed=0):
+    """
+    Runs the greedy policy of q_table on a batch of episodes.
+
+    Returns:
+        average timesteps and penalties per episode
+    """
+    next_states, rewards, dones, initial_distribution = tables
+    rng = np.random.default_rng(seed)
+    states = rng.choice(len(q_table), size=episodes, p=initial_distribution)
+    active = np.ones(episodes, dtype=np.bool_)
+    epochs = np.zeros(episodes, dtype=np.int64)
+    penalties = np.zeros(episodes, dtype=np.int64)
+    for _ in range(max_steps):
+        actions = np.argmax(q_table[states], axis=1)
+        reward = rewards[states, actions]
+        epochs += active
+        penalties += active & (reward == -10)
+        active &= ~dones[states, actions]
+        states = next_states[states, actions]
+        if not active.any():
+            break
+    return epochs.mean(), penalties.mean()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_episodes', type=int, default=100000)
+    parser.add_argument('--batch_size', type=int, default=1024)
+    # several values run a sweep over all combinations
+    parser.add_argument('--alpha', type=float, nargs='+', default=[0.1])
+    parser.add_argument('--gamma', type=float, nargs='+', default=[0.6])
+    parser.add_argument('--epsilon', type=float, nargs='+', default=[0.1])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    env = gym.make('Taxi-v3').env
+    tables = extract_tables(env)
+
+    for alpha, gamma, epsilon in itertools.product(args.alpha, args.gamma, args.epsilon):
+        start = time.time()
+        q_table, all_epochs, all_penalties = batched_q_learning(
+            tables, args.num_episodes, args.batch_size,
+            alpha=alpha, gamma=gamma, epsilon=epsilon, seed=args.seed)
+        eval_epochs, eval_penalties = evaluate(tables, q_table, seed=args.seed)
+        print(f"alpha={alpha} gamma={gamma} epsilon={epsilon}: "
+              f"trained in {time.time() - start:.1f}s, "
+              f"average penalties per training episode {all_penalties.mean():.3f}, "
+              f"average timesteps per eval episode {eval_epochs:.2f}, "
+              f"average penalties per eval episode {eval_penalties:.2f}")
+
+
+if __name__ == '__main__':
+    main()